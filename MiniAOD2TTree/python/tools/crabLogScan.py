@@ -0,0 +1,219 @@
+## \package crabLogScan
+# Fast scanning of CRAB job log tarballs (cmsRun_N.log.tar.gz)
+#
+# The exit code of a job ("process id is N status is M") is printed at
+# the end of the cmsRun-stdout log, so each tarball is streamed once and
+# only the tail of the log member is searched. The log files of a task
+# can be scanned in a process pool, and the results are cached in the
+# task directory (keyed by the log file size and mtime), so that
+# repeated merge attempts skip the logs that were already checked.
+#
+# Used by hplusMergeHistograms.py and hplusMergeOutput.py.
+
+import os
+import re
+import json
+import tarfile
+import multiprocessing
+
+## Number of bytes at the end of the cmsRun-stdout log searched for the exit code
+tailBytes = 64*1024
+
+## Name of the cache file written to the cache directory
+cacheFileName = ".crabLogScanCache.json"
+
+_log_re      = re.compile("cmsRun-stdout-(?P<job>\d+)\.log")
+_exitCode_re = re.compile("process\s+id\s+is\s+\d+\s+status\s+is\s+(?P<exitcode>\d+)")
+
+## Search lines (last one first) for the exit code
+#
+# \return exit code, or None if not found
+def _findExitCode(lines):
+    for line in reversed(lines):
+        m = _exitCode_re.search(line)
+        if m:
+            return int(m.group("exitcode"))
+    return None
+
+## Scan a single log tarball
+#
+# \param logFile   Path to the cmsRun_N.log.tar.gz file
+#
+# \return tuple (logFile, jobId, exitCode), where jobId is the job id of
+# the cmsRun-stdout log member (None if the file is not a tarball or
+# has no such member) and exitCode is -1 if no exit code was found
+def scanLogFile(logFile):
+    if not tarfile.is_tarfile(logFile):
+        return (logFile, None, -1)
+
+    jobId    = None
+    exitCode = None
+    truncated = False
+    fIN = tarfile.open(logFile, "r|*") # stream, the tarball is decompressed only once
+    for member in fIN:
+        match = _log_re.search(member.name)
+        if not match or not member.isfile():
+            continue
+        jobId = match.group("job")
+        # Read the member in chunks keeping only the tail
+        f    = fIN.extractfile(member)
+        tail = ""
+        while True:
+            chunk = f.read(1024*1024)
+            if not chunk:
+                break
+            truncated = truncated or len(tail) + len(chunk) > tailBytes
+            tail = (tail + chunk)[-tailBytes:]
+        lines = tail.split("\n")
+        if truncated:
+            lines = lines[1:] # first line may be partial
+        exitCode = _findExitCode(lines)
+        break
+    fIN.close()
+
+    # Exit code not within the tail, read the full log
+    if jobId != None and exitCode == None and truncated:
+        fIN = tarfile.open(logFile)
+        for member in fIN.getmembers():
+            if _log_re.search(member.name) and member.isfile():
+                exitCode = _findExitCode(fIN.extractfile(member).readlines())
+                break
+        fIN.close()
+
+    if exitCode == None:
+        exitCode = -1
+    return (logFile, jobId, exitCode)
+
+## Cache of the log scan results of one directory
+class LogScanCache:
+    def __init__(self, cacheDir):
+        self._fileName = None
+        self._entries  = {}
+        self._modified = False
+        if cacheDir == None:
+            return
+        self._fileName = os.path.join(cacheDir, cacheFileName)
+        if os.path.exists(self._fileName):
+            try:
+                f = open(self._fileName)
+                self._entries = json.load(f)
+                f.close()
+            except (IOError, ValueError):
+                self._entries = {}
+
+    def _stat(self, logFile):
+        try:
+            st = os.stat(logFile)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime]
+
+    ## Return cached (jobId, exitCode), or None if the log file has changed or was not scanned
+    def get(self, logFile):
+        entry = self._entries.get(logFile, None)
+        if entry == None:
+            return None
+        stat = self._stat(logFile)
+        if stat == None or entry["stat"] != stat:
+            return None
+        return (entry["jobId"], entry["exitCode"])
+
+    def set(self, logFile, jobId, exitCode):
+        stat = self._stat(logFile)
+        if stat == None:
+            return
+        self._entries[logFile] = {"stat": stat, "jobId": jobId, "exitCode": exitCode}
+        self._modified = True
+
+    ## Write the cache (failures are ignored, the cache is just an optimisation)
+    def save(self):
+        if self._fileName == None or not self._modified:
+            return
+        tmpName = self._fileName + ".tmp%d" % os.getpid()
+        try:
+            f = open(tmpName, "w")
+            json.dump(self._entries, f)
+            f.close()
+            os.rename(tmpName, self._fileName)
+        except (IOError, OSError):
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            return
+        self._modified = False
+
+## Scan the log tarballs of a task
+#
+# \param logFiles   List of cmsRun_N.log.tar.gz paths
+# \param cacheDir   Directory for the cache file (None to disable caching)
+# \param workers    Number of worker processes
+# \param progress   Optional function called as progress(index, logFile) when a file is done
+#
+# \return dictionary logFile -> (jobId, exitCode), see scanLogFile()
+def scanLogFiles(logFiles, cacheDir=None, workers=1, progress=None):
+    cache   = LogScanCache(cacheDir)
+    results = {}
+    toScan  = []
+    for f in logFiles:
+        cached = cache.get(f)
+        if cached == None:
+            toScan.append(f)
+        else:
+            results[f] = cached
+
+    # Progress of the cached files
+    index = 0
+    if progress != None:
+        for f in logFiles:
+            if f in results:
+                progress(index, f)
+                index += 1
+
+    pool = None
+    if workers > 1 and len(toScan) > 1:
+        pool    = multiprocessing.Pool(min(workers, len(toScan)))
+        scanned = pool.imap_unordered(scanLogFile, toScan, max(1, len(toScan)/(4*workers)))
+    else:
+        scanned = (scanLogFile(f) for f in toScan)
+    try:
+        for (f, jobId, exitCode) in scanned:
+            results[f] = (jobId, exitCode)
+            cache.set(f, jobId, exitCode)
+            if progress != None:
+                progress(index, f)
+            index += 1
+    finally:
+        if pool != None:
+            pool.terminate()
+            pool.join()
+        cache.save()
+    return results
+
+## Scan the log tarballs of a CRAB task directory
+#
+# \param taskDir    CRAB task directory, the cache is stored in its results/ subdirectory (if it exists)
+# \param logFiles   List of cmsRun_N.log.tar.gz paths
+# \param workers    Number of worker processes
+# \param progress   Optional function called as progress(index, logFile) when a file is done
+#
+# \return dictionary logFile -> (jobId, exitCode), see scanLogFile()
+def scanTaskLogFiles(taskDir, logFiles, workers=1, progress=None):
+    cacheDir = os.path.join(taskDir, "results")
+    if not os.path.isdir(cacheDir):
+        cacheDir = None
+    return scanLogFiles(logFiles, cacheDir, workers, progress)
+
+## Return the output ROOT file of a job from the job id found by the log scan
+#
+# \param logFile     Path to the cmsRun_N.log.tar.gz file of the job
+# \param jobId       Job id from scanLogFile() (not None)
+# \param filesInEOS  If True, return the path in the task output directory on EOS (not checked for existence)
+#
+# \return miniaod2tree_<jobId>.root (relative to the directory of the
+# log file unless \a filesInEOS), or None if the file does not exist
+def getHistogramFileFromJobId(logFile, jobId, filesInEOS=False):
+    histoFile = "miniaod2tree_%s.root" % (jobId)
+    if filesInEOS:
+        return logFile.rsplit("/", 2)[0] + "/" + histoFile
+    if os.path.exists(os.path.join(os.path.dirname(logFile), histoFile)):
+        return histoFile
+    return None
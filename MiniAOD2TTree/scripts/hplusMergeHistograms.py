@@ -33,12 +33,18 @@ import tarfile
 import getpass
 import socket
 import time
+import traceback
+import itertools
+import Queue
+import multiprocessing
+import multiprocessing.pool
 
 import ROOT
 ROOT.gROOT.SetBatch(True)
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 import HiggsAnalysis.NtupleAnalysis.tools.multicrab as multicrab
+import HiggsAnalysis.MiniAOD2TTree.tools.crabLogScan as crabLogScan
 from HiggsAnalysis.NtupleAnalysis.tools.ShellStyles import *
 
 #================================================================================================
@@ -1442,6 +1448,203 @@ def MergeFiles(mergeName, inputFiles, opts):
             os.system("chmod u+r,g+r,o+r %s"%mergeName)
     return ret
 
+class MergeJob:
+    '''
+    Merging of one split group of a task into one merged ROOT file.
+
+    With tree reduction (--haddFanIn) the input files are merged in
+    steps of at most haddFanIn files through temporary partial merge
+    files, until one step produces the merged file.
+    '''
+    def __init__(self, taskName, taskNameAndNum, mergeName, inputFiles):
+        self.taskName       = taskName
+        self.taskNameAndNum = taskNameAndNum.replace("/", "")
+        self.mergeName      = mergeName
+        self.inputFiles     = inputFiles
+        self.level          = 0
+        self.stepInputs     = inputFiles # input files of the current step
+        self.stepOutputs    = []         # output files of the current step
+        self.nRunning       = 0
+        self.mergeTime      = 0.0
+        self.mergeFileSize  = None
+        self.done           = False
+        return
+
+    def GetSteps(self, fanIn):
+        '''
+        Returns a list of (mergeName, inputFiles) tuples for the merges of the current step
+        '''
+        if fanIn < 2 or len(self.stepInputs) <= fanIn:
+            steps = [(self.mergeName, self.stepInputs)]
+        else:
+            steps   = []
+            dirName = os.path.dirname(self.mergeName)
+            for i in range(0, len(self.stepInputs), fanIn):
+                partName = os.path.join(dirName, "partialMerge-L%d-%d-%s.root" % (self.level, i/fanIn, self.taskNameAndNum))
+                steps.append( (partName, self.stepInputs[i:i+fanIn]) )
+        self.stepOutputs = [x[0] for x in steps]
+        self.nRunning    = len(steps)
+        return steps
+
+    def IsPartial(self, fileName):
+        return fileName != self.mergeName
+
+
+def RemoveFiles(fileList, opts):
+    '''
+    Silently removes the given files (used for the temporary partial merge files)
+    '''
+    Verbose("RemoveFiles()")
+    if opts.test:
+        return
+    for f in fileList:
+        if opts.filesInEOS:
+            Execute(ConvertCommandToEOS("rm", opts) + " " + f)
+        elif os.path.exists(f):
+            os.remove(f)
+    return
+
+
+def MergeWorker(args):
+    '''
+    Runs one merge (hadd/xrdcp/cp) of a merge job. Called in a worker thread.
+    Returns a (job, mergeName, ret, mergeTime, error) tuple.
+    '''
+    job, mergeName, inputFiles = args
+    time_start = time.time()
+    try:
+        # Left-overs of an interrupted tree reduction would make hadd fail
+        if job.IsPartial(mergeName) and FileExists(mergeName, opts):
+            RemoveFiles([mergeName], opts)
+        ret   = MergeFiles(mergeName, inputFiles, opts)
+        error = None
+    except:
+        ret   = 1
+        error = traceback.format_exc()
+    return (job, mergeName, ret, time.time()-time_start, error)
+
+
+def RunMergeJobs(mergeJobs, opts):
+    '''
+    Runs the merge jobs of all tasks with a pool of opts.workers threads
+    (the merging itself is done by hadd/xrdcp subprocesses). The split groups
+    of a task are independent jobs, so they are merged concurrently too.
+    The sanity check, file size and --deleteImmediately are done in the
+    main thread once a job is done.
+
+    Returns 0 on success, otherwise the return value of the failed merge.
+    '''
+    Verbose("RunMergeJobs()", True)
+    if len(mergeJobs) < 1:
+        return 0
+
+    nWorkers = min(max(opts.workers, 1), len(mergeJobs))
+    Verbose("Merging %d file(s) with %d worker(s)" % (len(mergeJobs), nWorkers), True)
+
+    # Per-task progress
+    nJobs = {}
+    nDone = {}
+    for job in mergeJobs:
+        nJobs[job.taskName] = nJobs.get(job.taskName, 0) + 1
+        nDone[job.taskName] = 0
+
+    pool    = multiprocessing.pool.ThreadPool(nWorkers)
+    results = Queue.Queue()
+    def Submit(job):
+        steps = job.GetSteps(opts.haddFanIn)
+        for mergeName, inputFiles in steps:
+            pool.apply_async(MergeWorker, [(job, mergeName, inputFiles)], callback=results.put)
+        return len(steps)
+
+    nRunning = 0
+    for job in mergeJobs:
+        nRunning += Submit(job)
+
+    ret = 0
+    while nRunning > 0:
+        job, mergeName, stepRet, dtMerge, error = results.get()
+        nRunning      -= 1
+        job.nRunning  -= 1
+        job.mergeTime += dtMerge
+        if error != None or stepRet != 0:
+            if error != None:
+                print error
+            Verbose("MergeFiles() returned %s" % (stepRet))
+            Print("%s, merging %s failed" % (job.taskName, mergeName), True)
+            ret = max(stepRet, 1)
+            continue
+        Verbose("MergeFiles() returned %s" % (stepRet) )
+
+        # Do not start anything new after a failure; just wait for the running merges
+        if ret != 0 or job.nRunning > 0:
+            continue
+
+        # The step is done: remove the partial files it consumed and start the next step
+        if job.level > 0:
+            RemoveFiles(job.stepInputs, opts)
+        if job.stepOutputs != [job.mergeName]:
+            job.stepInputs = job.stepOutputs
+            job.level     += 1
+            nRunning      += Submit(job)
+            continue
+
+        # The merge job is done
+        job.done = True
+        nDone[job.taskName] += 1
+
+        # Get the file size
+        job.mergeFileSize = GetFileSize(job.mergeName, opts)
+        if nJobs[job.taskName] > 1 and not job.mergeFileSize == None:
+            Verbose("Merged %s (%0.3f GB)." % (job.mergeName, job.mergeFileSize), False )
+
+        # Sanity check
+        CheckControlHisto(job.taskName, job.mergeName, job.inputFiles)
+
+        # Delete all input files after merging them
+        if opts.deleteImmediately:
+            DeleteFiles(job.taskName, job.mergeName, job.inputFiles, opts)
+
+        # Update Progress bar
+        mergeFile = os.path.basename(job.mergeName)
+        firstFile = os.path.basename(job.inputFiles[0])
+        lastFile  = os.path.basename(job.inputFiles[-1])
+        PrintProgressBar(job.taskName + ", Merge  ", nDone[job.taskName]-1, nJobs[job.taskName], "[" + mergeFile + " using %s files: %s to %s]" % (len(job.inputFiles), firstFile, lastFile) )
+        if nDone[job.taskName] == nJobs[job.taskName]:
+            FinishProgressBar()
+
+    pool.close()
+    pool.join()
+    return ret
+
+
+def CleanMergedFile(args):
+    '''
+    Deletes the duplicate folders from a merged file, deletes its source files
+    (--delete) and writes the pile-up histograms. The files are opened in UPDATE
+    mode with ROOT, so with several workers this runs in a worker process.
+    Returns a (mergeFile, cleanTime, error) tuple.
+    '''
+    f, taskName, sourceFiles, foldersToDelete = args
+    try:
+        # Delete folders & Calculate the clean-time (in seconds)
+        Verbose("%s [from %d file(s)]" % (f, len(sourceFiles)), True)
+        time_start = time.time()
+        DeleteFolders(f, foldersToDelete, opts)
+        time_end = time.time()
+        dtClean  = (time_end-time_start)
+
+        # Delete files after merging?
+        if opts.delete and not opts.deleteImmediately:
+            DeleteFiles(taskName, f, sourceFiles, opts)
+
+        # Add pile-up histos
+        WritePileupHistos(f, opts)
+    except:
+        # Catch also sys.exit() calls, they would kill the worker process
+        return (f, 0.0, traceback.format_exc())
+    return (f, dtClean, None)
+
+
 def PrintSummary(taskReports):
     '''
     Self explanatory
@@ -1529,18 +1732,30 @@ def GetTaskOutputAndExitCodes(taskName, stdoutFiles, opts):
     jobId_re   = re.compile("cmsRun_(?P<jobId>\d+)\.log\.tar\.gz")  #re.compile("/results/cmsRun_(?P<jobId>\d+)\.log\.tar\.gz")
     Verbose("Getting output files & exit codes for task %s" % (taskName) )
 
+    # Read the job ids and exit codes of all log files
+    def progress(index, f):
+        PrintProgressBar(taskName + ", Logs   ", index, len(stdoutFiles), "[" + os.path.basename(f) + "]")
+    scanResults = crabLogScan.scanTaskLogFiles(taskName, stdoutFiles, opts.workers, progress)
+    if len(stdoutFiles)>0:
+        FinishProgressBar()
+
     # For-loop: All stdout files of given task
     for index, f in enumerate(stdoutFiles):
 
         Verbose("Getting output files & exit codes for task %s (by reading %s)" % (taskName, f) )
-        histoFile = GetHistogramFile(taskName, f, opts)
+        jobId, exitcode = scanResults[f]
+        if jobId == None:
+            histoFile = GetHistogramFile(taskName, f, opts)
+        else:
+            histoFile = crabLogScan.getHistogramFileFromJobId(f, jobId, opts.filesInEOS)
         if histoFile != None:
             files.append(histoFile)
         else:
             missing += 1
             Verbose("Task %s, skipping job %s: input root file not found from stdout" % (taskName, os.path.basename(f)) )
 
-        exitcode = CheckTaskReport(f, opts)
+        if opts.skipVerify:
+            exitcode = 0
         if exitcode != 0:
             exit_match = jobId_re.search(f)
             if exit_match:
@@ -1969,12 +2184,14 @@ def main(opts, args):
     exit_re = re.compile("/results/cmsRun_(?P<exitcode>\d+)\.log\.tar\.gz")
     
     # Definitions
-    filesExist   = 0
     taskReports  = {}
     mergeFileMap = {}
     mergeSizeMap = {}
     mergeTimeMap = {}
     cleanTime    = {}
+    mergeJobs    = []
+    taskMergeDirs = {} # task name -> directory of the merged files (reports created after the merging)
+    time_begin   = time.time()
 
     # For-loop: All task names
     Verbose("Looping over all tasks in %s" % (opts.dirName), True)
@@ -2033,9 +2250,8 @@ def main(opts, args):
                         pass
 
                 Verbose("%s, skipping, some files are missing" % (taskName) )
-                mergeFiles, mergeSizeMap, mergeTimeMap = GetPreexistingMergedFiles(os.path.dirname(files[0]), opts)
-                filesExist = len(mergeFiles)
-                taskReports[taskName]  = Report( taskName, mergeFileMap, mergeSizeMap, mergeTimeMap, filesExist)
+                mergeFiles, preSizeMap, preTimeMap = GetPreexistingMergedFiles(os.path.dirname(files[0]), opts)
+                taskReports[taskName]  = Report( taskName, {}, preSizeMap, preTimeMap, len(mergeFiles))
 
                 # Create symbolic links?
                 if opts.linksToEOS:
@@ -2090,17 +2306,13 @@ def main(opts, args):
             # If merge file already exists skip it or rename it as .backup
             if FileExists(mergeName, opts) and not opts.overwrite:
 
-                mergeFiles, mergeSizeMap, mergeTimeMap = GetPreexistingMergedFiles(os.path.dirname(files[0]), opts)
-                filesExist = len(mergeFiles)
-                taskReports[taskName]  = Report( taskName, mergeFileMap, mergeSizeMap, mergeTimeMap, filesExist)
-                filesExist += 1                
-            
                 # Delete input files?
                 if opts.delete:
                     DeleteFiles(taskName, mergeName, inputFiles, opts)
                                     
                 # Create symbolic links?
                 if opts.linksToEOS:
+                    mergeFiles, preSizeMap, preTimeMap = GetPreexistingMergedFiles(os.path.dirname(files[0]), opts)
                     mList = []
                     # For-loop: All merge files
                     for f in mergeFiles:
@@ -2111,73 +2323,54 @@ def main(opts, args):
             else:
                 Verbose("%s, merge file  %s does not already exist. Will create it" % (taskName, mergeName) )
 
-            # Merge the ROOT files
-            #mergePath = "/".join(mergeName.split("/")[-1:]) #fits terminal, [-6:] is too big to fit
-            mergeFile = os.path.basename(mergeName)
-            nInputs   = len(inputFiles)
-            firstFile = os.path.basename(inputFiles[0])
-            lastFile  = os.path.basename(inputFiles[-1])
-            PrintProgressBar(taskName + ", Merge  ", index-1, len(filesSplit), "[" + mergeFile + " using %s file(s): %s to %s]" % (nInputs, firstFile, lastFile) )
-
-            # Time the merging process
-            time_start = time.time()
-            ret = -1
-            cmd = GetMergeCommand(mergeName, inputFiles, opts)
-#            try:
-            ret = MergeFiles(mergeName, inputFiles, opts)
-#            except TimeoutError, e:
-#                dt_timeout = time.time() - time_start
-#                print
-#                msg  = "Timed-out (%.2f seconds) trying to create %s using %s files(s): %s to %s" % (dt_timeout, mergeFile, nInputs, firstFile, lastFile)
-#                Print(msg, True)
-#                Print("Command invoked was:\n" +  " ".join(cmd), False)
-                #for c in cmd:
-                #   print c
-#                sys.exit()
-
-            time_end = time.time()
-            dtMerge = time_end-time_start
-            if ret != 0:
-                Verbose("MergeFiles() returned %s" % (ret))
-                return ret
-            else:
-                Verbose("MergeFiles() returned %s" % (ret) )
-                pass
-
-            # Get the file size
-            mergeFileSize = GetFileSize(mergeName, opts)
-            if len(filesSplit) > 1 and not mergeFileSize == None:
-                Verbose("Merged %s (%0.3f GB)." % (mergeName, mergeFileSize), False )
-
-            # Keep track of merged files
-            mergeFileMap[mergeName] = inputFiles
-            mergeSizeMap[mergeName] = mergeFileSize
-            mergeTimeMap[mergeName] = dtMerge
-
-            # Sanity check
-            CheckControlHisto(taskName, mergeName, inputFiles)
-
-            # Delete all input files after merging them
-            if opts.deleteImmediately:
-                DeleteFiles(taskName, mergeName, inputFiles, opts)
-
-            # Update Progress bar
-            PrintProgressBar(taskName + ", Merge  ", index, len(filesSplit), "[" + mergeFile + " using %s files: %s to %s]" % (len(inputFiles), firstFile, lastFile) )            
-            #PrintProgressBar(taskName + ", Merge  ", index, len(filesSplit), "[" + mergePath + "]")
+            # Queue the merge (the merge jobs of all tasks are run concurrently, see RunMergeJobs())
+            mergeJobs.append( MergeJob(taskName, taskNameAndNum, mergeName, inputFiles) )
 
         # Flush stdout
         FinishProgressBar()
-        if taskName not in taskReports.keys():
-            taskReports[taskName] = Report( taskName, mergeFileMap, mergeSizeMap, mergeTimeMap, filesExist)
+
+        # The report is created once the merge jobs of all tasks are done
+        taskMergeDirs[taskName] = os.path.dirname(files[0])
 
     if opts.test:
         return
 
+    # Merge the files of all tasks
+    ret = RunMergeJobs(mergeJobs, opts)
+
+    # Keep track of merged files
+    mergeJobsPerTask = {}
+    for job in mergeJobs:
+        if not job.done:
+            continue
+        mergeFileMap[job.mergeName] = job.inputFiles
+        mergeSizeMap[job.mergeName] = job.mergeFileSize
+        mergeTimeMap[job.mergeName] = job.mergeTime
+        mergeJobsPerTask.setdefault(job.taskName, []).append(job)
+
+    # Create the task reports, counting the merged files of each task after the merging
+    for taskName, taskMergeDir in taskMergeDirs.items():
+        mergeFiles, preSizeMap, preTimeMap = GetPreexistingMergedFiles(taskMergeDir, opts)
+        if taskName in mergeJobsPerTask:
+            jobs = mergeJobsPerTask[taskName]
+            taskFileMap = dict([(job.mergeName, job.inputFiles) for job in jobs])
+            taskSizeMap = dict([(job.mergeName, job.mergeFileSize) for job in jobs])
+            taskTimeMap = dict([(job.mergeName, job.mergeTime) for job in jobs])
+            taskReports[taskName] = Report( taskName, taskFileMap, taskSizeMap, taskTimeMap, len(mergeFiles))
+        else:
+            taskReports[taskName] = Report( taskName, {}, preSizeMap, preTimeMap, len(mergeFiles))
+
+    if ret != 0:
+        return ret
+
     # Append "delete" message
     deleteMsg = GetDeleteMessage(opts)
     Verbose("Merged files%s:" % (deleteMsg), False)
     
     foldersToDelete = ["Generated", "Commit", "dataVersion"]
+    cleanArgs       = []
+    cleanTaskNames  = {} # merge file -> task name for printing
+    cleanTaskKeys   = {} # merge file -> task name for the clean times
     # For-loop: All merged files
     for index, key in enumerate(mergeFileMap.keys(), 0):
         f = key
@@ -2193,31 +2386,42 @@ def main(opts, args):
             PrintProgressBar(taskNameMapR[taskNameEOS] + ", Clean  ", 99, 100, "[Skipped because filesPerMerge=%s]" % (opts.filesPerMerge))
             break
 
-        # Delete folders & Calculate the clean-time (in seconds)
-        Verbose("%s [from %d file(s)]" % (f, len(sourceFiles)), True)
-        time_start = time.time()
-        DeleteFolders(f, foldersToDelete, opts)
-        time_end = time.time()
-        dtClean  = (time_end-time_start)
-        
+        cleanArgs.append( (f, taskName, sourceFiles, foldersToDelete) )
+        cleanTaskKeys[f] = taskName
+        if opts.filesInEOS:
+            cleanTaskNames[f] = taskNameMapR[taskNameEOS]
+        else:
+            cleanTaskNames[f] = taskName
+
+    # Clean the merged files (in worker processes, ROOT files are updated)
+    pool = None
+    if opts.workers > 1 and len(cleanArgs) > 1:
+        pool    = multiprocessing.Pool(min(opts.workers, len(cleanArgs)))
+        results = pool.imap_unordered(CleanMergedFile, cleanArgs)
+    else:
+        results = itertools.imap(CleanMergedFile, cleanArgs)
+
+    # For-loop: All cleaned files
+    for index, (f, dtClean, error) in enumerate(results, 0):
+        if error != None:
+            print error
+            if pool != None:
+                pool.terminate()
+            raise Exception("Cleaning of merged file %s failed" % (f) )
+        taskName = cleanTaskKeys[f]
+
         # Save the total clean time for this task
         if taskName not in cleanTime.keys():
             cleanTime[taskName] = dtClean 
         else:
             cleanTime[taskName] = cleanTime[taskName] + dtClean
-            
-        # Delete files after merging?
-        if opts.delete and not opts.deleteImmediately:
-            DeleteFiles(taskName, f, sourceFiles, opts)
-
-        # Add pile-up histos
-        WritePileupHistos(f, opts)
 
         # Update Progress bar
-        if opts.filesInEOS:
-            PrintProgressBar(taskNameMapR[taskNameEOS] + ", Clean ", index, len(mergeFileMap.keys()), "[" + os.path.basename(f) + "]")
-        else:
-            PrintProgressBar(taskName + ", Clean ", index, len(mergeFileMap.keys()), "[" + os.path.basename(f) + "]")            
+        PrintProgressBar(cleanTaskNames[f] + ", Clean ", index, len(cleanArgs), "[" + os.path.basename(f) + "]")
+
+    if pool != None:
+        pool.close()
+        pool.join()
 
     # Flush stdout
     FinishProgressBar()
@@ -2231,6 +2435,7 @@ def main(opts, args):
 
     # Print summary table using reports
     PrintSummary(taskReports)
+    Print("Merged %d file(s) with %d worker(s) in %0.3f min" % (len(mergeFileMap.keys()), opts.workers, (time.time()-time_begin)/60.0), True)
 
     return 0
 
@@ -2262,6 +2467,8 @@ if __name__ == "__main__":
     SKIPVERIFY    = False
     MAXFILESIZE   = 2.0
     DELETEFIRST   = False
+    WORKERS       = 1
+    HADDFANIN     = 0
 
     parser = OptionParser(usage="Usage: %prog [options]")
     # multicrab.addOptions(parser)
@@ -2316,6 +2523,12 @@ if __name__ == "__main__":
     parser.add_option("-m", "--maxFileSize", dest="maxFileSize", default=MAXFILESIZE, type="float",
                       help="The maximum file size (in GB) allowed for each merged ROOT file. [default: %s]" % (MAXFILESIZE))
 
+    parser.add_option("-w", "--workers", dest="workers", default=WORKERS, type="int",
+                      help="Number of merges (and merged-file clean-ups and job log scans) to run concurrently, across tasks and split groups. [default: %s]" % (WORKERS))
+
+    parser.add_option("--haddFanIn", dest="haddFanIn", default=HADDFANIN, type="int",
+                      help="Merge at most this many files with one hadd call; larger groups are merged in steps through temporary files (tree reduction). Use 0 to disable. [default: %s]" % (HADDFANIN))
+
     (opts, args) = parser.parse_args()
 
     if opts.dirName == "":
@@ -2324,6 +2537,12 @@ if __name__ == "__main__":
     if opts.filesPerMerge == 0:
         parser.error("--filesPerMerge must be non-zero")
 
+    if opts.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    if opts.haddFanIn == 1:
+        parser.error("--haddFanIn must be 0 (disabled) or at least 2")
+
     if opts.deleteMergedFilesFirst:
         msg  = "Are you sure you want to %spermanently delete%s all merged ROOT files of all CRAB tasks? " % (ErrorStyle(), NormalStyle())
         replyIsYes = AskUser(WarningLabel() + msg + NormalStyle(), True)
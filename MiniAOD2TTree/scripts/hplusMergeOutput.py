@@ -39,6 +39,7 @@ ROOT.gROOT.SetBatch(True)
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 import HiggsAnalysis.NtupleAnalysis.tools.multicrab as multicrab
+import HiggsAnalysis.MiniAOD2TTree.tools.crabLogScan as crabLogScan
 from HiggsAnalysis.NtupleAnalysis.tools.ShellStyles import *
 
 #================================================================================================
@@ -1656,11 +1657,22 @@ def GetTaskOutputAndExitCodes(taskName, logFiles, opts):
     jobId_re      = re.compile("cmsRun_(?P<jobId>\d+)\.log\.tar\.gz")
     Verbose("Getting output files & exit codes for task %s" % (taskName) )
 
+    # Read the job ids and exit codes of all log files
+    def progress(index, f):
+        PrintProgressBar("Scan job logs", index, len(logFiles), "[" + os.path.basename(f) + "]")
+    scanResults = crabLogScan.scanTaskLogFiles(taskName, logFiles, opts.workers, progress)
+    if len(logFiles)>0:
+        FinishProgressBar()
+
     # For-loop: All log files of given task
     for index, f in enumerate(logFiles):
 
-        # Find & extract tarball log file and extract the job-id to create the ROOT file name
-        histoFile = GetHistogramFile(taskName, f, opts)
+        # Use the job-id found in the log file tarball to create the ROOT file name
+        jobId, exitcode = scanResults[f]
+        if jobId == None:
+            histoFile = GetHistogramFile(taskName, f, opts)
+        else:
+            histoFile = crabLogScan.getHistogramFileFromJobId(f, jobId, opts.filesInEOS)
 
         if histoFile != None:
             filePath = DoNotUseFuseMount(histoFile)
@@ -1671,7 +1683,8 @@ def GetTaskOutputAndExitCodes(taskName, logFiles, opts):
             nMissingFiles += 1
             Verbose("Task %s, skipping job %s: input ROOT file not found from stdout" % (taskName, os.path.basename(f)) )
 
-        exitcode = CheckTaskReport(f, opts)
+        if opts.skipVerify:
+            exitcode = 0
         if exitcode != 0:
             exit_match = jobId_re.search(f)
             if exit_match:
@@ -2357,6 +2370,7 @@ if __name__ == "__main__":
     SKIPVERIFY    = False
     MAXFILESIZE   = 2.0
     DELETEFIRST   = False
+    WORKERS       = 1
 
     parser = OptionParser(usage="Usage: %prog [options]")
     # multicrab.addOptions(parser)
@@ -2411,6 +2425,9 @@ if __name__ == "__main__":
     parser.add_option("-m", "--maxFileSize", dest="maxFileSize", default=MAXFILESIZE, type="float",
                       help="The maximum file size (in GB) allowed for each merged ROOT file. [default: %s]" % (MAXFILESIZE))
 
+    parser.add_option("-w", "--workers", dest="workers", default=WORKERS, type="int",
+                      help="Number of processes used for scanning the job log files. [default: %s]" % (WORKERS))
+
     (opts, args) = parser.parse_args()
 
     if opts.dirName == "":
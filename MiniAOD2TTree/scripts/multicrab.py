@@ -20,6 +20,14 @@ or
 multicrab.py --status -i "QCD_bEnriched_HT300|2016B|2016E|2016F|2016G|ST_tW_antitop|ST_t_channel_top"
 
 
+Check Status (16 tasks queried in parallel, 5 min timeout per CRAB call, re-query also COMPLETED tasks):
+multicrab.py --status -j 16 --timeout 300 --noCache -d <task_dir>
+
+
+Check Status (test the status engine with "crab status" results read from a JSON file):
+multicrab.py --status --statusFile <file.json> -d <task_dir>
+
+
 Get Output:
 multicrab.py --get --ask -d <task_dir>
 
@@ -82,11 +90,14 @@ import os
 import re
 import sys
 import time
+import json
+import threading
 import datetime
 import subprocess
 import tarfile
 from optparse import OptionParser
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import getpass
 import socket
 
@@ -119,6 +130,10 @@ outputDirOnEOSMap = {}
 # A map pairing local <task-dir> path to EOS <task-dir> path
 taskDirOnEOSMap = {}
 
+# Name of the file (inside each <task-dir>) where the last task status snapshot is cached
+taskSnapshotFileName = ".multicrabStatus.json"
+taskSnapshotVersion  = 1
+
 #================================================================================================ 
 # Class Definition
 #================================================================================================ 
@@ -270,6 +285,121 @@ class Report:
         return status
 
 
+class TaskSnapshot:
+    def __init__(self, taskDir, status="UNKNOWN", dashboardURL="UNKNOWN", allJobs=0, idle=0, running=0, transferring=0, unknown=0,
+                 finished=[], failed=[], retrievedLog=[], retrievedOut=[], eosLog=0, eosOut=0, missingLogs=[], missingOuts=[]):
+        '''
+        Constructor
+
+        The status of a CRAB task as returned by "crab status" together with the
+        log and output files found for its jobs (locally and on EOS). The job-lists
+        contain the job ids (strings) as found in the "crab status" result.
+        '''
+        Verbose("class TaskSnapshot:__init__()", True)
+        self.taskDir      = taskDir
+        self.status       = status
+        self.dashboardURL = dashboardURL
+        self.allJobs      = allJobs
+        self.idle         = idle
+        self.running      = running
+        self.transferring = transferring
+        self.unknown      = unknown
+        self.finished     = list(finished)
+        self.failed       = list(failed)
+        self.retrievedLog = list(retrievedLog)
+        self.retrievedOut = list(retrievedOut)
+        self.eosLog       = eosLog
+        self.eosOut       = eosOut
+        self.missingLogs  = list(missingLogs)
+        self.missingOuts  = list(missingOuts)
+        return
+
+
+    def IsFinal(self):
+        '''
+        A task is final if it is COMPLETED, all its jobs finished successfully and
+        all logs and outputs have been retrieved. Nothing can change for such a task,
+        so its cached snapshot can be used instead of querying the CRAB server again.
+        '''
+        if self.status != "COMPLETED" or self.allJobs < 1:
+            return False
+        if len(self.failed) > 0:
+            return False
+        nJobs = [len(self.finished), len(self.retrievedLog), len(self.retrievedOut)]
+        return nJobs == [self.allJobs]*3
+
+
+    def GetDict(self):
+        d = dict(self.__dict__)
+        del d["taskDir"]
+        return d
+
+
+    def GetStamp(self):
+        '''
+        The files that change when something is done with the task (crab.log for
+        all CRAB commands, the results dir for retrieved/removed logs and outputs).
+        '''
+        stamp = []
+        for path in [os.path.join(self.taskDir, "crab.log"), os.path.join(self.taskDir, "results")]:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            stamp.extend([st.st_size, st.st_mtime])
+        return stamp
+
+
+    def Save(self):
+        '''
+        Write the snapshot into the task dir (failures are ignored, the snapshot is just an optimisation)
+        '''
+        Verbose("class TaskSnapshot:Save()", True)
+        fileName = os.path.join(self.taskDir, taskSnapshotFileName)
+        tmpName  = fileName + ".tmp%d" % os.getpid()
+        content  = {"version": taskSnapshotVersion, "stamp": self.GetStamp(), "snapshot": self.GetDict()}
+        try:
+            f = open(tmpName, "w")
+            json.dump(content, f)
+            f.close()
+            os.rename(tmpName, fileName)
+        except (IOError, OSError):
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+        return
+
+
+class CrabStatusClient:
+    '''
+    Executes "crab status" for a task dir and returns the result dictionary.
+    '''
+    def Status(self, taskDir):
+        Verbose("class CrabStatusClient:Status()", True)
+        return crabCommand('status', dir=taskDir)
+
+
+class LocalStatusClient:
+    def __init__(self, fileName):
+        '''
+        Local stub of the CrabStatusClient, for testing the status engine without the CRAB server.
+        The JSON file maps the task name (basename of the task dir) to the dictionary
+        that "crab status" would return, e.g. {"<task>": {"jobs": {"1": {"State": "finished"}}}}
+        '''
+        Verbose("class LocalStatusClient:__init__()", True)
+        f = open(fileName)
+        self.results = json.load(f)
+        f.close()
+        return
+
+
+    def Status(self, taskDir):
+        Verbose("class LocalStatusClient:Status()", True)
+        taskName = GetBasename(taskDir)
+        if taskName not in self.results:
+            raise Exception("No \"crab status\" result for task %s!" % (taskName) )
+        return self.results[taskName]
+
+
 #================================================================================================ 
 # Function Definitions
 #================================================================================================ 
@@ -420,36 +550,137 @@ def GetTaskStatus(datasetPath):
     return status
 
 
-def GetTaskReports(datasetPath, opts):
+def LoadTaskSnapshot(taskDir):
     '''
-    Execute "crab status", get task logs and output. 
-    Resubmit or kill task according to user options.
+    Returns the snapshot cached in the task dir, or None if there is none
+    or the task has changed since the snapshot was saved.
     '''
-    Verbose("GetTaskReports()", True)
+    Verbose("LoadTaskSnapshot()", True)
+    fileName = os.path.join(taskDir, taskSnapshotFileName)
+    if not os.path.exists(fileName):
+        return None
+    try:
+        f = open(fileName)
+        content = json.load(f)
+        f.close()
+    except (IOError, ValueError):
+        return None
+    if content.get("version", None) != taskSnapshotVersion:
+        return None
+    snapshot = TaskSnapshot(taskDir, **dict((str(k), v) for k, v in content["snapshot"].iteritems()))
+    if content["stamp"] == None or content["stamp"] != snapshot.GetStamp():
+        Verbose("Task %s has changed since the status snapshot was saved" % (GetBasename(taskDir)) )
+        return None
+    return snapshot
+
+
+def CallWithTimeout(timeout, func, *args):
+    '''
+    Calls func(*args) in a separate thread and waits at most timeout seconds
+    for it to return (no limit if timeout is 0). Python threads cannot be
+    killed, so a call that times out is abandoned (left running in a daemon
+    thread) and an exception is raised.
+    '''
+    Verbose("CallWithTimeout()")
+
+    if timeout <= 0:
+        return func(*args)
+
+    result = {}
+    def call():
+        try:
+            result["value"] = func(*args)
+        except:
+            result["error"] = sys.exc_info()
+        return
 
-    report = None
-    
-    # Get all files under <dataset_dir>/results/
-    files = Execute("ls %s" % os.path.join( datasetPath, "results") )
+    thread = threading.Thread(target=call)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.isAlive():
+        raise Exception("%s() timed out after %s seconds" % (func.__name__, timeout) )
+    if "error" in result:
+        raise result["error"][0], result["error"][1], result["error"][2]
+    return result["value"]
 
+
+def GetStatusClient(opts):
+    '''
+    Returns the client used to execute "crab status". With the --statusFile option
+    the CRAB server is replaced by a local stub reading the results from a file.
+    '''
+    Verbose("GetStatusClient()", True)
+    if opts.statusFile != None:
+        Verbose("Reading \"crab status\" results from %s" % (opts.statusFile) )
+        return LocalStatusClient(opts.statusFile)
+    return CrabStatusClient()
+
+
+def GetTaskSnapshot(datasetPath, client, showProgress, opts):
+    '''
+    Execute "crab status" and assess the job success/failure and the
+    retrieved log and output files of a task.
+    Nothing is printed unless showProgress is True, so that this can be called
+    from the status threads. The "crab status" call and the retrieved files
+    assessment (EOS walks) are limited to opts.timeout seconds each.
+    '''
+    Verbose("GetTaskSnapshot()", True)
+
+    # Execute "crab status --dir=datasetPath"
     Verbose("crab status --dir=%s" % (GetLast2Dirs(datasetPath)), False)
+    result = CallWithTimeout(opts.timeout, client.Status, datasetPath)
+    Verbose("Calling crab --status for dataset %s returned %s" % (GetBasename(datasetPath), result) )
+
+    # Get CRAB task status
+    status = GetTaskStatus(datasetPath).replace("\t", "")
+
+    # Get CRAB task dashboard URL
+    dashboardURL = GetTaskDashboardURL(datasetPath)
+
+    # Assess JOB success/failure for task
+    snapshot = CallWithTimeout(opts.timeout, RetrievedFiles, datasetPath, result, showProgress, opts)
+    snapshot.status       = status
+    snapshot.dashboardURL = dashboardURL
+    return snapshot
+
+
+def QueryTaskSnapshot(datasetPath, client, showProgress, opts):
+    '''
+    Status thread function. Returns the tuple (datasetPath, snapshot, errorMsg),
+    where snapshot is None if the task status could not be determined.
+    '''
     try:
-        d = GetBasename(datasetPath)
+        return (datasetPath, GetTaskSnapshot(datasetPath, client, showProgress, opts), None)
+    except:
+        return (datasetPath, None, sys.exc_info()[1])
 
-        # Execute "crab status --dir=datasetPath"
-        Verbose("Getting task status", False)
-        result = crabCommand('status', dir=datasetPath)
-        Verbose("Calling crab --status for dataset %s returned %s" % (d, result) )
-    
-        # Get CRAB task status
-        status = GetTaskStatus(d).replace("\t", "")
 
-        # Get CRAB task dashboard URL
-        dashboardURL = GetTaskDashboardURL(d)
+def GetFailedReport(datasetPath, msg):
+    Verbose("GetFailedReport()")
+    report = Report(datasetPath, "?", "?", "?", "?", "?", "?", "?", "?", "?", "?", "?", "?", "?") 
+    Print("crab status failed with message %s. Skipping ..." % ( msg ), True)
+    return report
 
-        # Assess JOB success/failure for task
-        Verbose("Retrieving files", True)
-        idle, running, finished, transferring, failed, retrievedLog, retrievedOut, eosLog, eosOut = RetrievedFiles(datasetPath, result, dashboardURL, True, opts)
+
+def GetTaskReports(datasetPath, snapshot, opts):
+    '''
+    Print the task status (see GetTaskSnapshot), get task logs and output. 
+    Resubmit or kill task according to user options.
+    '''
+    Verbose("GetTaskReports()", True)
+
+    report = None
+    try:
+        # Print results in a nice table
+        PrintTaskSnapshot(snapshot, opts)
+        idle         = snapshot.idle
+        running      = snapshot.running
+        finished     = snapshot.finished
+        transferring = snapshot.transferring
+        failed       = snapshot.failed
+        retrievedLog = snapshot.retrievedLog
+        retrievedOut = snapshot.retrievedOut
 
         # Get the task logs & output ?        
         Verbose("Getting task logs", True)
@@ -468,11 +699,11 @@ def GetTaskReports(datasetPath, opts):
         KillTask(datasetPath)
         # Count retrieved/all jobs
         retrieved = min(finished, retrievedLog, retrievedOut)
-        alljobs   = GetTotalJobsFromStatus(result)
+        alljobs   = snapshot.allJobs
 
         # Append the report
         Verbose("Appending Report")
-        report = Report(datasetPath, alljobs, idle, retrieved, running, finished, failed, transferring, retrievedLog, retrievedOut, eosLog, eosOut, status, dashboardURL)
+        report = Report(datasetPath, alljobs, idle, retrieved, running, finished, failed, transferring, retrievedLog, retrievedOut, snapshot.eosLog, snapshot.eosOut, snapshot.status, snapshot.dashboardURL)
 
         # Determine if task is DONE or not
         Verbose("Determining if Task is DONE")
@@ -480,11 +711,13 @@ def GetTaskReports(datasetPath, opts):
             absolutePath = os.path.join(datasetPath, "crab.log")
             os.system("sed -i -e '$a\DONE! (Written by multicrabCheck.py)' %s" % absolutePath )
 
+        # Cache the snapshot of COMPLETED tasks (no need to query them again)
+        if snapshot.IsFinal():
+            snapshot.Save()
+
     # Catch exceptions (Errors detected during execution which may not be "fatal")
     except:
-        msg = sys.exc_info()[1]
-        report = Report(datasetPath, "?", "?", "?", "?", "?", "?", "?", "?", "?", "?", "?", "?", "?") 
-        Print("crab status failed with message %s. Skipping ..." % ( msg ), True)
+        report = GetFailedReport(datasetPath, sys.exc_info()[1])
     return report
 
 
@@ -508,7 +741,7 @@ def CheckTaskReport(taskDir, jobId,  opts):
     '''
     Verbose("CheckTaskReport()", True)
 
-    filePath    = os.path.join(taskDir, "results", "cmsRun_%i.log.tar.gz" % jobId)
+    filePath    = os.path.join(taskDir, "results", "cmsRun_%s.log.tar.gz" % jobId)
     exitCode_re = re.compile("process\s+id\s+is\s+\d+\s+status\s+is\s+(?P<exitcode>\d+)")
 
     # Ensure file is indeed a tarfile 
@@ -878,10 +1111,18 @@ def GetCrabReportDictionary(datasets):
     and saves it into a dictionary, thus mapping the
     task name (basename of dataset path) to the CRAB 
     report for that task.    
+
+    The status of the tasks is queried in opts.jobs threads. The tasks
+    are then processed (tables printed, output retrieved, jobs resubmitted etc.)
+    one at a time as their status arrives. COMPLETED tasks with all logs and
+    output retrieved are not queried again, their cached snapshot is used instead.
     '''
     Verbose("GetCrabReportDictionary()", True)
 
     reportDict = {}
+    client     = GetStatusClient(opts)
+    snapshots  = {}
+    toQuery    = []
     # For-loop: All (absolute) paths of the datasets
     for index, d in enumerate(datasets):
         
@@ -890,11 +1131,39 @@ def GetCrabReportDictionary(datasets):
         # Check if task is in "DONE" state
         if GetTaskStatusBool(d):
             continue
-        
-        # Get the CRAB task report & add to dictionary (retrieves job output!)
-        report = GetTaskReports(d, opts)
-        reportDict[d.split("/")[-1]] = report
 
+        # Check if task is COMPLETED in an earlier check
+        snapshot = None
+        if not opts.noCache:
+            snapshot = LoadTaskSnapshot(d)
+        if snapshot != None and snapshot.IsFinal():
+            Verbose("Task %s is COMPLETED. Using cached status" % (GetBasename(d)) )
+            snapshots[d] = snapshot
+        else:
+            toQuery.append(d)
+    Verbose("Querying the status of %s tasks (%s COMPLETED tasks cached)" % (len(toQuery), len(snapshots)), True)
+
+    # Get the CRAB task report & add to dictionary (retrieves job output!)
+    for d in sorted(snapshots.keys()):
+        reportDict[d.split("/")[-1]] = GetTaskReports(d, snapshots[d], opts)
+
+    pool = None
+    if opts.jobs > 1 and len(toQuery) > 1:
+        pool    = ThreadPool(min(opts.jobs, len(toQuery)))
+        queried = pool.imap(lambda d: QueryTaskSnapshot(d, client, False, opts), toQuery)
+    else:
+        queried = (QueryTaskSnapshot(d, client, True, opts) for d in toQuery)
+    try:
+        for d, snapshot, msg in queried:
+            if snapshot == None:
+                report = GetFailedReport(d, msg)
+            else:
+                report = GetTaskReports(d, snapshot, opts)
+            reportDict[d.split("/")[-1]] = report
+    finally:
+        if pool != None:
+            pool.terminate()
+            pool.join()
     return reportDict
 
     
@@ -1004,11 +1273,11 @@ def GetEOSDir(taskDir, opts):
     return taskDirEOS
 
 
-def RetrievedFiles(taskDir, crabResults, dashboardURL, printTable, opts):
+def RetrievedFiles(taskDir, crabResults, showProgress, opts):
     '''
     Determines whether the jobs Finished (Success or Failure), and whether 
     the logs and output files have been retrieved. Returns all these in form
-    of lists. The list of tuple crabResults contains the jobId and its status.
+    of a TaskSnapshot. The dictionary crabResults contains the status of each jobId.
     For example:
     crabResults = [['finished', 1], ['finished', 2], ['finished', 3] ] #obsolete
     '''
@@ -1036,7 +1305,8 @@ def RetrievedFiles(taskDir, crabResults, dashboardURL, printTable, opts):
         stateDict = crabResults['jobs'][jobId] 
 
         # Inform user of progress (especially if opts.filesInEOS is enabled)
-        PrintProgressBar(os.path.basename(taskDir), index, nJobs )
+        if showProgress:
+            PrintProgressBar(os.path.basename(taskDir), index, nJobs )
 
         # Get the job ID and status
         jobStatus = stateDict['State']        
@@ -1088,26 +1358,36 @@ def RetrievedFiles(taskDir, crabResults, dashboardURL, printTable, opts):
     failed = list(set(failed))
 
     # Remove the progress bar once finished
-    ClearProgressBar()
+    if showProgress:
+        ClearProgressBar()
+
+    return TaskSnapshot(taskDir, allJobs=nJobs, idle=idle, running=running, transferring=transferring, unknown=unknown, finished=finished, failed=failed,
+                        retrievedLog=retrievedLog, retrievedOut=retrievedOut, eosLog=eosLog, eosOut=eosOut, missingLogs=missingLogs, missingOuts=missingOuts)
+
+
+def PrintTaskSnapshot(snapshot, opts):
+    '''
+    Prints the status of a task (see RetrievedFiles) in a nice table.
+    '''
+    Verbose("PrintTaskSnapshot()", True)
 
     # Print results in a nice table
-    reportTable = GetReportTable(taskDir, nJobs, running, transferring, finished, unknown, failed, idle, retrievedLog, retrievedOut, eosLog, eosOut)
-    if printTable:
-        for r in reportTable:
-            Print(r, False)
+    reportTable = GetReportTable(snapshot.taskDir, snapshot.allJobs, snapshot.running, snapshot.transferring, snapshot.finished, snapshot.unknown, snapshot.failed,
+                                 snapshot.idle, snapshot.retrievedLog, snapshot.retrievedOut, snapshot.eosLog, snapshot.eosOut)
+    for r in reportTable:
+        Print(r, False)
 
     # Sanity check
-    status = GetTaskStatus(taskDir).replace("\t", "")
-    if opts.verbose and status == "COMPLETED":
-        if len(missingLogs) > 0:
-            Print( "Missing log file(s) job ID: %s" % missingLogs)
-        if len(missingOuts) > 0:
-            Print( "Missing output files(s) job ID: %s" % missingOuts)
+    if opts.verbose and snapshot.status == "COMPLETED":
+        if len(snapshot.missingLogs) > 0:
+            Print( "Missing log file(s) job ID: %s" % snapshot.missingLogs)
+        if len(snapshot.missingOuts) > 0:
+            Print( "Missing output files(s) job ID: %s" % snapshot.missingOuts)
 
     # Print the dashboard url 
     if opts.url:
-        Print(dashboardURL, False)
-    return idle, running, finished, transferring, failed, retrievedLog, retrievedOut, eosLog, eosOut
+        Print(snapshot.dashboardURL, False)
+    return
 
 
 def GetReportTable(taskDir, nJobs, running, transferring, finished, unknown, failed, idle, retrievedLog, retrievedOut, eosLog, eosOut):
@@ -1894,6 +2174,8 @@ if __name__ == "__main__":
     PSET    = "miniAOD2TTree_SignalAnalysisSkim_cfg.py"
     SITE    = "T2_FI_HIP"
     DIRNAME = ""
+    JOBS    = 8
+    TIMEOUT = 600
 
     parser = OptionParser(usage="Usage: %prog [options]")
     parser.add_option("--create", dest="create", default=False, action="store_true", 
@@ -1944,6 +2226,18 @@ if __name__ == "__main__":
     parser.add_option("--filesInEOS", dest="filesInEOS", default=False, action="store_true",
                       help="The CRAB files are in a local EOS. Do not use files from the local multicrab directory [default: 'False']")
 
+    parser.add_option("-j", "--jobs", dest="jobs", default=JOBS, type="int",
+                      help="Number of threads querying the status of the CRAB tasks in parallel [default: %s]" % (JOBS))
+
+    parser.add_option("--timeout", dest="timeout", default=TIMEOUT, type="int",
+                      help="Time limit (in seconds) for the \"crab status\" call and the retrieved files check of a task (0 for no limit) [default: %s]" % (TIMEOUT))
+
+    parser.add_option("--noCache", dest="noCache", default=False, action="store_true",
+                      help="Query the status of all tasks, also the COMPLETED ones cached by an earlier status check [default: False]")
+
+    parser.add_option("--statusFile", dest="statusFile", default=None, type="string",
+                      help="Read the \"crab status\" results from a JSON file (task name -> result) instead of querying the CRAB server. For testing [default: None]")
+
     (opts, args) = parser.parse_args()
 
     if opts.create == False and opts.dirName == "":
@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+'''
+Unit tests of the task snapshots of multicrab.py
+
+Usage:
+python test_scripts_multicrab.py
+
+Needs the same (CRAB) environment as multicrab.py itself.
+'''
+import os
+import sys
+import json
+import imp
+import unittest
+from optparse import Values
+
+_testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(_testDir, "..", "..", "NtupleAnalysis", "test"))
+from unittestTools import TemporaryDirectoryTestCase
+
+multicrab = imp.load_source("multicrab", os.path.join(_testDir, "..", "scripts", "multicrab.py"))
+# The script reads its command line options from a global
+multicrab.opts = Values({"verbose": False})
+
+class TestTaskSnapshot(TemporaryDirectoryTestCase):
+    def setUp(self):
+        TemporaryDirectoryTestCase.setUp(self)
+        os.mkdir(os.path.join(self.directory, "results"))
+        self.writeFile("crab.log", "Task status: COMPLETED\n")
+
+    def completedSnapshot(self, **kwargs):
+        args = {"status": "COMPLETED", "allJobs": 3, "finished": ["1", "2", "3"],
+                "retrievedLog": ["1", "2", "3"], "retrievedOut": ["1", "2", "3"]}
+        args.update(kwargs)
+        return multicrab.TaskSnapshot(self.directory, **args)
+
+    def testIsFinal(self):
+        self.assertTrue(self.completedSnapshot().IsFinal())
+
+    def testIsNotFinal(self):
+        self.assertFalse(multicrab.TaskSnapshot(self.directory).IsFinal())
+        self.assertFalse(self.completedSnapshot(status="RUNNING").IsFinal())
+        self.assertFalse(self.completedSnapshot(allJobs=0, finished=[], retrievedLog=[], retrievedOut=[]).IsFinal())
+        self.assertFalse(self.completedSnapshot(failed=["2"]).IsFinal())
+        self.assertFalse(self.completedSnapshot(finished=["1", "2"]).IsFinal())
+        self.assertFalse(self.completedSnapshot(retrievedLog=["1", "2"]).IsFinal())
+        self.assertFalse(self.completedSnapshot(retrievedOut=["1", "2"]).IsFinal())
+
+    def testRoundTrip(self):
+        self.assertEqual(multicrab.LoadTaskSnapshot(self.directory), None)
+        snapshot = self.completedSnapshot(dashboardURL="http://foo", eosLog=3, missingOuts=["4"])
+        snapshot.Save()
+        loaded = multicrab.LoadTaskSnapshot(self.directory)
+        self.assertNotEqual(loaded, None)
+        self.assertEqual(loaded.taskDir, self.directory)
+        self.assertEqual(loaded.GetDict(), snapshot.GetDict())
+        self.assertTrue(loaded.IsFinal())
+
+    def testChangedTask(self):
+        self.completedSnapshot().Save()
+        f = open(os.path.join(self.directory, "crab.log"), "a")
+        f.write("Task status: RESUBMITTED\n")
+        f.close()
+        self.assertEqual(multicrab.LoadTaskSnapshot(self.directory), None)
+
+    def testOtherVersion(self):
+        self.completedSnapshot().Save()
+        fileName = os.path.join(self.directory, multicrab.taskSnapshotFileName)
+        f = open(fileName)
+        content = json.load(f)
+        f.close()
+        content["version"] = multicrab.taskSnapshotVersion+1
+        f = open(fileName, "w")
+        json.dump(content, f)
+        f.close()
+        self.assertEqual(multicrab.LoadTaskSnapshot(self.directory), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,6 +8,9 @@ import json
 import re
 import sys
 import socket
+import traceback
+import hashlib
+import multiprocessing
 
 import ROOT
 ROOT.gROOT.SetBatch(True)
@@ -24,6 +27,7 @@ import HiggsAnalysis.NtupleAnalysis.tools.git as git
 _debugMode = False
 _debugPUreweighting = False
 _debugMemoryConsumption = False
+_workerProcess = None # (Process, outputDir, lumidata) inherited by the forked worker processes
 
 
 #================================================================================================
@@ -50,27 +54,95 @@ def Print(msg, printHeader=True):
     return
     
 
+def _processJobInWorker(job):
+    '''
+    Entry point of the local worker processes of Process.run().
+    Returns a tuple of (job index, statistics, formatted traceback or None).
+    The exceptions are returned as strings, since the ROOT exceptions
+    can not necessarily be pickled back to the parent process.
+    '''
+    (process, outputDir, lumidata) = _workerProcess
+    try:
+        return (job[0], process._processJob(job, outputDir, lumidata), None)
+    except Exception:
+        return (job[0], None, traceback.format_exc())
+
+
 #================================================================================================
 # Class Definition
 #================================================================================================
+## Copy a parameter value for a PSet
+#
+# PSets are cloned (copy-on-write, i.e. the data is shared until
+# modified), lists are copied item by item, and everything else is
+# deep-copied.
+def _copyPSetValue(value):
+    if isinstance(value, PSet):
+        return value.clone()
+    if isinstance(value, list):
+        return [_copyPSetValue(item) for item in value]
+    return copy.deepcopy(value)
+
+## Set of parameters with copy-on-write semantics
+#
+# clone() is cheap: the clones share the parameter dictionary (and the
+# PSets and lists in it) until one of them is modified. Only the
+# modified PSet and the path to it are copied, so a large sub-tree
+# (e.g. the b-tag SF payload) is stored once for all variations of a
+# configuration. A PSet or list value is copied when it is accessed,
+# since the caller may modify it in place. The values handed out this
+# way stay with their PSet, a clone gets its own copies of them.
 class PSet:
     def __init__(self, **kwargs):
-        self.__dict__["_data"] = copy.deepcopy(kwargs)
+        data = {}
+        for key, value in kwargs.iteritems():
+            data[key] = _copyPSetValue(value)
+        self.__dict__["_data"] = data
+        self.__dict__["_shared"] = False # _data is shared with other PSets
+        self.__dict__["_owned"] = set(data.keys()) # keys of the PSet/list values not shared with other PSets
 
     def clone(self, **kwargs):
-        pset = PSet(**self._data)
+        pset = PSet()
+        data = self._data
+        owned = [key for key in self._owned if isinstance(data[key], PSet) or isinstance(data[key], list)]
+        if len(owned) > 0:
+            # The owned PSet/list values may be referenced (and modified)
+            # from outside, so the clone must not share them
+            data = dict(self._data)
+            for key in owned:
+                data[key] = _copyPSetValue(data[key])
+            pset.__dict__["_data"] = data
+        else:
+            pset.__dict__["_data"] = data
+            pset.__dict__["_shared"] = True
+            self.__dict__["_shared"] = True
+            self.__dict__["_owned"] = set()
         for key, value in kwargs.iteritems():
             setattr(pset, key, value)
         return pset
 
+    def _makeWritable(self):
+        if self._shared:
+            self.__dict__["_data"] = dict(self._data)
+            self.__dict__["_shared"] = False
+
     def __getattr__(self, name):
-        return self._data[name]
+        value = self._data[name]
+        if (isinstance(value, PSet) or isinstance(value, list)) and name not in self._owned:
+            # Shared with other PSets, copy since the caller may modify it
+            self._makeWritable()
+            value = _copyPSetValue(value)
+            self._data[name] = value
+            self._owned.add(name)
+        return value
 
     def __hasattr__(self, name):
         return name in self._data.keys()
 
     def __setattr__(self, name, value):
-        self.__dict__["_data"][name] = value
+        self._makeWritable()
+        self._data[name] = value
+        self._owned.add(name)
 
     def _asDict(self):
         data = {}
@@ -101,6 +173,93 @@ class PSet:
         return json.dumps(self._asDict(), sort_keys=True, indent=2)
 
 
+## Serializer for the configurations of several analyzers, writing the
+## sub-trees shared between them only once
+#
+# A sub-tree (PSet or list) is shared when the configurations have been
+# cloned from the same PSet and the sub-tree has not been modified (see
+# PSet). In the analyzer configuration a shared sub-tree is replaced by
+# the string "@PSetRef:<index>", and its JSON is stored in
+# getSharedConfigs()[index]. SelectorImpl expands the references from
+# the "psetref_<index>" TNamed objects of the input list.
+class PSetSerializationCache:
+    ## Constructor
+    #
+    # \param minimumLength  Shared sub-trees with shorter JSON are written inline
+    def __init__(self, minimumLength=1024):
+        self._minimumLength = minimumLength
+        self._counts = {} # id of the PSet data or list -> number of references
+        self._objects = [] # keep the counted objects alive to keep the ids unique
+        self._references = {} # id of the PSet data or list -> index in _sharedConfigs (None for inline)
+        self._sharedConfigs = []
+
+    def _nodeId(self, value):
+        if isinstance(value, PSet):
+            return id(value._data)
+        if isinstance(value, list):
+            return id(value)
+        return None
+
+    def _count(self, value):
+        nodeId = self._nodeId(value)
+        if nodeId == None:
+            return
+        self._counts[nodeId] = self._counts.get(nodeId, 0) + 1
+        if self._counts[nodeId] > 1:
+            return # the children have been counted already
+        self._objects.append(value)
+        if isinstance(value, PSet):
+            children = value._data.values()
+        else:
+            children = value
+        for child in children:
+            self._count(child)
+
+    ## Register a configuration (PSet), all configurations must be added before serialize()
+    def add(self, pset):
+        for value in pset._data.values():
+            self._count(value)
+
+    def _asSerializable(self, value):
+        nodeId = self._nodeId(value)
+        if nodeId == None:
+            return value
+        if self._counts.get(nodeId, 0) > 1:
+            if not nodeId in self._references:
+                config = json.dumps(_asSerializableValue(value), sort_keys=True)
+                if len(config) < self._minimumLength:
+                    self._references[nodeId] = None
+                else:
+                    self._references[nodeId] = len(self._sharedConfigs)
+                    self._sharedConfigs.append(config)
+            index = self._references[nodeId]
+            if index != None:
+                return "@PSetRef:%d" % index
+            return _asSerializableValue(value)
+        if isinstance(value, PSet):
+            return dict((key, self._asSerializable(item)) for key, item in value._data.iteritems())
+        return [self._asSerializable(item) for item in value]
+
+    ## Return the JSON of a configuration with the references to the shared sub-trees
+    def serialize(self, pset):
+        data = {}
+        for key, value in pset._data.iteritems():
+            data[key] = self._asSerializable(value)
+        return json.dumps(data, sort_keys=True, indent=2)
+
+    ## Return the list of JSON strings of the shared sub-trees
+    def getSharedConfigs(self):
+        return self._sharedConfigs
+
+## Convert a PSet (or a list with PSets) recursively into dictionaries and lists
+def _asSerializableValue(value):
+    if isinstance(value, PSet):
+        return dict((key, _asSerializableValue(item)) for key, item in value._data.iteritems())
+    if isinstance(value, list):
+        return [_asSerializableValue(item) for item in value]
+    return value
+
+
 def File(fname):
     fullpath = os.path.join(aux.higgsAnalysisPath(), fname)
     if not os.path.exists(fullpath):
@@ -139,7 +298,10 @@ class Analyzer:
         setattr(self.__dict__["_pset"], name, value)
 
     def exists(self, name):
-        return name in self._pset._asDict()
+        return name in self._pset._data
+
+    def pset_(self):
+        return self.__dict__["_pset"]
 
     def className_(self):
         return self.__dict__["_className"]
@@ -231,11 +393,210 @@ class Dataset:
     def getNAllEvents(self):
         return self._nAllEvents
 
+#================================================================================================
+# Class Definition
+#================================================================================================
+class FileMetadataCache:
+    '''
+    Persistent cache of the per-file metadata needed before the event loop
+    (number of entries, configInfo/SkimCounter, configInfo/topPtWeightAllEvents
+    and configInfo/configinfo).
+
+    The cache of each input directory is stored as a JSON file under
+    \a cacheDir (default ~/.hplusMetadataCache), so that nothing is written
+    into the (possibly shared or EOS) multicrab directories. With
+    \a useSidecar True, the cache is stored instead as a sidecar file
+    (.metadataCache.json) in the input directory if that is writable.
+    The entries are keyed by the file path and validated against the file
+    size and modification time (remote files are assumed to be immutable).
+    A file is opened only if it has no valid entry in the cache, and then
+    all metadata are read in one go. With \a persistent False, the cache
+    lives only in memory.
+    '''
+    _sidecarName = ".metadataCache.json"
+    _version = 2
+
+    def __init__(self, cacheDir=None, persistent=True, useSidecar=False):
+        if cacheDir is None:
+            cacheDir = os.path.join(os.path.expanduser("~"), ".hplusMetadataCache")
+        self._cacheDir = cacheDir
+        self._persistent = persistent
+        self._useSidecar = useSidecar
+        self._caches = {} # directory -> {basename -> metadata}
+        self._dirty  = set()
+        self._hits   = 0
+        self._misses = 0
+
+    def _getCacheFileName(self, directory):
+        if self._useSidecar and os.path.isdir(directory) and os.access(directory, os.W_OK):
+            return os.path.join(directory, self._sidecarName)
+        name = hashlib.md5(directory).hexdigest()+".json"
+        return os.path.join(self._cacheDir, name)
+
+    def _getDirectoryCache(self, directory):
+        if directory not in self._caches:
+            data = {}
+            cacheFileName = self._getCacheFileName(directory)
+            if self._persistent and os.path.exists(cacheFileName):
+                try:
+                    f = open(cacheFileName)
+                    data = json.load(f)
+                    f.close()
+                except ValueError:
+                    Print("Ignoring corrupted metadata cache %s" % cacheFileName, True)
+                    data = {}
+            self._caches[directory] = data
+        return self._caches[directory]
+
+    def _getFileStamp(self, fileName):
+        if not os.path.exists(fileName):
+            return (None, None)
+        st = os.stat(fileName)
+        return (st.st_size, int(st.st_mtime))
+
+    def get(self, fileName):
+        '''
+        Returns the metadata dictionary of the file, reading it from the file if necessary
+        '''
+        (directory, basename) = os.path.split(fileName)
+        cache = self._getDirectoryCache(directory)
+        (size, mtime) = self._getFileStamp(fileName)
+        entry = cache.get(basename, None)
+        if entry is not None and entry["size"] == size and entry["mtime"] == mtime and entry.get("version", None) == self._version:
+            self._hits += 1
+            return entry
+        self._misses += 1
+        entry = self._readFile(fileName)
+        entry["size"]    = size
+        entry["mtime"]   = mtime
+        entry["version"] = self._version
+        cache[basename] = entry
+        self._dirty.add(directory)
+        return entry
+
+    def prefetch(self, fileNames):
+        '''
+        Makes sure that all files have a valid cache entry, and saves the cache
+        '''
+        for fileName in fileNames:
+            self.get(fileName)
+        self.save()
+        Verbose("Metadata cache: %d hits, %d misses" % (self._hits, self._misses), True)
+        return
+
+    def save(self):
+        if not self._persistent:
+            self._dirty = set()
+            return
+        for directory in self._dirty:
+            cacheFileName = self._getCacheFileName(directory)
+            try:
+                if not os.path.exists(os.path.dirname(cacheFileName)):
+                    os.makedirs(os.path.dirname(cacheFileName))
+                # Write to a temporary file first, so that an interrupted write does not corrupt the cache
+                tmpName = "%s.%d.tmp" % (cacheFileName, os.getpid())
+                f = open(tmpName, "w")
+                json.dump(self._caches[directory], f)
+                f.close()
+                os.rename(tmpName, cacheFileName)
+            except (IOError, OSError), e:
+                Print("Unable to write metadata cache %s: %s" % (cacheFileName, str(e)), True)
+        self._dirty = set()
+        return
+
+    def getEntries(self, fileNames):
+        '''
+        Returns the total number of entries in the Events tree of the files
+        '''
+        return sum([self.get(f)["entries"] for f in fileNames])
+
+    def getHisto(self, fileName, name):
+        '''
+        Returns a new TH1 (not attached to any file) of configInfo/<name>, or None if the file does not have it
+        '''
+        data = self.get(fileName)[name]
+        if data is None:
+            return None
+        return _jsonToHisto(data)
+
+    def getBinContents(self, fileName, name):
+        '''
+        Returns the list of bin contents (including under- and overflow) of configInfo/<name>, or None
+        '''
+        data = self.get(fileName)[name]
+        if data is None:
+            return None
+        return data["contents"]
+
+    def _readFile(self, fileName):
+        Verbose("Reading metadata from %s" % fileName, True)
+        entry = {}
+        fIN = ROOT.TFile.Open(fileName)
+        if fIN == None or fIN.IsZombie():
+            raise Exception("Unable to open file %s" % fileName)
+        tree = fIN.Get("Events")
+        if tree == None:
+            entry["entries"] = 0
+        else:
+            entry["entries"] = tree.GetEntries()
+        for name in ["SkimCounter", "topPtWeightAllEvents", "configinfo"]:
+            h = fIN.Get("configInfo/"+name)
+            if h == None:
+                entry[name] = None
+            else:
+                entry[name] = _histoToJson(h)
+        ROOT.gROOT.GetListOfFiles().Remove(fIN)
+        fIN.Close()
+        return entry
+
+
+def _histoToJson(h):
+    '''
+    Serializes a 1D histogram (class, binning, labels, contents and errors) into a JSON-compatible dictionary
+    '''
+    n = h.GetNbinsX()
+    axis = h.GetXaxis()
+    return {"class"   : h.ClassName(),
+            "name"    : h.GetName(),
+            "title"   : h.GetTitle(),
+            "nbins"   : n,
+            "xmin"    : axis.GetXmin(),
+            "xmax"    : axis.GetXmax(),
+            "labels"  : [axis.GetBinLabel(i) for i in range(1, n+1)],
+            "contents": [h.GetBinContent(i) for i in range(0, n+2)],
+            "errors"  : [h.GetBinError(i) for i in range(0, n+2)],
+            "entries" : h.GetEntries(),
+            }
+
+
+def _jsonToHisto(data):
+    '''
+    Creates a histogram of the original class (e.g. TH1F or TH1D) from a dictionary produced by _histoToJson()
+    '''
+    h = getattr(ROOT, str(data["class"]))(str(data["name"]), str(data["title"]), data["nbins"], data["xmin"], data["xmax"])
+    h.SetDirectory(None)
+    h.Sumw2()
+    for i, label in enumerate(data["labels"]):
+        if label != "":
+            h.GetXaxis().SetBinLabel(i+1, str(label))
+    for i in range(0, data["nbins"]+2):
+        h.SetBinContent(i, data["contents"][i])
+        h.SetBinError(i, data["errors"][i])
+    h.SetEntries(data["entries"])
+    return h
+
 #================================================================================================
 # Class Definition
 #================================================================================================
 class Process:
-    def __init__(self, outputPrefix="analysis", outputPostfix="", maxEvents={}):
+    def __init__(self, outputPrefix="analysis", outputPostfix="", maxEvents={}, useMetadataCache=True, metadataCacheDir=None, metadataCacheSidecar=False):
+        '''
+        \param useMetadataCache      Store the per-file metadata read before the event loop
+                                     persistently (see FileMetadataCache)
+        \param metadataCacheDir      Directory for the metadata caches (default ~/.hplusMetadataCache)
+        \param metadataCacheSidecar  Store the metadata cache of a writable input directory
+                                     in that directory (.metadataCache.json) instead
+        '''
         ROOT.gSystem.Load("libHPlusAnalysis.so")
 
         self._verbose       = _debugMode
@@ -245,6 +606,7 @@ class Process:
         self._analyzers = {}
         self._maxEvents = maxEvents
         self._options   = PSet()
+        self._metadataCache = FileMetadataCache(metadataCacheDir, persistent=useMetadataCache, useSidecar=metadataCacheSidecar)
         return
     
     def ConvertSymLinks(fileList):
@@ -277,14 +639,18 @@ class Process:
         return fileList
 
 
-    def addDataset(self, name, files=None, dataVersion=None, lumiFile=None):
+    def addDataset(self, name, files=None, dataVersion=None, lumiFile=None, precursor=None):
         '''
+        If the dataset.DatasetPrecursor of the dataset is given, its
+        metadata is used instead of reading the files again
         '''
         Verbose("addDataset()", True)
         if files is None:
             files = datasetsTest.getFiles(name)
 
-        prec = dataset.DatasetPrecursor(name, files)
+        prec = precursor
+        if prec is None:
+            prec = dataset.DatasetPrecursor(name, files)
         if dataVersion is None:
             dataVersion = prec.getDataVersion()
         #get pileup
@@ -319,6 +685,7 @@ class Process:
     def addDatasetsFromMulticrab(self, directory, *args, **kwargs):
         '''
         kwargs for 'includeOnlyTasks' or 'excludeTasks' to set the datasets over which this analyzer is processed, default is all datasets
+        kwarg 'useMetadataIndex=False' reads the dataset metadata from the ROOT files instead of the index file of the multicrab directory (created on the first run)
         '''
         Verbose("addDatasetsFromMulticrab()", True)
         blacklist = []
@@ -364,7 +731,7 @@ class Process:
             if isOnBlackList:
                 print "Ignoring dataset because of black/whitelist options: '%s' ..."%dset.getName()
             else:
-                self.addDataset(dset.getName(), dset.getFileNames(), dataVersion=dset.getDataVersion(), lumiFile=dsetMgrCreator.getLumiFile())
+                self.addDataset(dset.getName(), dset.getFileNames(), dataVersion=dset.getDataVersion(), lumiFile=dsetMgrCreator.getLumiFile(), precursor=dset)
         return
 
 
@@ -419,7 +786,28 @@ class Process:
         for key, value in kwargs.iteritems():
             setattr(self._options, key, value)
 
-    def run(self, proof=False, proofWorkers=None):
+    def run(self, proof=False, proofWorkers=None, workers=None, filesPerJob=None, entriesPerJob=None, mergeShards=True):
+        '''
+        Processes all datasets with all analyzers.
+
+        \param proof         Use PROOF (legacy)
+        \param proofWorkers  Number of PROOF workers
+        \param workers       Number of local worker processes. If larger than 1,
+                             each dataset (or file chunk) is processed in a
+                             separate process, writing its own output file.
+        \param filesPerJob   Split datasets with more files than this into file
+                             chunks (only with \a workers). Each chunk writes
+                             histograms-<dataset>_<chunk>.root into the same
+                             res/ directory.
+        \param entriesPerJob Split datasets with more entries than this into
+                             entry ranges of the full TChain (only with
+                             \a workers). Takes precedence over \a filesPerJob.
+        \param mergeShards   Merge the outputs of the file chunks and entry
+                             ranges of a dataset in-process into the usual
+                             histograms-<dataset>.root once all of them are
+                             finished. If False, the chunk files are kept, and
+                             they are summed by the dataset module when read back.
+        '''
         outputDir = self._outputPrefix+"_"+time.strftime("%y%m%d_%H%M%S")
         if self._outputPostfix != "":
             outputDir += "_"+self._outputPostfix
@@ -474,6 +862,8 @@ class Process:
         # Setup proof if asked
         _proof = None
         if proof:
+            if workers is not None and workers > 1:
+                raise Exception("The PROOF and the local process-pool ('workers') modes are mutually exclusive")
             opt = ""
             if proofWorkers is not None:
                 opt = "workers=%d"%proofWorkers
@@ -485,303 +875,552 @@ class Process:
         cpuTimeTotal = 0
         readMbytesTotal = 0
         callsTotal = 0
+        wallTimeStart = time.time()
 
-
-        # Process over datasets
-        ndset = 0
+        # Read the per-file metadata (entries, skim counters, etc.) of all datasets
+        # in one go. With a persistent cache, a re-run does not open the files here.
+        allFiles = []
         for dset in self._datasets:
-            # Get data PU distributions from data
-            #   This is done every time for a dataset since memory management is simpler to handle
-            #   if all the histograms in memory are deleted after reading a dataset is finished
-            hPUs = self._getDataPUhistos()
-            # Initialize
-            ndset += 1
-            inputList = ROOT.TList()
-            nanalyzers = 0
-            anames = []
-            usePUweights = False
-            useTopPtCorrection = False
-            nAllEventsPUWeighted = 0.0
-            for aname, analyzerIE in self._analyzers.iteritems():
-                if analyzerIE.runForDataset_(dset.getName()):
-                    nanalyzers += 1
-                    analyzer = analyzerIE.getAnalyzer()
-                    if hasattr(analyzer, "__call__"):
-                        analyzer = analyzer(dset.getDataVersion())
-                        if analyzer is None:
-                            raise Exception("Analyzer %s was specified as a function, but returned None" % aname)
-                        if not isinstance(analyzer, Analyzer):
-                            raise Exception("Analyzer %s was specified as a function, but returned object of %s instead of Analyzer" % (aname, analyzer.__class__.__name__))
-                    inputList.Add(ROOT.TNamed("analyzer_"+aname, analyzer.className_()+":"+analyzer.config_()))
-                    # ttbar status for top pt corrections
-                    ttbarStatus = "0"
-                    useTopPtCorrection = analyzer.exists("useTopPtWeights") and analyzer.__getattr__("useTopPtWeights")
-                    useTopPtCorrection = useTopPtCorrection and dset.getName().startswith("TT")
-                    if useTopPtCorrection:
-                        ttbarStatus = "1"
-                    inputList.Add(ROOT.TNamed("isttbar", ttbarStatus))
-                    # intermediate H+ status for reweighting the NoNeutral samples
-                    intermediateStatus = "0"
-                    if dset.getName().find("IntermediateMassNoNeutral") > 0:
-                        intermediateStatus = "1"
-                    inputList.Add(ROOT.TNamed("isIntermediateNoNeutral", intermediateStatus))
-                    # Pileup reweighting
-                    (puAllEvents, puStatus) = self._parsePUweighting(dset, analyzer, aname, hPUs, inputList)
-                    nAllEventsPUWeighted += puAllEvents
-                    usePUweights = puStatus
-                    # Sum skim counters (from ttree)
-                    hSkimCounterSum = self._getSkimCounterSum(dset.getFileNames())
-                    inputList.Add(hSkimCounterSum)
-                    # Add name
-                    anames.append(aname)
-            if nanalyzers == 0:
-                print "Skipping %s, no analyzers" % dset.getName()
-                continue
-
-            Print("Processing dataset (%d/%d)" % (ndset, len(self._datasets) ))
-            align= "{:<23} {:<1} {:<60}"
-            info = {}
-            info["Dataset"] = dset.getName()
-            if dset.getDataVersion().isData():
-                lumivalue = "--- not available in lumi.json (or lumi.json not available) ---"
-                if dset.getName() in lumidata.keys():
-                    lumivalue = lumidata[dset.getName()]
-                info["Luminosity"] = str(lumivalue) + " fb-1"
-            info["UsePUweights"] = usePUweights
-            info["UseTopPtCorrection"] = useTopPtCorrection
-            for key in info:
-                Print(align.format(key, ":", info[key]), False)
-
-            # Create dir for dataset ROOTT files   
-            resDir = os.path.join(outputDir, dset.getName(), "res")
-            resFileName = os.path.join(resDir, "histograms-%s.root"%dset.getName())
-            os.makedirs(resDir)
+            allFiles.extend(dset.getFileNames())
+        self._metadataCache.prefetch(allFiles)
 
-            tchain = ROOT.TChain("Events")
-            # For-loop: All file names for dataset
-            for f in dset.getFileNames():
-                tchain.Add(f)
-            tchain.SetCacheLearnEntries(1000);
-            tchain.SetCacheSize(10000000) # Set cache size to 10 MB (somehow it is not automatically set contrary to ROOT docs)
-
-            tselector = ROOT.SelectorImpl()
-
-            # FIXME: TChain.GetEntries() is needed only to give a time
-            # estimate for the analysis. If this turns out to be slow,
-            # we could store the number of events along the file names
-            # (whatever is the method for that)
-            inputList.Add(ROOT.TNamed("entries", str(tchain.GetEntries())))
-            if dset.getDataVersion().isMC():
-                inputList.Add(ROOT.TNamed("isMC", "1"))
-            else:
-                inputList.Add(ROOT.TNamed("isMC", "0"))
-            inputList.Add(ROOT.TNamed("options", self._options.serialize_()))
-            inputList.Add(ROOT.TNamed("printStatus", "1"))
-
-            if _proof is not None:
-                tchain.SetProof(True)
-                inputList.Add(ROOT.TNamed("PROOF_OUTPUTFILE_LOCATION", resFileName))
-            else:
-                inputList.Add(ROOT.TNamed("OUTPUTFILE_LOCATION", resFileName))
+        # Process over datasets
+        if workers is not None and workers > 1:
+            jobs = self._createJobs(filesPerJob, entriesPerJob)
+            results = self._runJobsInPool(jobs, workers, outputDir, lumidata, mergeShards)
+        else:
+            results = []
+            for job in self._createJobs(None, None):
+                results.append(self._processJob(job, outputDir, lumidata, _proof))
 
-#            if _debugPUreweighting:
-#                print "\n\nDebug(inputlist): Input list contains:"
-#                print "--- start of input list ---"
-#                inputList.Print("",1)
-#                print "--- end of input list \n\n"
-
-            tselector.SetInputList(inputList)
-
-            readBytesStart = ROOT.TFile.GetFileBytesRead()
-            readCallsStart = ROOT.TFile.GetFileReadCalls()
-            timeStart = time.time()
-            clockStart = time.clock()
-
-            # Determine how many events to run on for given dataset
-            if len(self._maxEvents.keys()) > 0:
-                key = ""
-                for k in self._maxEvents.keys():
-                    if k.lower() == "all":
-                        key = k
-                        break
-                    maxEv_re = re.compile(k)
-                    match = maxEv_re.search(dset.getName())
-                    if match:
-                        key = k
-                        break
-                if key == "":
-                    tchain.Process(tselector)
-                else:
-                    maxEvts  = self._maxEvents[key]
-                    if maxEvts == -1:
-                        tchain.Process(tselector)
-                    else:
-                        tchain.SetCacheEntryRange(0, self._maxEvents[key])
-                        tchain.Process(tselector, "", self._maxEvents[key])
-
-#            elif "All" in self._maxEvents:
-#                if len(self._maxEvents) == 1:
-#                    if self._maxEvents["All"] == -1:
-#                        tchain.Process(tselector)
-#                    else:
-#                        tchain.SetCacheEntryRange(0, self._maxEvents["All"])
-#                        tchain.Process(tselector, "", self._maxEvents["All"])
-#                else:
-#                    msg  = "Ambiguous selection for number of max events to run"
-#                    msg += "If \"all\" is selected no other datasets options are allowed. Got: "
-#                    msg += "\n\t".join(self._maxEvents.keys())
-#                    raise Exception(msg)
-#            elif dset.getName() in self._maxEvents.keys():
-#                tchain.SetCacheEntryRange(0, self._maxEvents[dset.getName()])
-#                tchain.Process(tselector, "", self._maxEvents[dset.getName()])
-            #if self._maxEvents > 0:
-            #    tchain.SetCacheEntryRange(0, self._maxEvents)
-            #    tchain.Process(tselector, "", self._maxEvents)
-            else:
-                tchain.Process(tselector)
-            if _debugMemoryConsumption:
-                print "    MEMDBG: TChain cache statistics:"
-                tchain.PrintCacheStats()
-            
-            # Obtain Nall events for top pt corrections
-            NAllEventsTopPt = 0
-            if useTopPtCorrection:
-                for inname in dset.getFileNames():
-                    fIN = ROOT.TFile.Open(inname)
-                    h = fIN.Get("configInfo/topPtWeightAllEvents")
-                    if h != None:
-                        binNumber = 2 # nominal
-                        if hasattr(analyzer, "topPtSystematicVariation"):
-                            variation = getattr(analyzer, "topPtSystematicVariation")
-                            if variation == "minus":
-                                binNumber = 0
-                            # FIXME: The bin is to be added to the ttrees
-                            #elif variation == "plus":
-                                #binNumber = 3
-                                #if not h.GetXaxis().GetBinLabel().endsWith("Plus"):
-                                    #raise Exception("This should not happen")
-                        if binNumber > 0:
-                            NAllEventsTopPt += h.GetBinContent(binNumber)
-                    else:
-                        raise Exception("Warning: Could not obtain N(AllEvents) for top pt reweighting")
-                    ROOT.gROOT.GetListOfFiles().Remove(fIN)
-                    fIN.Close()
-
-            # Write configInfo
-            fIN = ROOT.TFile.Open(dset.getFileNames()[0])
-            cinfo = fIN.Get("configInfo/configinfo")
-            tf = ROOT.TFile.Open(resFileName, "UPDATE")
-            configInfo = tf.Get("configInfo")
-            if configInfo == None:
-                configInfo = tf.mkdir("configInfo")
-            configInfo.cd()
-            dv = ROOT.TNamed("dataVersion", str(dset.getDataVersion()))
-            dv.Write()
-            dv.Delete()
-            cv = ROOT.TNamed("codeVersionAnalysis", git.getCommitId())
-            cv.Write()
-            cv.Delete()
-            if not cinfo == None:
-                # Add more information to configInfo
-                n = cinfo.GetNbinsX()
-                cinfo.SetBins(n+3, 0, n+3)
-                cinfo.GetXaxis().SetBinLabel(n+1, "isData")
-                cinfo.GetXaxis().SetBinLabel(n+2, "isPileupReweighted")
-                cinfo.GetXaxis().SetBinLabel(n+3, "isTopPtReweighted")
-                # Add "isData" column
-                if not dset.getDataVersion().isMC():
-                    cinfo.SetBinContent(n+1, cinfo.GetBinContent(1))
-                # Add "isPileupReweighted" column
-                if usePUweights:
-                    cinfo.SetBinContent(n+2, nAllEventsPUWeighted / nanalyzers)
-                # Add "isTopPtReweighted" column
-                if useTopPtCorrection:
-                    cinfo.SetBinContent(n+3, NAllEventsTopPt)
-                # Write
-                cinfo.Write()
-                ROOT.gROOT.GetListOfFiles().Remove(fIN);
-                fIN.Close()
-
-            # Memory management
-            configInfo.Delete()
-            ROOT.gROOT.GetListOfFiles().Remove(tf);
-            tf.Close()
-            for item in inputList:
-                if isinstance(item, ROOT.TObject):
-                    item.Delete()
-            inputList = None
-            if hSkimCounterSum != None:
-                hSkimCounterSum.Delete()
-            if _debugMemoryConsumption:
-                print "      MEMDBG: gDirectory", ROOT.gDirectory.GetList().GetSize()
-                print "      MEMDBG: list ", ROOT.gROOT.GetList().GetSize()
-                print "      MEMDBG: globals ", ROOT.gROOT.GetListOfGlobals().GetSize()
-                #for item in ROOT.gROOT.GetListOfGlobals():
-                    #print item.GetName()
-                print "      MEMDBG: files", ROOT.gROOT.GetListOfFiles().GetSize()
-                #for item in ROOT.gROOT.GetListOfFiles():
-                #    print "          %d items"%item.GetList().GetSize()
-                print "      MEMDBG: specials ", ROOT.gROOT.GetListOfSpecials().GetSize()
-                for item in ROOT.gROOT.GetListOfSpecials():
-                    print "          "+item.GetName()
-                
-                #gDirectory.GetList().Delete();
-                #gROOT.GetList().Delete();
-                #gROOT.GetListOfGlobals().Delete();
-                #TIter next(gROOT.GetList());
-                #while (TObject* o = dynamic_cast<TObject*>(next())) {
-                  #o.Delete();
-                #}
-            
-            # Performance and information
-            timeStop = time.time()
-            clockStop = time.clock()
-            readCallsStop = ROOT.TFile.GetFileReadCalls()
-            readBytesStop = ROOT.TFile.GetFileBytesRead()
-
-            calls = ""
-            if _proof is not None:
-                tchain.SetProof(False)
-                queryResult = _proof.GetQueryResult()
-                cpuTime = queryResult.GetUsedCPU()
-                readMbytes = queryResult.GetBytes()/1024/1024
-            else:
-                cpuTime = clockStop-clockStart
-                readMbytes = float(readBytesStop-readBytesStart)/1024/1024
-                calls = " (%d calls)" % (readCallsStop-readCallsStart)
-            realTime = timeStop-timeStart
-            align= "{:<23} {:<1} {:<60}"
-            info = {}
-            info["Real time"]    = "%.3f" % realTime + " s"
-            info["CPU time"]     = "%.3f" % cpuTime  + " s"
-            info["Read Percent"]= "%.3f" % (cpuTime/realTime*100) + " MB"
-            info["Read Size"]    = "%.3f" % (readMbytes) + " MB"
-            info["Read Calls"]   = "%s"   % (readCallsStop-readCallsStart)
-            info["Read Speed"]   = "%.3f" % (readMbytes/realTime) + " MB/s"
-            for key in info:
-                Print(align.format(key, ":", info[key]), False)
-
-            # Time accumulation
-            realTimeTotal   += realTime
-            cpuTimeTotal    += cpuTime
-            readMbytesTotal += readMbytes
+        # Time accumulation
+        for res in results:
+            if res is None:
+                continue
+            realTimeTotal   += res["realTime"]
+            cpuTimeTotal    += res["cpuTime"]
+            readMbytesTotal += res["readMbytes"]
+            callsTotal      += res["readCalls"]
+        wallTime = time.time()-wallTimeStart
 
         # Total time stats
-        if len(self._datasets) > 1:
+        align= "{:<23} {:<1} {:<60}"
+        if len(self._datasets) > 1 and realTimeTotal > 0:
             Print("Usage statistics", True)
             total = {}
             total["Real time"]  = "%.3f" % realTimeTotal + " s"
             total["CPU time"]   = "%.3f" % cpuTimeTotal  + " s (%.1f %% of eal time)" % (cpuTimeTotal/realTimeTotal*100)
             total["Read size"]  = "%.3f" % (readMbytesTotal) + " MB"
-            total["Read speed"] = "%.3f" % (readMbytes/realTime) + " MB/s"
+            total["Read calls"] = "%d" % (callsTotal)
+            total["Read speed"] = "%.3f" % (readMbytesTotal/realTimeTotal) + " MB/s"
+            if workers is not None and workers > 1:
+                total["Wall time"] = "%.3f" % wallTime + " s (%d workers)" % (workers)
             for key in total:
                 Print(align.format(key, ":", total[key]), False)
         Print("Results are in %s" % (outputDir), True)
         return outputDir
 
+    def _createJobs(self, filesPerJob, entriesPerJob):
+        '''
+        Splits the datasets into jobs. Each job is a tuple of
+        (job index, dataset index, chunk index, list of file names, first entry, number of entries).
+        The chunk index is None if the dataset is processed as a whole.
+        The number of entries is None unless the job is an entry range of the full TChain.
+        '''
+        jobs = []
+        for i, dset in enumerate(self._datasets):
+            files = dset.getFileNames()
+            if entriesPerJob is not None and entriesPerJob > 0:
+                # Entry ranges of the full TChain
+                nEntries = self._metadataCache.getEntries(files)
+                maxEvts = self._getMaxEvents(dset)
+                if maxEvts >= 0:
+                    nEntries = min(nEntries, maxEvts)
+                if nEntries > entriesPerJob:
+                    for j, first in enumerate(range(0, nEntries, entriesPerJob)):
+                        jobs.append((len(jobs), i, j, files, first, min(entriesPerJob, nEntries-first)))
+                    continue
+            elif filesPerJob is not None and filesPerJob > 0 and len(files) > filesPerJob:
+                # File chunks
+                for j, k in enumerate(range(0, len(files), filesPerJob)):
+                    jobs.append((len(jobs), i, j, files[k:k+filesPerJob], 0, None))
+                continue
+            jobs.append((len(jobs), i, None, files, 0, None))
+        return jobs
+
+    def _runJobsInPool(self, jobs, workers, outputDir, lumidata, mergeShards):
+        '''
+        Processes the jobs in a pool of local worker processes. Each worker
+        builds its own TChain/SelectorImpl and writes its own output file.
+        The outputs of the chunks of a dataset are merged as soon as all
+        of them are finished, if \a mergeShards is True.
+        Returns the list of statistics dictionaries of the jobs.
+        '''
+        global _workerProcess
+        if len(jobs) == 0:
+            return []
+        Print("Processing %d jobs of %d datasets with %d local worker processes" % (len(jobs), len(self._datasets), workers), True)
+
+        # Number of unfinished chunks per dataset, and the expected configinfo control bin of the merged output
+        # (the sum over the distinct input files of the dataset, as in hplusMergeHistograms.sanityCheck)
+        pending = {}
+        expectedControl = {}
+        for job in jobs:
+            if job[2] is not None:
+                pending[job[1]] = pending.get(job[1], 0) + 1
+                if job[1] not in expectedControl:
+                    inputFiles = set(self._datasets[job[1]].getFileNames())
+                    expectedControl[job[1]] = sum([self._getInputControlBin(f) for f in inputFiles])
+        nChunks = dict(pending)
+
+        # The workers are forked, so they inherit the whole Process object
+        _workerProcess = (self, outputDir, lumidata)
+        pool = multiprocessing.Pool(processes=min(workers, len(jobs)), maxtasksperchild=1)
+        results = [None]*len(jobs)
+        try:
+            # A timeout in get() keeps the parent responsive to Ctrl-C (python issue 8296)
+            it = pool.imap_unordered(_processJobInWorker, jobs)
+            for n in range(len(jobs)):
+                (index, res, error) = it.next(timeout=1e7)
+                (index, idset, chunk, files, firstEntry, nEntries) = jobs[index]
+                dset = self._datasets[idset]
+                if error is not None:
+                    raise Exception("Job %d (dataset %s) failed in worker process:\n%s" % (index, dset.getName(), error))
+                results[index] = res
+                Print("Finished job %d/%d" % (n+1, len(jobs)), False)
+                if chunk is None:
+                    continue
+                pending[idset] -= 1
+                if pending[idset] == 0 and mergeShards and res is not None:
+                    resDir = os.path.join(outputDir, dset.getName(), "res")
+                    shardFiles = [os.path.join(resDir, "histograms-%s_%d.root"%(dset.getName(), j)) for j in range(nChunks[idset])]
+                    self._mergeShards(os.path.join(resDir, "histograms-%s.root"%dset.getName()), shardFiles, expectedControl[idset])
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _workerProcess = None
+        return results
+
+    def _mergeShards(self, resFileName, shardFiles, expectedControl):
+        '''
+        Merges the outputs of the file chunks or entry ranges of a dataset
+        into a single file, checks the configInfo/configinfo control bin of
+        the result, and removes the chunk files.
+
+        The histograms (including the counters and configInfo/configinfo) are
+        summed, and for the other objects the one from the first file is kept,
+        as with hadd. The configinfo of each input file is written by exactly
+        one chunk (see _getJobConfigInfo()), so the control bin of the result
+        must equal \a expectedControl, the sum of the control bins of the
+        distinct input files of the dataset. A lost or duplicated file chunk
+        changes the control bin.
+        '''
+        Verbose("_mergeShards()", True)
+        Print("Merging %d chunks into %s" % (len(shardFiles), resFileName), False)
+
+        merger = ROOT.TFileMerger(False)
+        merger.SetPrintLevel(0)
+        if not merger.OutputFile(resFileName, "RECREATE"):
+            raise Exception("Unable to create merged output file %s" % resFileName)
+        for fname in shardFiles:
+            if not merger.AddFile(fname, False):
+                raise Exception("Unable to add file %s for merging into %s" % (fname, resFileName))
+        if not merger.Merge():
+            raise Exception("Merging into %s failed" % resFileName)
+
+        # Sanity check: configInfo/configinfo control bin against the inputs (as in hplusMergeHistograms.py)
+        mergedControl = self._getControlBin(resFileName)
+        if int(round(mergedControl)) != int(round(expectedControl)):
+            raise Exception("Merged file %s has configInfo/configinfo:control = %d, while the input files of the dataset add up to %d; keeping the chunk files" % (resFileName, mergedControl, expectedControl))
+        for fname in shardFiles:
+            os.remove(fname)
+        return
+
+    def _getControlBin(self, fileName):
+        '''
+        Returns the content of the control bin of configInfo/configinfo, or 0 if there is no such histogram
+        '''
+        control = 0
+        tfile = ROOT.TFile.Open(fileName)
+        if tfile == None or tfile.IsZombie():
+            raise Exception("Unable to open file %s" % fileName)
+        configinfo = tfile.Get("configInfo/configinfo")
+        if configinfo != None:
+            for i in range(1, configinfo.GetNbinsX()+1):
+                if configinfo.GetXaxis().GetBinLabel(i) == "control":
+                    control = configinfo.GetBinContent(i)
+        ROOT.gROOT.GetListOfFiles().Remove(tfile)
+        tfile.Close()
+        return control
+
+    def _getInputControlBin(self, fileName):
+        '''
+        Returns the content of the control bin of configInfo/configinfo of an input file (from the metadata cache), or 0
+        '''
+        data = self._metadataCache.get(fileName)["configinfo"]
+        if data is None:
+            return 0
+        for i, label in enumerate(data["labels"]):
+            if label == "control":
+                return data["contents"][i+1]
+        return 0
+
+    def _getJobConfigInfo(self, files, chunk, nEntries):
+        '''
+        Returns the configinfo histogram (from the metadata cache) to be written into the output of a job, or None
+
+        A dataset processed as a whole gets the configinfo of its first file.
+        For the chunks, the configinfo of each input file is written exactly
+        once, so that the merged output has the sum over the input files:
+        a file chunk gets the sum over its files, the first entry range the
+        sum over all the files, and the other entry ranges an empty copy.
+        '''
+        cinfo = self._metadataCache.getHisto(files[0], "configinfo")
+        if cinfo is None or chunk is None:
+            return cinfo
+        if nEntries is not None and chunk > 0:
+            cinfo.Reset()
+            return cinfo
+        seen = set([files[0]])
+        for fname in files[1:]:
+            if fname in seen:
+                continue
+            seen.add(fname)
+            h = self._metadataCache.getHisto(fname, "configinfo")
+            if h is not None:
+                cinfo.Add(h)
+                h.Delete()
+        return cinfo
+
+    def _getMaxEvents(self, dset):
+        '''
+        Returns the maximum number of events to process for the dataset, or -1 for all events
+        '''
+        for k in self._maxEvents.keys():
+            if k.lower() == "all":
+                return self._maxEvents[k]
+            maxEv_re = re.compile(k)
+            if maxEv_re.search(dset.getName()):
+                return self._maxEvents[k]
+        return -1
+
+    def _processJob(self, job, outputDir, lumidata, _proof=None):
+        '''
+        Processes a single job (a dataset, or a file chunk or an entry range of it).
+        Returns a dictionary with the timing and read statistics, or
+        None if there are no analyzers for the dataset.
+        '''
+        (index, idset, chunk, files, firstEntry, nEntries) = job
+        dset = self._datasets[idset]
+        # Get data PU distributions from data
+        #   This is done every time for a dataset since memory management is simpler to handle
+        #   if all the histograms in memory are deleted after reading a dataset is finished
+        hPUs = self._getDataPUhistos()
+        # Per-dataset prepass shared by all analyzers
+        prepass = self._getDatasetPrepass(dset, files)
+        if nEntries is not None and chunk > 0:
+            # Only the first entry range carries the skim counters, to
+            # avoid multiplying them when the outputs are merged
+            prepass["SkimCounter"].Reset()
+        # Initialize
+        ndset = idset+1
+        inputList = ROOT.TList()
+        nanalyzers = 0
+        anames = []
+        usePUweights = False
+        useTopPtCorrection = False
+        nAllEventsPUWeighted = 0.0
+        configCache = PSetSerializationCache()
+        configs = []
+        for aname, analyzerIE in self._analyzers.iteritems():
+            if analyzerIE.runForDataset_(dset.getName()):
+                nanalyzers += 1
+                analyzer = analyzerIE.getAnalyzer()
+                if hasattr(analyzer, "__call__"):
+                    analyzer = analyzer(dset.getDataVersion())
+                    if analyzer is None:
+                        raise Exception("Analyzer %s was specified as a function, but returned None" % aname)
+                    if not isinstance(analyzer, Analyzer):
+                        raise Exception("Analyzer %s was specified as a function, but returned object of %s instead of Analyzer" % (aname, analyzer.__class__.__name__))
+                configCache.add(analyzer.pset_())
+                configs.append((aname, analyzer))
+                # ttbar status for top pt corrections
+                ttbarStatus = "0"
+                useTopPtCorrection = analyzer.exists("useTopPtWeights") and analyzer.__getattr__("useTopPtWeights")
+                useTopPtCorrection = useTopPtCorrection and dset.getName().startswith("TT")
+                if useTopPtCorrection:
+                    ttbarStatus = "1"
+                inputList.Add(ROOT.TNamed("isttbar", ttbarStatus))
+                # intermediate H+ status for reweighting the NoNeutral samples
+                intermediateStatus = "0"
+                if dset.getName().find("IntermediateMassNoNeutral") > 0:
+                    intermediateStatus = "1"
+                inputList.Add(ROOT.TNamed("isIntermediateNoNeutral", intermediateStatus))
+                # Pileup reweighting
+                (puAllEvents, puStatus) = self._parsePUweighting(dset, analyzer, aname, hPUs, inputList, prepass)
+                nAllEventsPUWeighted += puAllEvents
+                usePUweights = puStatus
+                # Sum skim counters (from ttree), shared by all analyzers
+                self._addToInputList(inputList, prepass, prepass["SkimCounter"])
+                # Add name
+                anames.append(aname)
+        if nanalyzers == 0:
+            print "Skipping %s, no analyzers" % dset.getName()
+            self._deletePrepass(prepass, hPUs)
+            return None
+        # Analyzer configurations, the sub-trees shared between the analyzers are written once
+        for aname, analyzer in configs:
+            inputList.Add(ROOT.TNamed("analyzer_"+aname, analyzer.className_()+":"+configCache.serialize(analyzer.pset_())))
+        for i, config in enumerate(configCache.getSharedConfigs()):
+            inputList.Add(ROOT.TNamed("psetref_%d" % i, config))
+
+        if chunk is None:
+            Print("Processing dataset (%d/%d)" % (ndset, len(self._datasets) ))
+        elif nEntries is None:
+            Print("Processing dataset (%d/%d), file chunk %d" % (ndset, len(self._datasets), chunk))
+        else:
+            Print("Processing dataset (%d/%d), entries %d-%d" % (ndset, len(self._datasets), firstEntry, firstEntry+nEntries-1))
+        align= "{:<23} {:<1} {:<60}"
+        info = {}
+        info["Dataset"] = dset.getName()
+        if dset.getDataVersion().isData():
+            lumivalue = "--- not available in lumi.json (or lumi.json not available) ---"
+            if dset.getName() in lumidata.keys():
+                lumivalue = lumidata[dset.getName()]
+            info["Luminosity"] = str(lumivalue) + " fb-1"
+        info["UsePUweights"] = usePUweights
+        info["UseTopPtCorrection"] = useTopPtCorrection
+        for key in info:
+            Print(align.format(key, ":", info[key]), False)
+
+        # Create dir for dataset ROOTT files   
+        resDir = os.path.join(outputDir, dset.getName(), "res")
+        if chunk is None:
+            resFileName = os.path.join(resDir, "histograms-%s.root"%dset.getName())
+        else:
+            resFileName = os.path.join(resDir, "histograms-%s_%d.root"%(dset.getName(), chunk))
+        if not os.path.exists(resDir):
+            os.makedirs(resDir)
+
+        tchain = ROOT.TChain("Events")
+        # For-loop: All file names for dataset
+        for f in files:
+            tchain.Add(f)
+        tchain.SetCacheLearnEntries(1000);
+        tchain.SetCacheSize(10000000) # Set cache size to 10 MB (somehow it is not automatically set contrary to ROOT docs)
+
+        tselector = ROOT.SelectorImpl()
+
+        # The number of entries is needed only to give a time
+        # estimate for the analysis, it is taken from the metadata cache
+        if nEntries is None:
+            inputList.Add(ROOT.TNamed("entries", str(self._metadataCache.getEntries(files))))
+        else:
+            inputList.Add(ROOT.TNamed("entries", str(nEntries)))
+        if dset.getDataVersion().isMC():
+            inputList.Add(ROOT.TNamed("isMC", "1"))
+        else:
+            inputList.Add(ROOT.TNamed("isMC", "0"))
+        inputList.Add(ROOT.TNamed("options", self._options.serialize_()))
+        inputList.Add(ROOT.TNamed("printStatus", "1"))
+
+        if _proof is not None:
+            tchain.SetProof(True)
+            inputList.Add(ROOT.TNamed("PROOF_OUTPUTFILE_LOCATION", resFileName))
+        else:
+            inputList.Add(ROOT.TNamed("OUTPUTFILE_LOCATION", resFileName))
+
+#        if _debugPUreweighting:
+#            print "\n\nDebug(inputlist): Input list contains:"
+#            print "--- start of input list ---"
+#            inputList.Print("",1)
+#            print "--- end of input list \n\n"
+
+        tselector.SetInputList(inputList)
+
+        readBytesStart = ROOT.TFile.GetFileBytesRead()
+        readCallsStart = ROOT.TFile.GetFileReadCalls()
+        timeStart = time.time()
+        clockStart = time.clock()
+
+        # Determine how many events to run on for given dataset
+        if nEntries is not None:
+            # Entry range (maxEvents is already taken into account in the splitting)
+            tchain.SetCacheEntryRange(firstEntry, firstEntry+nEntries)
+            tchain.Process(tselector, "", nEntries, firstEntry)
+        elif len(self._maxEvents.keys()) > 0:
+            key = ""
+            for k in self._maxEvents.keys():
+                if k.lower() == "all":
+                    key = k
+                    break
+                maxEv_re = re.compile(k)
+                match = maxEv_re.search(dset.getName())
+                if match:
+                    key = k
+                    break
+            if key == "":
+                tchain.Process(tselector)
+            else:
+                maxEvts  = self._maxEvents[key]
+                if maxEvts == -1:
+                    tchain.Process(tselector)
+                else:
+                    tchain.SetCacheEntryRange(0, self._maxEvents[key])
+                    tchain.Process(tselector, "", self._maxEvents[key])
+
+#        elif "All" in self._maxEvents:
+#            if len(self._maxEvents) == 1:
+#                if self._maxEvents["All"] == -1:
+#                    tchain.Process(tselector)
+#                else:
+#                    tchain.SetCacheEntryRange(0, self._maxEvents["All"])
+#                    tchain.Process(tselector, "", self._maxEvents["All"])
+#            else:
+#                msg  = "Ambiguous selection for number of max events to run"
+#                msg += "If \"all\" is selected no other datasets options are allowed. Got: "
+#                msg += "\n\t".join(self._maxEvents.keys())
+#                raise Exception(msg)
+#        elif dset.getName() in self._maxEvents.keys():
+#            tchain.SetCacheEntryRange(0, self._maxEvents[dset.getName()])
+#            tchain.Process(tselector, "", self._maxEvents[dset.getName()])
+        #if self._maxEvents > 0:
+        #    tchain.SetCacheEntryRange(0, self._maxEvents)
+        #    tchain.Process(tselector, "", self._maxEvents)
+        else:
+            tchain.Process(tselector)
+        if _debugMemoryConsumption:
+            print "    MEMDBG: TChain cache statistics:"
+            tchain.PrintCacheStats()
+
+        # Obtain Nall events for top pt corrections
+        #   Summed over all files of the dataset. Like N(all events PU weighted), the value
+        #   is for the whole dataset and it is written only in the first chunk, since the
+        #   configinfo of the chunks are summed when they are merged
+        firstChunk = chunk is None or chunk == 0
+        NAllEventsTopPt = 0
+        if useTopPtCorrection:
+            for inname in dset.getFileNames():
+                h = self._metadataCache.getBinContents(inname, "topPtWeightAllEvents")
+                if h != None:
+                    binNumber = 2 # nominal
+                    if hasattr(analyzer, "topPtSystematicVariation"):
+                        variation = getattr(analyzer, "topPtSystematicVariation")
+                        if variation == "minus":
+                            binNumber = 0
+                        # FIXME: The bin is to be added to the ttrees
+                        #elif variation == "plus":
+                            #binNumber = 3
+                            #if not h.GetXaxis().GetBinLabel().endsWith("Plus"):
+                                #raise Exception("This should not happen")
+                    if binNumber > 0:
+                        NAllEventsTopPt += h[binNumber]
+                else:
+                    raise Exception("Warning: Could not obtain N(AllEvents) for top pt reweighting")
+
+        # Write configInfo
+        cinfo = self._getJobConfigInfo(files, chunk, nEntries)
+        tf = ROOT.TFile.Open(resFileName, "UPDATE")
+        configInfo = tf.Get("configInfo")
+        if configInfo == None:
+            configInfo = tf.mkdir("configInfo")
+        configInfo.cd()
+        dv = ROOT.TNamed("dataVersion", str(dset.getDataVersion()))
+        dv.Write()
+        dv.Delete()
+        cv = ROOT.TNamed("codeVersionAnalysis", git.getCommitId())
+        cv.Write()
+        cv.Delete()
+        if not cinfo == None:
+            # Add more information to configInfo
+            n = cinfo.GetNbinsX()
+            cinfo.SetBins(n+3, 0, n+3)
+            cinfo.GetXaxis().SetBinLabel(n+1, "isData")
+            cinfo.GetXaxis().SetBinLabel(n+2, "isPileupReweighted")
+            cinfo.GetXaxis().SetBinLabel(n+3, "isTopPtReweighted")
+            # Add "isData" column
+            if not dset.getDataVersion().isMC():
+                cinfo.SetBinContent(n+1, cinfo.GetBinContent(1))
+            # Add "isPileupReweighted" column
+            if usePUweights and firstChunk:
+                cinfo.SetBinContent(n+2, nAllEventsPUWeighted / nanalyzers)
+            # Add "isTopPtReweighted" column
+            if useTopPtCorrection and firstChunk:
+                cinfo.SetBinContent(n+3, NAllEventsTopPt)
+            # Write
+            cinfo.Write()
+            cinfo.Delete()
+
+        # Memory management
+        configInfo.Delete()
+        ROOT.gROOT.GetListOfFiles().Remove(tf);
+        tf.Close()
+        for item in inputList:
+            if isinstance(item, ROOT.TObject):
+                item.Delete()
+        inputList = None
+        self._deletePrepass(prepass, hPUs)
+        if _debugMemoryConsumption:
+            print "      MEMDBG: gDirectory", ROOT.gDirectory.GetList().GetSize()
+            print "      MEMDBG: list ", ROOT.gROOT.GetList().GetSize()
+            print "      MEMDBG: globals ", ROOT.gROOT.GetListOfGlobals().GetSize()
+            #for item in ROOT.gROOT.GetListOfGlobals():
+                #print item.GetName()
+            print "      MEMDBG: files", ROOT.gROOT.GetListOfFiles().GetSize()
+            #for item in ROOT.gROOT.GetListOfFiles():
+            #    print "          %d items"%item.GetList().GetSize()
+            print "      MEMDBG: specials ", ROOT.gROOT.GetListOfSpecials().GetSize()
+            for item in ROOT.gROOT.GetListOfSpecials():
+                print "          "+item.GetName()
+
+            #gDirectory.GetList().Delete();
+            #gROOT.GetList().Delete();
+            #gROOT.GetListOfGlobals().Delete();
+            #TIter next(gROOT.GetList());
+            #while (TObject* o = dynamic_cast<TObject*>(next())) {
+              #o.Delete();
+            #}
+
+        # Performance and information
+        timeStop = time.time()
+        clockStop = time.clock()
+        readCallsStop = ROOT.TFile.GetFileReadCalls()
+        readBytesStop = ROOT.TFile.GetFileBytesRead()
+
+        calls = ""
+        if _proof is not None:
+            tchain.SetProof(False)
+            queryResult = _proof.GetQueryResult()
+            cpuTime = queryResult.GetUsedCPU()
+            readMbytes = queryResult.GetBytes()/1024/1024
+        else:
+            cpuTime = clockStop-clockStart
+            readMbytes = float(readBytesStop-readBytesStart)/1024/1024
+            calls = " (%d calls)" % (readCallsStop-readCallsStart)
+        realTime = timeStop-timeStart
+        align= "{:<23} {:<1} {:<60}"
+        info = {}
+        info["Real time"]    = "%.3f" % realTime + " s"
+        info["CPU time"]     = "%.3f" % cpuTime  + " s"
+        info["Read Percent"]= "%.3f" % (cpuTime/realTime*100) + " MB"
+        info["Read Size"]    = "%.3f" % (readMbytes) + " MB"
+        info["Read Calls"]   = "%s"   % (readCallsStop-readCallsStart)
+        info["Read Speed"]   = "%.3f" % (readMbytes/realTime) + " MB/s"
+        for key in info:
+            Print(align.format(key, ":", info[key]), False)
+
+        return {"realTime": realTime, "cpuTime": cpuTime, "readMbytes": readMbytes, "readCalls": readCallsStop-readCallsStart}
+
     ## Returns PU histograms for data
+    #
+    # Analyzers with the same PU direction running over the same data
+    # datasets share the same histogram object.
     def _getDataPUhistos(self):
         hPUs = {}
+        hPUsByKey = {}
         for aname, analyzerIE in self._analyzers.iteritems():
             hPU = None
             direction="nominal"
@@ -792,12 +1431,16 @@ class Process:
                     continue
             if hasattr(analyzer, "PUWeightSystematicVariation"):
                 direction=getattr(analyzer, "PUWeightSystematicVariation")
-            for dset in self._datasets:
-                if dset.getDataVersion().isData() and analyzerIE.runForDataset_(dset.getName()):
-                    if hPU is None:
-                        hPU = dset.getPileUp(direction).Clone()
-                    else:
-                        hPU.Add(dset.getPileUp(direction))
+            dataDsets = [dset for dset in self._datasets if dset.getDataVersion().isData() and analyzerIE.runForDataset_(dset.getName())]
+            key = (direction, tuple([dset.getName() for dset in dataDsets]))
+            if key in hPUsByKey:
+                hPUs[aname] = hPUsByKey[key]
+                continue
+            for dset in dataDsets:
+                if hPU is None:
+                    hPU = dset.getPileUp(direction).Clone()
+                else:
+                    hPU.Add(dset.getPileUp(direction))
             if hPU != None:
                 if direction == "plus":
                     direction_postfix="Up"
@@ -808,6 +1451,7 @@ class Process:
                 hPU.SetName("PileUpData"+direction_postfix)
                 hPU.SetDirectory(None)
                 hPUs[aname] = hPU
+                hPUsByKey[key] = hPU
 #                #Debug prints:
 #                sys.stderr.write("_getDataPUhistos saves direction ")
 #                sys.stderr.write(direction)
@@ -820,11 +1464,61 @@ class Process:
             else:
                 raise Exception("Cannot determine PU spectrum for data!")
         return hPUs
- 
-    def _parsePUweighting(self, dset, analyzer, aname, hDataPUs, inputList):
+
+    def _getDatasetPrepass(self, dset, files):
+        '''
+        Pre-processing common to all analyzers of a dataset, done once per
+        dataset instead of once per analyzer. The returned dictionary holds
+        the skim counter sum, the MC PU spectrum (created on first use in
+        _parsePUweighting()), the memoized N(all events PU weighted) per data
+        PU histogram, and the names of the objects already in the input list.
+        The analyzers share these objects through the input list (SelectorImpl
+        looks them up by name).
+        '''
+        Verbose("_getDatasetPrepass()", True)
+        prepass = {}
+        prepass["SkimCounter"] = self._getSkimCounterSum(files)
+        prepass["PileUpMC"]    = None
+        prepass["dummyPU"]     = None
+        prepass["nAllEventsPUWeighted"] = {}
+        prepass["inputNames"]  = set()
+        prepass["inputIds"]    = set()
+        return prepass
+
+    def _addToInputList(self, inputList, prepass, obj):
+        '''
+        Adds a shared object to the input list once. Only the first object
+        with a given name is visible to SelectorImpl, so later objects with
+        the same name are not added either.
+        '''
+        if obj.GetName() in prepass["inputNames"]:
+            return
+        prepass["inputNames"].add(obj.GetName())
+        prepass["inputIds"].add(id(obj))
+        inputList.Add(obj)
+        return
+
+    def _deletePrepass(self, prepass, hDataPUs):
+        '''
+        Deletes the shared objects that did not end up in the input list
+        (those are deleted together with the input list)
+        '''
+        objs = [prepass["SkimCounter"], prepass["PileUpMC"], prepass["dummyPU"]] + hDataPUs.values()
+        deleted = set(prepass["inputIds"])
+        for obj in objs:
+            if obj is None or id(obj) in deleted:
+                continue
+            deleted.add(id(obj))
+            obj.Delete()
+        return
+
+    def _parsePUweighting(self, dset, analyzer, aname, hDataPUs, inputList, prepass):
         '''
         Obtains PU histogram for MC
         Returns tuple of N(all events PU weighted) and status of enabling PU weights
+
+        The MC PU spectrum and the N(all events PU weighted) for a given data
+        PU histogram are computed only once per dataset (see _getDatasetPrepass())
         '''
         Verbose("_parsePUweighting()", True)
 
@@ -836,19 +1530,30 @@ class Process:
 #            if _debugPUreweighting:
 #                for k in range(hDataPUs[aname].GetNbinsX()):
 #                    print "DEBUG(PUreweighting,aname=%s): dataPU:%d:%f"%(aname,k+1, hDataPUs[aname].GetBinContent(k+1))
-            inputList.Add(hDataPUs[aname])
+            self._addToInputList(inputList, prepass, hDataPUs[aname])
         else:
-            n = 100
-            hFlat = ROOT.TH1F("dummyPU"+aname,"dummyPU"+aname,n,0,n)
-            hFlat.SetName("PileUpData")
-            for k in range(n):
-                hFlat.Fill(k+1, 1.0/n)
-            inputList.Add(hFlat)
-            hDataPUs[aname] = hFlat
-        if dset.getPileUp("nominal") == None:
-            raise Exception("Error: pileup spectrum is missing from dataset! Please switch to using newest multicrab!")
-        hPUMC = dset.getPileUp("nominal").Clone()
-        hPUMC.SetDirectory(None)
+            if prepass["dummyPU"] is None:
+                n = 100
+                hFlat = ROOT.TH1F("dummyPU"+aname,"dummyPU"+aname,n,0,n)
+                hFlat.SetName("PileUpData")
+                hFlat.SetDirectory(None)
+                for k in range(n):
+                    hFlat.Fill(k+1, 1.0/n)
+                prepass["dummyPU"] = hFlat
+            self._addToInputList(inputList, prepass, prepass["dummyPU"])
+            hDataPUs[aname] = prepass["dummyPU"]
+        if prepass["PileUpMC"] is None:
+            if dset.getPileUp("nominal") == None:
+                raise Exception("Error: pileup spectrum is missing from dataset! Please switch to using newest multicrab!")
+            hPUMC = dset.getPileUp("nominal").Clone()
+            hPUMC.SetDirectory(None)
+            hPUMC.SetName("PileUpMC")
+            Verbose("hPUMC.GetMean() =  %s" % (hPUMC.GetMean() ), False)
+#            if _debugPUreweighting:
+#                for k in range(hPUMC.GetNbinsX()):
+#                    print "Debug(PUreweighting): MCPU:%d:%f"%(k+1, hPUMC.GetBinContent(k+1))
+            prepass["PileUpMC"] = hPUMC
+        hPUMC = prepass["PileUpMC"]
 
         # Sanity checks: Integral and Binning
         if hDataPUs[aname].Integral() == 0.0:
@@ -857,14 +1562,8 @@ class Process:
             Verbose("hDataPUs[%s].GetMean() =  %s" % (aname, hDataPUs[aname].GetMean() ), False)
         if hPUMC.GetNbinsX() != hDataPUs[aname].GetNbinsX():
             raise Exception("Pileup histogram dimension mismatch! data nPU has %d bins and MC nPU has %d bins, for dataset \"%s\"!" % (hDataPUs[aname].GetNbinsX(), hPUMC.GetNbinsX(), dset.getName()) )
-        else:
-            Verbose("hPUMC.GetMean() =  %s" % (hPUMC.GetMean() ), False)
 
-        hPUMC.SetName("PileUpMC")
-#        if _debugPUreweighting:
-#            for k in range(hPUMC.GetNbinsX()):
-#                print "Debug(PUreweighting): MCPU:%d:%f"%(k+1, hPUMC.GetBinContent(k+1))
-        inputList.Add(hPUMC)
+        self._addToInputList(inputList, prepass, hPUMC)
 
         if analyzer.exists("usePileupWeights"):
             usePUweights = analyzer.__getattr__("usePileupWeights")           
@@ -872,14 +1571,19 @@ class Process:
                 Print("Debug(PUreweighting,aname=%s): hDataPUs[aname].Integral(): %f"%(aname,hDataPUs[aname].Integral()), True)
                 Print("Debug(PUreweighting,aname=%s): hDataPUs[aname].Mean(): %f"%(aname,hDataPUs[aname].GetMean()), True)
 
-            # Apply PU-reweighting
-            factor = hPUMC.Integral() / hDataPUs[aname].Integral()
-            for k in range(0, hPUMC.GetNbinsX()+2):
-                if hPUMC.GetBinContent(k) > 0.0:
-                    w = hDataPUs[aname].GetBinContent(k) / hPUMC.GetBinContent(k) * factor
-                    nAllEventsPUWeighted += w * hPUMC.GetBinContent(k)
+            # Apply PU-reweighting (once per data PU histogram)
+            key = id(hDataPUs[aname])
+            if key not in prepass["nAllEventsPUWeighted"]:
+                factor = hPUMC.Integral() / hDataPUs[aname].Integral()
+                for k in range(0, hPUMC.GetNbinsX()+2):
+                    if hPUMC.GetBinContent(k) > 0.0:
+                        w = hDataPUs[aname].GetBinContent(k) / hPUMC.GetBinContent(k) * factor
+                        nAllEventsPUWeighted += w * hPUMC.GetBinContent(k)
+                if _debugPUreweighting:
+                    Print("Debug(PUreweighting, aname=%s): normalization factor: %f"%(aname,factor), True)
+                prepass["nAllEventsPUWeighted"][key] = nAllEventsPUWeighted
+            nAllEventsPUWeighted = prepass["nAllEventsPUWeighted"][key]
             if _debugPUreweighting:
-                Print("Debug(PUreweighting, aname=%s): normalization factor: %f"%(aname,factor), True)
                 Print("Debug(PUreweighting, aname=%s): nAllEventsPUWeighted: %f"%(aname,nAllEventsPUWeighted), True)
 
         return (nAllEventsPUWeighted, usePUweights)
@@ -893,15 +1597,12 @@ class Process:
 
         hSkimCounterSum = None
         for inname in datasetFilenameList:
-            fIN = ROOT.TFile.Open(inname)
-            hSkimCounters = fIN.Get("configInfo/SkimCounter")
+            hSkimCounters = self._metadataCache.getHisto(inname, "SkimCounter")
             if hSkimCounterSum == None:
-                hSkimCounterSum = hSkimCounters.Clone()
-                hSkimCounterSum.SetDirectory(None) # Store the histogram to memory TDirectory, not into fIN
+                hSkimCounterSum = hSkimCounters
             else:
                 hSkimCounterSum.Add(hSkimCounters)
-            hSkimCounters.Delete()
-            fIN.Close()
+                hSkimCounters.Delete()
         if hSkimCounterSum == None:
             # Construct an empty histogram
             hSkimCounterSum = ROOT.TH1F("SkimCounter","SkimCounter",1,0,1)
@@ -981,6 +1682,77 @@ if __name__ == "__main__":
   "foo": 1
 }""")
 
+        def testCloneRecursive(self):
+            a = PSet(foo=1, bar=PSet(a=4), lst=[PSet(b=1), 2])
+            b = a.clone()
+            b.bar.a = 5
+            b.lst[0].b = 3
+            b.lst.append(4)
+            self.assertEqual(a.bar.a, 4)
+            self.assertEqual(a.lst[0].b, 1)
+            self.assertEqual(len(a.lst), 2)
+            self.assertEqual(b.bar.a, 5)
+            self.assertEqual(b.lst[0].b, 3)
+            self.assertEqual(len(b.lst), 3)
+
+            a.bar.a = 6
+            self.assertEqual(b.bar.a, 5)
+            c = b.clone()
+            self.assertEqual(c.serialize_(), b.serialize_())
+
+        def testCloneReferences(self):
+            a = PSet(foo=1, bar=PSet(a=4, sub=PSet(x=1)), lst=[PSet(b=1), 2])
+            bar = a.bar
+            sub = a.bar.sub
+            lst = a.lst
+            item = a.lst[0]
+            b = a.clone()
+            bar.a = 5
+            sub.x = 2
+            lst.append(3)
+            item.b = 4
+            self.assertEqual(a.bar.a, 5)
+            self.assertEqual(a.bar.sub.x, 2)
+            self.assertEqual(len(a.lst), 3)
+            self.assertEqual(a.lst[0].b, 4)
+            self.assertEqual(b.bar.a, 4)
+            self.assertEqual(b.bar.sub.x, 1)
+            self.assertEqual(len(b.lst), 2)
+            self.assertEqual(b.lst[0].b, 1)
+
+            # References obtained from the clone do not affect the original
+            c = a.clone()
+            cbar = c.bar
+            d = c.clone()
+            cbar.a = 6
+            self.assertEqual(a.bar.a, 5)
+            self.assertEqual(c.bar.a, 6)
+            self.assertEqual(d.bar.a, 5)
+
+        def testSerializationCache(self):
+            a = PSet(foo=1, bar=PSet(a=4, b="foo"), xyzzy=PSet(a=1))
+            b = a.clone(foo=2)
+            b.xyzzy.a = 2
+            cache = PSetSerializationCache(minimumLength=0)
+            cache.add(a)
+            cache.add(b)
+            configA = cache.serialize(a)
+            configB = cache.serialize(b)
+            shared = cache.getSharedConfigs()
+            self.assertEqual(len(shared), 1)
+            self.assertEqual(json.loads(shared[0]), {"a": 4, "b": "foo"})
+            self.assertEqual(json.loads(configA)["bar"], "@PSetRef:0")
+            self.assertEqual(json.loads(configB)["bar"], "@PSetRef:0")
+            self.assertEqual(json.loads(configA.replace('"@PSetRef:0"', shared[0])), json.loads(a.serialize_()))
+            self.assertEqual(json.loads(configB.replace('"@PSetRef:0"', shared[0])), json.loads(b.serialize_()))
+
+            # Short shared sub-trees are written inline
+            cache = PSetSerializationCache()
+            cache.add(a)
+            cache.add(b)
+            self.assertEqual(cache.serialize(a), a.serialize_())
+            self.assertEqual(len(cache.getSharedConfigs()), 0)
+
     class TestFile(unittest.TestCase):
         def testConstruct(self):
             f = File("NtupleAnalysis/python/main.py")
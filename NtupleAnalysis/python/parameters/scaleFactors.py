@@ -2,6 +2,7 @@ from HiggsAnalysis.NtupleAnalysis.main import PSet
 import json
 import csv
 import os
+import cPickle
 
 # This file contains all the scale factors and their uncertainties used in the analysis
 # There are two types of scale factors:
@@ -190,9 +191,6 @@ def _setupBtagSFDatabase(btagPset, btagPayloadFilename, direction, variationInfo
     fullname = os.path.join(os.getenv("HIGGSANALYSIS_BASE"), "NtupleAnalysis", "data", btagPayloadFilename)
     if not os.path.exists(fullname):
         raise Exception("Error: Could not find btag POG btag SF payload csv file! (tried: %s)"%fullname)
-    # Obtain header row and rows
-    headerRow = None
-    rows = []
     validAlgoHeaderPairs = {
       "pfCombinedInclusiveSecondaryVertexV2BJetTags": "CSVv2",
       "pfCombinedMVAV2BJetTags": "cMVAv2"
@@ -213,55 +211,157 @@ def _setupBtagSFDatabase(btagPset, btagPayloadFilename, direction, variationInfo
     }
     if not btagPset.__getattr__("bjetDiscrWorkingPoint") in workingPointLUT.keys():
         raise Exception("Error: Btag working point '%s' is not defined in the look-up table!"%(btagPset.__getattr__("bjetDiscrWorkingPoint")))
-    # Column names in the btag payload file
-    headerColumnIndices = {
-      "OperatingPoint": None,
-      "measurementType": None,
-      "sysType": None,
-      "jetFlavor": None,
-      "etaMin": None,
-      "etaMax": None,
-      "ptMin": None,
-      "ptMax": None,
-      "discrMin": None,
-      "discrMax": None,
-      "formula": None
-    }
-    with open(fullname, 'rb') as csvfile:
-        reader = csv.reader(csvfile)
-        for row in reader:
-            if headerRow == None:
-                headerRow = row[1:]
-                # Check that payload matches with tagger
-                if validAlgoHeaderPairs[btagPset.__getattr__("bjetDiscr")] != row[0]:
-                    raise Exception("Error: btag algo = %s is incompatible with btag SF payload file header '%s' (expected %s)!"%(btagPset.__getattr__("bjetDiscr"), row[0], validAlgoHeaderPairs[btagPset.__getattr__("bjetDiscr")]))
-                # Obtain column indices
-                for key in headerColumnIndices.keys():
-                    for i in range(len(headerRow)):
-                        if headerRow[i] == key or headerRow[i] == " "+key or headerRow[i] == " "+key+" ":
-                            headerColumnIndices[key] = i
-                    if headerColumnIndices[key] == None:
-                        raise Exception("Error: could not find column '%s' in file %s:\n  header = %s"%(key, fullname, headerRow))
-            else:
-                # Store only the rows which apply for the desired variation and working point
-                if row[headerColumnIndices["OperatingPoint"]] == workingPointLUT[btagPset.__getattr__("bjetDiscrWorkingPoint")]:
-                    rows.append(row)
+    table = loadBtagSFPayload(fullname)
+    # Check that payload matches with tagger
+    if validAlgoHeaderPairs[btagPset.__getattr__("bjetDiscr")] != table.getAlgo():
+        raise Exception("Error: btag algo = %s is incompatible with btag SF payload file header '%s' (expected %s)!"%(btagPset.__getattr__("bjetDiscr"), table.getAlgo(), validAlgoHeaderPairs[btagPset.__getattr__("bjetDiscr")]))
+    # Store only the rows which apply for the desired working point
+    rows = table.getRows(operatingPoint=workingPointLUT[btagPset.__getattr__("bjetDiscrWorkingPoint")])
     if len(rows) == 0:
         raise Exception("Error: for unknown reason, no entries found from the btag SF payload (%s)!"%fullname)
-    # Convert output into vector of PSets
-    psetList = []
-    for row in rows:
-        p = PSet(jetFlavor=int(row[headerColumnIndices["jetFlavor"]]),
-                 ptMin=float(row[headerColumnIndices["ptMin"]]), 
-                 ptMax=float(row[headerColumnIndices["ptMax"]]), 
-                 etaMin=float(row[headerColumnIndices["etaMin"]]), 
-                 etaMax=float(row[headerColumnIndices["etaMax"]]), 
-                 discrMin=float(row[headerColumnIndices["discrMin"]]), 
-                 discrMax=float(row[headerColumnIndices["discrMax"]]), 
-                 sysType=row[headerColumnIndices["sysType"]],
-                 formula=row[headerColumnIndices["formula"]])
-        psetList.append(p)
-    btagPset.btagSF = psetList
+    # Pass the rows as packed columns instead of one PSet per row
+    btagPset.btagSFTable = PSet(**table.packRows(rows))
+
+## Indexed table of the rows of a btag POG SF payload csv file
+#
+# The rows are stored in file order as tuples with the columns of
+# BtagSFPayloadTable.columns, and indexed by the key
+# (OperatingPoint, measurementType, sysType, jetFlavor) with the
+# surrounding spaces stripped. The string values in the rows are kept
+# as in the file (e.g. sysType " central"), because the C++ side
+# expects them in that form.
+class BtagSFPayloadTable:
+    ## Columns of the stored rows
+    columns = ["OperatingPoint", "measurementType", "sysType", "jetFlavor", "etaMin", "etaMax", "ptMin", "ptMax", "discrMin", "discrMax", "formula"]
+    ## Columns passed to the C++ side by packRows()
+    packedColumns = ["jetFlavor", "ptMin", "ptMax", "etaMin", "etaMax", "discrMin", "discrMax", "sysType", "formula"]
+    _converters = {
+      "jetFlavor": int,
+      "etaMin": float,
+      "etaMax": float,
+      "ptMin": float,
+      "ptMax": float,
+      "discrMin": float,
+      "discrMax": float,
+    }
+
+    def __init__(self, algo, rows):
+        self._algo = algo
+        self._rows = rows
+        self._columnIndex = dict((c, i) for i, c in enumerate(self.columns))
+        self._index = {}
+        iOP = self._columnIndex["OperatingPoint"]
+        iType = self._columnIndex["measurementType"]
+        iSys = self._columnIndex["sysType"]
+        iFlavor = self._columnIndex["jetFlavor"]
+        for i, row in enumerate(rows):
+            key = (row[iOP].strip(), row[iType].strip(), row[iSys].strip(), row[iFlavor])
+            self._index.setdefault(key, []).append(i)
+
+    ## Parse a payload csv file
+    @classmethod
+    def fromCsv(cls, fileName):
+        algo = None
+        columnIndices = None
+        rows = []
+        with open(fileName, 'rb') as csvfile:
+            reader = csv.reader(csvfile)
+            for row in reader:
+                if algo == None:
+                    algo = row[0]
+                    headerRow = row[1:]
+                    # Obtain column indices
+                    columnIndices = []
+                    for key in cls.columns:
+                        index = None
+                        for i in range(len(headerRow)):
+                            if headerRow[i] == key or headerRow[i] == " "+key or headerRow[i] == " "+key+" ":
+                                index = i
+                        if index == None:
+                            raise Exception("Error: could not find column '%s' in file %s:\n  header = %s"%(key, fileName, headerRow))
+                        columnIndices.append((index, cls._converters.get(key, None)))
+                else:
+                    values = []
+                    for (i, converter) in columnIndices:
+                        if converter == None:
+                            values.append(row[i])
+                        else:
+                            values.append(converter(row[i]))
+                    rows.append(tuple(values))
+        return cls(algo, rows)
+
+    def getAlgo(self):
+        return self._algo
+
+    def getFileRows(self):
+        return self._rows
+
+    ## Return the rows (in file order) matching the given key values (None matches all)
+    def getRows(self, operatingPoint=None, measurementType=None, sysType=None, jetFlavor=None):
+        selection = (operatingPoint, measurementType, sysType, jetFlavor)
+        indices = []
+        for key, keyIndices in self._index.iteritems():
+            match = True
+            for value, keyValue in zip(selection, key):
+                if value != None and value != keyValue:
+                    match = False
+                    break
+            if match:
+                indices.extend(keyIndices)
+        indices.sort()
+        return [self._rows[i] for i in indices]
+
+    ## Convert rows to a dictionary of column name -> list of values
+    def packRows(self, rows):
+        result = {}
+        for column in self.packedColumns:
+            i = self._columnIndex[column]
+            result[column] = [row[i] for row in rows]
+        return result
+
+## Version of the binary cache format, increment when BtagSFPayloadTable changes
+_btagSFPayloadCacheVersion = 1
+## Payload tables loaded in this process, keyed by file name
+_btagSFPayloadTables = {}
+
+## Load a btag POG SF payload csv file as BtagSFPayloadTable
+#
+# The table is parsed once per process. The parsed rows are also stored
+# to a binary cache file next to the csv file ("<file>.cache"), which
+# is used as long as the modification time and size of the csv file are
+# unchanged. Failures to write the cache are ignored, the cache is just
+# an optimisation.
+def loadBtagSFPayload(fileName):
+    st = os.stat(fileName)
+    stamp = (st.st_mtime, st.st_size)
+    cached = _btagSFPayloadTables.get(fileName, None)
+    if cached != None and cached[0] == stamp:
+        return cached[1]
+
+    cacheFileName = fileName + ".cache"
+    table = None
+    if os.path.exists(cacheFileName):
+        try:
+            f = open(cacheFileName, "rb")
+            content = cPickle.load(f)
+            f.close()
+            if content["version"] == _btagSFPayloadCacheVersion and content["stamp"] == stamp:
+                table = BtagSFPayloadTable(content["algo"], content["rows"])
+        except Exception:
+            table = None
+    if table == None:
+        table = BtagSFPayloadTable.fromCsv(fileName)
+        tmpName = cacheFileName + ".tmp%d" % os.getpid()
+        try:
+            f = open(tmpName, "wb")
+            cPickle.dump({"version": _btagSFPayloadCacheVersion, "stamp": stamp, "algo": table.getAlgo(), "rows": table.getFileRows()}, f, cPickle.HIGHEST_PROTOCOL)
+            f.close()
+            os.rename(tmpName, cacheFileName)
+        except (IOError, OSError):
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+    _btagSFPayloadTables[fileName] = (stamp, table)
+    return table
 
 ## Helper function accessed through setupBtagSFInformation
 def _setupBtagEfficiency(btagPset, btagEfficiencyFilename, direction, variationInfo):
@@ -2172,7 +2172,11 @@ class EventCounter:
     # \param mainCounterOnly     If True, read only the main counter (default: False)
     # \param kwargs              Keyword arguments, passed to Dataset.getDatasetRootHisto() when reading the counter histograms
     #
-    # Creates counter.Counter for the main counter and each subcounter
+    # Creates counter.Counter for the main counter. The counter.Counter
+    # of a subcounter is created when it is accessed for the first
+    # time, and the operations done so far (removeColumns(),
+    # normalization, scaling) are then applied to it. Hence the
+    # datasets must not be closed while the EventCounter is in use.
     def __init__(self, datasets, countNameFunction=None, counters=None, mainCounterOnly=False, **kwargs):
         counterNames = {}
 
@@ -2196,9 +2200,12 @@ class EventCounter:
                 else:
                     if counterDir != dataset.getCounterDirectory():
                         raise Exception("Sanity check failed, datasets have different counter directories!")
-        # Pick all possible names of counters
+        # Pick all possible names of counters (from the TKeys, without reading the histograms)
+        def isTH1(key):
+            cls = ROOT.TClass.GetClass(key.GetClassName())
+            return cls != None and cls.InheritsFrom("TH1")
         for dataset in allDatasets:
-            for name in dataset.getDirectoryContent(counterDir, lambda obj: isinstance(obj, ROOT.TH1)):
+            for name in dataset.getDirectoryContent(counterDir, keyPredicate=isTH1):
                 counterNames[name] = 1
 
         try:
@@ -2208,15 +2215,14 @@ class EventCounter:
 
         def getDatasetRootHistos(path):
             return [d.getDatasetRootHisto(path, **kwargs) for d in allDatasets]
+        self._createCounter = lambda name: Counter(getDatasetRootHistos(counterDir+"/"+name), countNameFunction)
 
-        self.mainCounter = Counter(getDatasetRootHistos(counterDir+"/counter"), countNameFunction)
+        self.mainCounter = self._createCounter("counter")
         self.subCounters = {}
+        self._subCounterNames = []
         if not mainCounterOnly:
-            for subname in counterNames.keys():
-                try:
-                    self.subCounters[subname] = Counter(getDatasetRootHistos(counterDir+"/"+subname), countNameFunction)
-                except:
-                    pass
+            self._subCounterNames = counterNames.keys()
+        self._operations = []
 
         self.normalization = "None"
 
@@ -2230,10 +2236,25 @@ class EventCounter:
         self.mainCounter.removeRows(counterName)
 
     ## Loop through all counters calling the given function
+    #
+    # The function is recorded, and applied to the subcounters created later
     def _forEachCounter(self, func):
         func(self.mainCounter)
         for c in self.subCounters.itervalues():
             func(c)
+        self._operations.append(func)
+
+    ## Create the counter.Counter of a subcounter (if not done already)
+    def _getSubCounter(self, name):
+        if name in self.subCounters:
+            return self.subCounters[name]
+        if name not in self._subCounterNames:
+            raise KeyError(name)
+        c = self._createCounter(name)
+        for func in self._operations:
+            func(c)
+        self.subCounters[name] = c
+        return c
 
     ## Set normalization scheme to unit area
     def normalizeToOne(self):
@@ -2282,19 +2303,19 @@ class EventCounter:
 
     ## Get names of subcounters
     def getSubCounterNames(self):
-        return self.subCounters.keys()
+        return self._subCounterNames[:]
 
     ## Get the counter.Counter of a subcounter
     #
     # \param name  Name of subcounter
     def getSubCounter(self, name):
-        return self.subCounters[name]
+        return self._getSubCounter(name)
 
     ## Get the counter.CounterTable from a subcounter
     #
     # \param name  Name of subcounter
     def getSubCounterTable(self, name):
-        return self.subCounters[name].getTable()
+        return self._getSubCounter(name).getTable()
 
     ## Get current normalization scheme string
     def getNormalizationString(self):
@@ -2303,7 +2324,7 @@ class EventCounter:
     ## \var mainCounter
     # counter.Counter object for the main counter
     ## \var subCounters
-    # Dictionary of counter.Counter objects for the subcounters.
-    # Subcounter names serve as the keys.
+    # Dictionary of counter.Counter objects for the subcounters created
+    # so far. Subcounter names serve as the keys.
     ## \var normalization
     # Name of current normalization scheme
@@ -16,7 +16,9 @@ import copy
 import time
 import StringIO
 import hashlib
+import json
 import array
+import numpy
 import socket
 from collections import OrderedDict
 
@@ -35,6 +37,8 @@ from sys import platform as _platform
 #================================================================================================
 DEBUG = False
 _debugNAllEvents = False
+# Memory limit of the histogram cache shared by all Datasets of the process (see RootObjectCache)
+_rootObjectCacheMaxBytes = 64*1024*1024
 _debugCounters = False
 
 # era name -> list of era parts in data dataset names
@@ -401,6 +405,10 @@ def addOptions(parser, analysisName=None, searchMode=None, dataEra=None, optimiz
                       help="List available analysis name information, and quit.")
     parser.add_option("--counterDir", "-c", dest="counterDir", type="string", default=None,
                       help="TDirectory name containing the counters, relative to the analysis directory (default: analysisDirectory+'/counters')")
+    parser.add_option("--useMetadataIndex", dest="useMetadataIndex", action="store_true", default=None,
+                      help="Read the dataset metadata from the index file '%s' in the multicrab directory (created/updated if necessary) instead of opening all ROOT files (default for multicrab directories)" % _metadataIndexFileName)
+    parser.add_option("--noMetadataIndex", dest="useMetadataIndex", action="store_false",
+                      help="Do not use (nor create) the dataset metadata index, read the metadata from the ROOT files")
     return
 
 
@@ -617,6 +625,44 @@ def histoIntegrateToCount(histo):
         count.add(Count(histo.GetBinContent(bin), histo.GetBinError(bin)))
     return count
 
+## NumPy dtypes of the TArray storage of the TH1 classes
+_histoArrayTypes = [("TArrayD", numpy.float64), ("TArrayF", numpy.float32), ("TArrayI", numpy.int32),
+                    ("TArrayS", numpy.int16), ("TArrayC", numpy.int8)]
+
+## Get the bin contents of TH1/TH2/TH3 as NumPy array
+#
+# \param histo  TH1 histogram
+#
+# \return numpy.array (float64) of all cells (i.e. indexed by the
+# global bin number, including the under/overflow bins)
+def _histoContentsArray(histo):
+    n = histo.GetSize()
+    if not isinstance(histo, ROOT.TProfile):
+        for (arrayType, dtype) in _histoArrayTypes:
+            if isinstance(histo, getattr(ROOT, arrayType)):
+                return numpy.frombuffer(histo.GetArray(), dtype=dtype, count=n).astype(numpy.float64)
+    return numpy.array([histo.GetBinContent(i) for i in xrange(n)], dtype=numpy.float64)
+
+## Get the bin errors of TH1/TH2/TH3 as NumPy array
+#
+# \param histo  TH1 histogram
+#
+# \return numpy.array of all cells, see _histoContentsArray()
+def _histoErrorsArray(histo):
+    n = histo.GetSize()
+    if isinstance(histo, ROOT.TProfile) or histo.GetBinErrorOption() != ROOT.TH1.kNormal:
+        return numpy.array([histo.GetBinError(i) for i in xrange(n)], dtype=numpy.float64)
+    if histo.GetSumw2N() > 0:
+        return numpy.sqrt(numpy.frombuffer(histo.GetSumw2().GetArray(), dtype=numpy.float64, count=n))
+    return numpy.sqrt(numpy.abs(_histoContentsArray(histo)))
+
+## Set the bin contents of TH1/TH2/TH3 from NumPy array
+#
+# \param histo   TH1 histogram
+# \param values  numpy.array of all cells, see _histoContentsArray()
+def _setHistoContentsArray(histo, values):
+    histo.SetContent(array.array("d", values.tolist()))
+
 ## Rescales info dictionary.
 # 
 # Assumes that d has a 'control' key for a numeric value, and then
@@ -833,12 +879,7 @@ class TreeDraw:
         if self.varexp != "" and not ">>" in self.varexp:
             raise Exception("varexp should include explicitly the histogram binning (%s)"%self.varexp)
 
-        selection = self.selection
-        if len(self.weight) > 0:
-            if len(selection) > 0:
-                selection = "%s * (%s)" % (self.weight, selection)
-            else:
-                selection = self.weight
+        selection = self.getSelection()
 
         (tree, treeName) = dataset.createRootChain(self.tree)
         if tree == None:
@@ -872,7 +913,25 @@ class TreeDraw:
 
         h.SetName(dataset.getName()+"_"+h.GetName())
         h.SetDirectory(0)
+        self.setBinLabels(h, selection, option)
+        return h
 
+    ## Selection expression including the weight
+    def getSelection(self):
+        selection = self.selection
+        if len(self.weight) > 0:
+            if len(selection) > 0:
+                selection = "%s * (%s)" % (self.weight, selection)
+            else:
+                selection = self.weight
+        return selection
+
+    ## Set the bin labels (if given) to a histogram produced by draw()
+    #
+    # \param h          TH1 to modify
+    # \param selection  Selection expression (for error message)
+    # \param option     TTree.Draw option (for error message)
+    def setBinLabels(self, h, selection, option):
         for axis in ["X", "Y", "Z"]:
             if getattr(self, "binLabels"+axis) is not None:
                 labels = getattr(self, "binLabels"+axis)
@@ -880,13 +939,11 @@ class TreeDraw:
                 nbins = getattr(h, "GetNbins"+axis)()
                 if nlabels != nbins:
                     raise Exception("Trying to set %s bin labels, bot %d labels, histogram has %d bins. \ntree:       %s\nvarexp:     %s\nselection:  %s\noption:     %s" %
-                                    (axis, nlabels, nbins, self.tree, varexp, selection, option))
+                                    (axis, nlabels, nbins, self.tree, self.varexp, selection, option))
                 axisObj = getattr(h, "Get"+axis+"axis")()
                 for i, label in enumerate(labels):
                     axisObj.SetBinLabel(i+1, label)
 
-        return h
-
 
     ## \var tree
     # Path to the TTree object in a file
@@ -1033,6 +1090,9 @@ def _treeDrawToNumEntriesSingle(treeDraw):
 # Seems to be used only from DatasetQCDData class, which was never
 # finished.
 def treeDrawToNumEntries(treeDraw):
+    if isinstance(treeDraw, BatchedTreeDraw):
+        # Register the number of entries request to the same batch
+        return treeDraw.transform(treeDrawToNumEntries)
     if isinstance(treeDraw, TreeDrawCompound):
         td = TreeDrawCompound(_treeDrawToNumEntriesSingle(treeDraw.default))
         for name, td2 in treeDraw.datasetMap.iteritems():
@@ -1042,6 +1102,383 @@ def treeDrawToNumEntries(treeDraw):
         return _treeDrawToNumEntriesSingle(treeDraw)
 
 
+## C++ code filling the histograms of many TTree.Draw requests in one event loop
+#
+# The TTreeFormula handling follows TSelectorDraw: the formulas of a
+# request share a TTreeFormulaManager, instance 0 is always evaluated
+# (it loads the branches), and for array variables all instances
+# passing the selection are filled. As in TTree.Draw, the variables of
+# a multi-dimensional request are given as in the varexp ("y:x"), and
+# the last one goes to the X axis. Requests with zero dimensions
+# count the selected entries (as TTree.GetEntries(selection)).
+_treeDrawBatchCode = """
+#include "TTree.h"
+#include "TTreeFormula.h"
+#include "TTreeFormulaManager.h"
+#include "TH1.h"
+#include "TH2.h"
+#include "TH3.h"
+#include <string>
+#include <vector>
+
+namespace TreeDrawBatch {
+  // Returns the number of processed entries, or -1-i if the formulas of request i can not be compiled
+  Long64_t fill(TTree *tree, const std::vector<int>& ndims, const std::vector<std::string>& variables,
+                const std::vector<std::string>& selections, const std::vector<TH1 *>& histos,
+                std::vector<double>& counts) {
+    const size_t nreq = ndims.size();
+    std::vector<std::vector<TTreeFormula *> > vars(nreq);
+    std::vector<std::vector<bool> > varMultiple(nreq);
+    std::vector<TTreeFormula *> selects(nreq, 0);
+    std::vector<bool> selectMultiple(nreq, false);
+    std::vector<TTreeFormulaManager *> managers(nreq, 0);
+    std::vector<TTreeFormula *> all;
+    counts.assign(nreq, 0.0);
+
+    Long64_t ret = 0;
+    tree->LoadTree(0);
+    size_t ivar = 0;
+    for (size_t i = 0; i < nreq && ret == 0; ++i) {
+      std::vector<TTreeFormula *> formulas;
+      for (int d = 0; d < ndims[i]; ++d, ++ivar) {
+        TTreeFormula *f = new TTreeFormula(Form("var%d_%d", int(i), d), variables[ivar].c_str(), tree);
+        all.push_back(f);
+        if (f->GetNdim() == 0) {
+          ret = -1 - Long64_t(i);
+          break;
+        }
+        vars[i].push_back(f);
+        varMultiple[i].push_back(f->GetMultiplicity() != 0);
+        formulas.push_back(f);
+      }
+      if (ret == 0 && !selections[i].empty()) {
+        TTreeFormula *f = new TTreeFormula(Form("select%d", int(i)), selections[i].c_str(), tree);
+        all.push_back(f);
+        if (f->GetNdim() == 0) {
+          ret = -1 - Long64_t(i);
+          break;
+        }
+        selects[i] = f;
+        selectMultiple[i] = f->GetMultiplicity() != 0;
+        formulas.push_back(f);
+      }
+      if (ret == 0 && !formulas.empty()) {
+        managers[i] = new TTreeFormulaManager();
+        for (size_t k = 0; k < formulas.size(); ++k)
+          managers[i]->Add(formulas[k]);
+        managers[i]->Sync();
+      }
+    }
+
+    const Long64_t nentries = tree->GetEntries();
+    int treeNumber = -1;
+    double values[3] = {0, 0, 0};
+    for (Long64_t entry = 0; ret >= 0 && entry < nentries; ++entry) {
+      if (tree->LoadTree(entry) < 0)
+        break;
+      if (tree->GetTreeNumber() != treeNumber) {
+        treeNumber = tree->GetTreeNumber();
+        for (size_t k = 0; k < all.size(); ++k)
+          all[k]->UpdateFormulaLeaves();
+      }
+      ++ret;
+
+      for (size_t i = 0; i < nreq; ++i) {
+        const int ndata = managers[i] ? managers[i]->GetNdata() : 1;
+        if (ndata == 0)
+          continue;
+        const int ndim = ndims[i];
+        double w0 = selects[i] ? selects[i]->EvalInstance(0) : 1.0;
+        if (w0 == 0 && !selectMultiple[i])
+          continue;
+        for (int d = 0; d < ndim; ++d)
+          values[d] = vars[i][d]->EvalInstance(0);
+
+        for (int j = 0; j < ndata; ++j) {
+          double w = w0;
+          if (j > 0) {
+            bool multiple = selectMultiple[i];
+            if (selectMultiple[i])
+              w = selects[i]->EvalInstance(j);
+            for (int d = 0; d < ndim; ++d) {
+              if (varMultiple[i][d]) {
+                values[d] = vars[i][d]->EvalInstance(j);
+                multiple = true;
+              }
+            }
+            if (!multiple)
+              break;
+          }
+          if (w == 0)
+            continue;
+
+          if (ndim == 0) {
+            // Count entries, not instances, like TTree::GetEntries(selection)
+            counts[i] += 1;
+            break;
+          }
+          else if (ndim == 1)
+            histos[i]->Fill(values[0], w);
+          else if (ndim == 2)
+            static_cast<TH2 *>(histos[i])->Fill(values[1], values[0], w);
+          else
+            static_cast<TH3 *>(histos[i])->Fill(values[2], values[1], values[0], w);
+        }
+      }
+    }
+
+    // The managers are deleted together with their last formula
+    for (size_t k = 0; k < all.size(); ++k)
+      delete all[k];
+    return ret;
+  }
+}
+"""
+_treeDrawBatchCodeLoaded = False
+
+def _loadTreeDrawBatchCode():
+    global _treeDrawBatchCodeLoaded
+    if _treeDrawBatchCodeLoaded:
+        return
+    if not ROOT.gInterpreter.Declare(_treeDrawBatchCode):
+        raise Exception("Failed to compile the TreeDrawBatch code")
+    _treeDrawBatchCodeLoaded = True
+
+_treeDrawHisto_re = re.compile("^\s*(?P<name>[^\s(+]+)\s*\((?P<binning>[^)]*)\)\s*$")
+
+def _splitTreeDrawVarexp(expression):
+    '''
+    Split the variable part of a TTree.Draw varexp at the ':'
+    separators (ignoring '::' and anything within parentheses)
+    '''
+    ret = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(expression):
+        if c in "([":
+            depth += 1
+        elif c in ")]":
+            depth -= 1
+        elif c == ":" and depth == 0:
+            if expression[i-1:i] == ":" or expression[i+1:i+2] == ":":
+                continue
+            ret.append(expression[start:i])
+            start = i+1
+    ret.append(expression[start:])
+    return ret
+
+def _parseTreeDrawVarexp(varexp):
+    '''
+    Parse 'y:x>>name(nx,xmin,xmax,ny,ymin,ymax)' style varexp
+
+    \return tuple (list of variable expressions in the varexp order,
+    histogram name, list of (nbins, min, max) per axis), or None if
+    the varexp can not be handled by TreeDrawBatch (e.g. automatic
+    binning or filling an existing histogram)
+    '''
+    if varexp.count(">>") != 1:
+        return None
+    (variables, histo) = varexp.split(">>")
+    m = _treeDrawHisto_re.search(histo)
+    if not m:
+        return None
+    variables = _splitTreeDrawVarexp(variables)
+    if len(variables) > 3 or "" in [v.strip() for v in variables]:
+        return None
+    try:
+        binning = [float(b) for b in m.group("binning").split(",")]
+    except ValueError:
+        return None
+    if len(binning) != 3*len(variables):
+        return None
+    axes = []
+    for i in xrange(len(variables)):
+        (nbins, xmin, xmax) = binning[3*i:3*i+3]
+        if nbins < 1 or nbins != int(nbins) or xmin >= xmax:
+            return None
+        axes.append((int(nbins), xmin, xmax))
+    return (variables, m.group("name"), axes)
+
+
+#================================================================================================
+# Class Definition
+#================================================================================================
+class TreeDrawBatch:
+    '''
+    Fill the histograms of many dataset.TreeDraw objects in one pass over the TTree
+
+    Each dataset.TreeDraw.draw() call runs a full TTree.Draw event
+    loop. With this class the TreeDraw (or TreeDrawCompound) objects
+    are first registered with add(), which returns an object to be
+    given to dataset.Dataset.getDatasetRootHisto() (and everything
+    built on top of it, e.g. plots) instead of the TreeDraw. When the
+    first of them is drawn for a dataset, the histograms of all
+    registered objects not yet drawn for that dataset are filled in a
+    single event loop per TTree, and the rest of them are returned
+    from memory.
+
+    Requests which can not be batched (e.g. varexp with automatic
+    binning) are drawn with TreeDraw.draw().
+
+    Example:
+    \code
+    batch = dataset.TreeDrawBatch()
+    td = dataset.TreeDraw("tree", weight="weight")
+    tds = [batch.add(td.clone(varexp=v)) for v in ["MET>>met(50,0,500)", "tauPt>>taupt(50,0,500)"]]
+    for t in tds:
+        plots.DataMCPlot(datasets, t)
+    \endcode
+    '''
+    def __init__(self):
+        self._requests = []
+        self._results = {}
+
+    ## Register a TreeDraw/TreeDrawCompound
+    #
+    # \return BatchedTreeDraw object to be drawn instead of \a treeDraw
+    def add(self, treeDraw):
+        request = BatchedTreeDraw(self, treeDraw)
+        self._requests.append(request)
+        return request
+
+    ## Release the histograms not yet requested
+    def clear(self):
+        self._results = {}
+
+    def _draw(self, request, dataset):
+        results = self._results.setdefault(dataset, {})
+        if request not in results:
+            # Fill everything not yet drawn for this dataset
+            requests = [r for r in self._requests if r not in results]
+            if request not in requests:
+                requests.append(request)
+            results.update(self._fill(dataset, requests))
+        h = results[request]
+        results[request] = None # drawn, drawing again re-runs the request
+        if h is None:
+            h = self._fill(dataset, [request])[request]
+        return h
+
+    def _fill(self, dataset, requests):
+        ret = {}
+        trees = OrderedDict()
+        for request in requests:
+            td = request.getTreeDraw(dataset)
+            if not isinstance(td, TreeDraw):
+                ret[request] = td.draw(dataset)
+                continue
+            trees.setdefault(td.tree, []).append((request, td))
+        for treeName, lst in trees.iteritems():
+            ret.update(self._fillTree(dataset, treeName, lst))
+        return ret
+
+    def _fillTree(self, dataset, treeName, requests):
+        ret = {}
+        batched = []
+        for (request, td) in requests:
+            if td.varexp == "":
+                batched.append((request, td, None))
+                continue
+            parsed = _parseTreeDrawVarexp(td.varexp)
+            if parsed is None:
+                ret[request] = td.draw(dataset)
+            else:
+                batched.append((request, td, parsed))
+        if len(batched) == 0:
+            return ret
+
+        (tree, realTreeName) = dataset.createRootChain(treeName)
+        if tree == None:
+            raise Exception("No TTree '%s' in file %s" % (realTreeName, dataset.getRootFile().GetName()))
+
+        _loadTreeDrawBatchCode()
+        ndims = ROOT.std.vector("int")()
+        variables = ROOT.std.vector("string")()
+        selections = ROOT.std.vector("string")()
+        histos = ROOT.std.vector("TH1*")()
+        counts = ROOT.std.vector("double")()
+        created = []
+        for (request, td, parsed) in batched:
+            selection = td.getSelection()
+            selections.push_back(selection)
+            if parsed is None:
+                ndims.push_back(0)
+                histos.push_back(ROOT.MakeNullPointer(ROOT.TH1))
+                created.append(None)
+                continue
+            (exprs, histoName, axes) = parsed
+            ndims.push_back(len(exprs))
+            for e in exprs:
+                variables.push_back(e)
+            title = td.varexp.split(">>")[0]
+            if len(selection) > 0:
+                title += " {%s}" % selection
+            args = [dataset.getName()+"_"+histoName, title]
+            for axis in axes:
+                args.extend(axis)
+            h = getattr(ROOT, "TH%dF" % len(exprs))(*args)
+            h.SetDirectory(0)
+            if len(td.weight) > 0:
+                h.Sumw2()
+            histos.push_back(h)
+            created.append(h)
+
+        nentries = ROOT.TreeDrawBatch.fill(tree, ndims, variables, selections, histos, counts)
+        if nentries < 0:
+            (request, td, parsed) = batched[-1-nentries]
+            raise Exception("Error when compiling the TTree formulas with the following parameters for dataset %s\ntree:       %s\nvarexp:     %s\nselection:  %s" % (dataset.getName(), realTreeName, td.varexp, td.getSelection()))
+
+        for i, (request, td, parsed) in enumerate(batched):
+            h = created[i]
+            if h is None:
+                # Same as TreeDraw.draw() for the number of selected entries
+                selection = td.getSelection()
+                n = counts[i]
+                h = ROOT.TH1F("nentries", "Number of entries by selection %s"%selection, 1, 0, 1)
+                h.SetDirectory(0)
+                if len(td.weight) > 0:
+                    h.Sumw2()
+                h.SetBinContent(1, n)
+                h.SetBinError(1, math.sqrt(n))
+            else:
+                td.setBinLabels(h, td.getSelection(), "batch")
+            ret[request] = h
+        return ret
+
+    ## \var _requests
+    # List of registered BatchedTreeDraw objects
+    ## \var _results
+    # Dictionary of Dataset -> dictionary of BatchedTreeDraw -> TH1
+    # (None if already drawn)
+
+class BatchedTreeDraw:
+    '''
+    TreeDraw registered to dataset.TreeDrawBatch, created by TreeDrawBatch.add()
+    '''
+    def __init__(self, batch, treeDraw):
+        self._batch = batch
+        self._treeDraw = treeDraw
+
+    ## Return the TreeDraw to use for a dataset (resolves TreeDrawCompound)
+    def getTreeDraw(self, dataset):
+        if isinstance(self._treeDraw, TreeDrawCompound):
+            return self._treeDraw.datasetMap.get(dataset.getName(), self._treeDraw.default)
+        return self._treeDraw
+
+    ## Clone the TreeDraw and register the clone to the same batch
+    def clone(self, **kwargs):
+        return self._batch.add(self._treeDraw.clone(**kwargs))
+
+    ## Apply a function to the TreeDraw/TreeDrawCompound and register the result to the same batch
+    #
+    # \param function  Function taking a TreeDraw/TreeDrawCompound and returning a new one
+    def transform(self, function):
+        return self._batch.add(function(self._treeDraw))
+
+    def draw(self, dataset):
+        return self._batch._draw(self, dataset)
+
+
 #================================================================================================
 # Class Definition
 #================================================================================================
@@ -1351,12 +1788,10 @@ class RootHistoWithUncertainties:
             raise Exception("getRate(): The under/overflow bins might not be not empty! Did you forget to call makeFlowBinsVisible() before getRate()?")
         if len(self._treatShapesAsStat) > 0:
             print "WARNING: some shapes are treated as statistical uncertainty, but they have not been implemented yet to getRateStatUncertainty()!"
-        mySum = 0.0
         if isinstance(self._rootHisto, ROOT.TH2):
             raise Exception("getRateStatUncertainty() supported currently only for TH1!")
-        for i in range(1, self._rootHisto.GetNbinsX()+1):
-            mySum += self._rootHisto.GetBinError(i)**2
-        return math.sqrt(mySum)
+        errors = _histoErrorsArray(self._rootHisto)[1:self._rootHisto.GetNbinsX()+1]
+        return math.sqrt(numpy.sum(errors**2))
 
     ## Get the syst. uncertainty of the root histo object
     def getRateSystUncertainty(self):
@@ -1388,14 +1823,14 @@ class RootHistoWithUncertainties:
     ## Sets negative bins to zero events
     def treatNegativeBins(self, minimumStatUncertainty):
         def treatBins(h):
-            for i in range(h.GetNbinsX()):
-                if h.GetBinContent(i+1) < 0.0:
-                    h.SetBinContent(i+1, 0.0)
+            contents = _histoContentsArray(h)[1:h.GetNbinsX()+1]
+            for i in numpy.flatnonzero(contents < 0.0):
+                h.SetBinContent(int(i)+1, 0.0)
         # Treat negative bins in rate histo
         treatBins(self._rootHisto)
-        for i in range(self._rootHisto.GetNbinsX()):
-            if self._rootHisto.GetBinError(i+1) < minimumStatUncertainty:
-                self._rootHisto.SetBinError(i+1, minimumStatUncertainty)
+        errors = _histoErrorsArray(self._rootHisto)[1:self._rootHisto.GetNbinsX()+1]
+        for i in numpy.flatnonzero(errors < minimumStatUncertainty):
+            self._rootHisto.SetBinError(int(i)+1, minimumStatUncertainty)
         # Treat negative bins in variations
         for key, (hPlus, hMinus) in self._shapeUncertainties.iteritems():
             treatBins(hPlus)
@@ -1494,10 +1929,12 @@ class RootHistoWithUncertainties:
             hminus = aux.Clone(th1Plus)
             hminus.Scale(-1)
 
-        for bin in xrange(1, self._rootHisto.GetNbinsX()+1):
-            myRate = self._rootHisto.GetBinContent(bin)
-            hplus.SetBinContent(bin, myRate * hplus.GetBinContent(bin))
-            hminus.SetBinContent(bin, myRate * hminus.GetBinContent(bin))
+        # Scale the visible bins by the rate (under/overflow bins are kept as they are)
+        myRate = _histoContentsArray(self._rootHisto)
+        myRate[0] = 1.0
+        myRate[-1] = 1.0
+        _setHistoContentsArray(hplus, myRate * _histoContentsArray(hplus))
+        _setHistoContentsArray(hminus, myRate * _histoContentsArray(hminus))
 
         self._shapeUncertainties[name] = (hplus, hminus)
 
@@ -1516,13 +1953,15 @@ class RootHistoWithUncertainties:
         hplus = aux.Clone(self._rootHisto)
         hplus.Reset()
         hminus = aux.Clone(hplus)
-        for bin in xrange(1, self._rootHisto.GetNbinsX()+1):
-            myRate = self._rootHisto.GetBinContent(bin)
-            hplus.SetBinContent(bin, myRate * uncertaintyPlus)
-            if uncertaintyMinus == None:
-                hminus.SetBinContent(bin, -myRate * uncertaintyPlus)
-            else:
-                hminus.SetBinContent(bin, -abs(myRate * uncertaintyMinus))
+        # Bins 1..nbinsX only, the under/overflow bins stay empty
+        myRate = numpy.zeros(self._rootHisto.GetSize())
+        nbins = self._rootHisto.GetNbinsX()
+        myRate[1:nbins+1] = _histoContentsArray(self._rootHisto)[1:nbins+1]
+        _setHistoContentsArray(hplus, myRate * uncertaintyPlus)
+        if uncertaintyMinus == None:
+            _setHistoContentsArray(hminus, -myRate * uncertaintyPlus)
+        else:
+            _setHistoContentsArray(hminus, -numpy.abs(myRate * uncertaintyMinus))
 
         self._shapeUncertainties[name] = (hplus, hminus)
 
@@ -1569,48 +2008,30 @@ class RootHistoWithUncertainties:
     # direction (i.e. asymmetrically). Again, a rather crude
     # approximation.
     def getSystematicUncertaintyGraph(self, addStatistical=False, addSystematic=True):
-        xvalues = []
-        xerrhigh = []
-        xerrlow = []
-        yvalues = []
-        yerrhigh = []
-        yerrlow = []
-
-        class WrapTH1:
-            def __init__(self, th1):
-                self._th1 = th1
-            def begin(self):
-                return 1
-            def end(self):
-                return self._th1.GetNbinsX()+1
-            def xvalues(self, i):
-                xval = self._th1.GetBinCenter(i)
-                xlow = xval-self._th1.GetXaxis().GetBinLowEdge(i)
-                xhigh = self._th1.GetXaxis().GetBinUpEdge(i)-xval
-                return (xval, xlow, xhigh)
-            def y(self, i):
-                return self._th1.GetBinContent(i)
-            def statErrors(self, i):
-                stat = self._th1.GetBinError(i)
-                return (stat, stat)
-        class WrapTGraph:
-            def __init__(self, gr):
-                self._gr = gr
-            def begin(self):
-                return 0
-            def end(self):
-                return self._gr.GetN()
-            def xvalues(self, i):
-                return (self._gr.GetX()[i], self._gr.GetErrorXlow(i), self._gr.GetErrorXhigh(i))
-            def y(self, i):
-                return self._gr.GetY()[i]
-            def statErrors(self, i):
-                return (self._gr.GetErrorYlow(i), self._gr.GetErrorYhigh(i))
-
+        # Points as arrays: TGraph points 0..N-1, or TH1 bins 1..nbinsX
         if isinstance(self._rootHisto, ROOT.TGraph):
-            wrapper = WrapTGraph(self._rootHisto)
+            gr = self._rootHisto
+            (begin, end) = (0, gr.GetN())
+            xvalues = numpy.array([gr.GetX()[i] for i in xrange(begin, end)], dtype=numpy.float64)
+            xerrlow = numpy.array([gr.GetErrorXlow(i) for i in xrange(begin, end)], dtype=numpy.float64)
+            xerrhigh = numpy.array([gr.GetErrorXhigh(i) for i in xrange(begin, end)], dtype=numpy.float64)
+            yvalues = numpy.array([gr.GetY()[i] for i in xrange(begin, end)], dtype=numpy.float64)
+            statLow = numpy.array([gr.GetErrorYlow(i) for i in xrange(begin, end)], dtype=numpy.float64)
+            statHigh = numpy.array([gr.GetErrorYhigh(i) for i in xrange(begin, end)], dtype=numpy.float64)
         else:
-            wrapper = WrapTH1(self._rootHisto)
+            h = self._rootHisto
+            (begin, end) = (1, h.GetNbinsX()+1)
+            axis = h.GetXaxis()
+            if axis.GetXbins().GetSize() > 0:
+                edges = numpy.frombuffer(axis.GetXbins().GetArray(), dtype=numpy.float64, count=end)
+            else:
+                edges = numpy.linspace(axis.GetXmin(), axis.GetXmax(), end)
+            xvalues = 0.5*(edges[:-1]+edges[1:])
+            xerrlow = xvalues-edges[:-1]
+            xerrhigh = edges[1:]-xvalues
+            yvalues = _histoContentsArray(h)[begin:end]
+            statLow = _histoErrorsArray(h)[begin:end]
+            statHigh = statLow
 
         # Set shapes to stat, syst, or stat+syst according to what was
         # requested
@@ -1627,39 +2048,38 @@ class RootHistoWithUncertainties:
             # in this case all shapes are syst
             shapes = self._shapeUncertainties.values()
 
-        #shapes.sort()
-        #print addStatistical, addSystematic, "\n  ".join([x[0].GetName() for x in shapes])
-
-        for i in xrange(wrapper.begin(), wrapper.end()):
-            (xval, xlow, xhigh) = wrapper.xvalues(i)
-
-            yval = wrapper.y(i)
-            yhighSquareSum = 0.0
-            ylowSquareSum = 0.0
-
-            if addStatistical:
-                (statLow, statHigh) = wrapper.statErrors(i)
-                yhighSquareSum += statHigh**2
-                ylowSquareSum += statLow**2
-
-            if len(shapes) > 0:
-                for shapePlus, shapeMinus in shapes:
-                    diffPlus = shapePlus.GetBinContent(i) # Note that this could have + or - sign
-                    diffMinus = shapeMinus.GetBinContent(i) # Note that this could have + or - sign
-                    (addPlus, addMinus) = aux.getProperAdditivesForVariationUncertainties(diffPlus, diffMinus)
-                    yhighSquareSum += addPlus
-                    ylowSquareSum += addMinus
-
-            xvalues.append(xval)
-            xerrhigh.append(xhigh)
-            xerrlow.append(xlow)
-            yvalues.append(yval)
-            yerrhigh.append(math.sqrt(yhighSquareSum))
-            yerrlow.append(math.sqrt(ylowSquareSum))
-
-        return ROOT.TGraphAsymmErrors(len(xvalues), array.array("d", xvalues), array.array("d", yvalues),
-                                      array.array("d", xerrlow), array.array("d", xerrhigh),
-                                      array.array("d", yerrlow), array.array("d", yerrhigh))
+        yhighSquareSum = numpy.zeros(end-begin)
+        ylowSquareSum = numpy.zeros(end-begin)
+
+        if addStatistical:
+            yhighSquareSum += statHigh**2
+            ylowSquareSum += statLow**2
+
+        if len(shapes) > 0:
+            def contents(th1):
+                ret = _histoContentsArray(th1)
+                if len(ret) < end:
+                    ret = numpy.array([th1.GetBinContent(i) for i in xrange(end)], dtype=numpy.float64)
+                return ret[begin:end]
+            # Matrices of (uncertainty source, point); note that the
+            # differences could have + or - sign
+            diffPlus = numpy.array([contents(shapePlus) for shapePlus, shapeMinus in shapes])
+            diffMinus = numpy.array([contents(shapeMinus) for shapePlus, shapeMinus in shapes])
+            if numpy.isnan(diffPlus).any() or numpy.isnan(diffMinus).any():
+                (src, i) = numpy.argwhere(numpy.isnan(diffPlus) | numpy.isnan(diffMinus))[0]
+                raise Exception("Error: Unknown situation diffPlus=%f, diffMinus=%f!"%(diffPlus[src, i], diffMinus[src, i]))
+            # Same as aux.getProperAdditivesForVariationUncertainties()
+            # for each element: the largest upward (downward) variation
+            # goes to the high (low) side
+            zero = numpy.zeros_like(diffPlus)
+            yhighSquareSum += numpy.sum(numpy.maximum(numpy.maximum(diffPlus, diffMinus), zero)**2, axis=0)
+            ylowSquareSum += numpy.sum(numpy.minimum(numpy.minimum(diffPlus, diffMinus), zero)**2, axis=0)
+
+        def toArray(a):
+            return array.array("d", a.tolist())
+        return ROOT.TGraphAsymmErrors(end-begin, toArray(xvalues), toArray(yvalues),
+                                      toArray(xerrlow), toArray(xerrhigh),
+                                      toArray(numpy.sqrt(ylowSquareSum)), toArray(numpy.sqrt(yhighSquareSum)))
 
     ## Print associated systematic uncertainties
     def printUncertainties(self):
@@ -2563,6 +2983,217 @@ class HistogramNotFoundException(Exception):
     def __init__(self, message):
         Exception.__init__(self, message)
 
+## Bytes per cell of the TArray storage of the TH1 classes
+_histoArrayBytes = [("TArrayD", 8), ("TArrayF", 4), ("TArrayI", 4), ("TArrayS", 2), ("TArrayC", 1)]
+
+## Estimate the memory footprint of a histogram
+def _estimateHistoBytes(histo):
+    perCell = 8
+    for (arrayType, nbytes) in _histoArrayBytes:
+        if isinstance(histo, getattr(ROOT, arrayType)):
+            perCell = nbytes
+            break
+    if histo.GetSumw2N() > 0:
+        perCell += 8
+    return 1024 + histo.GetSize()*perCell
+
+## Set the memory limit (in bytes) of the histogram cache shared by all Dataset objects
+#
+# \param maxBytes   Maximum size in bytes, 0 disables the caching
+def setRootObjectCacheSize(maxBytes):
+    global _rootObjectCacheMaxBytes
+    _rootObjectCacheMaxBytes = maxBytes
+    _rootObjectCacheStore.setMaxBytes(maxBytes)
+
+#================================================================================================
+# Class Definition
+#================================================================================================
+class RootObjectCacheStore:
+    '''
+    Storage of the histograms of RootObjectCache objects with a common
+    memory limit
+
+    The least recently used entries of all the caches using the store
+    are evicted when the estimated size of the stored histograms exceeds
+    the limit. By default all Dataset objects of the process (including
+    the copies made by Dataset.deepCopy() and for systematic variations)
+    share one store, so the limit is for the whole process.
+    '''
+    def __init__(self, maxBytes):
+        self._maxBytes = maxBytes
+        self._entries = OrderedDict() # (cache, realName) -> (list of TH1, size in bytes)
+        self._bytes = 0
+        self._evictions = 0
+
+    def getMaxBytes(self):
+        return self._maxBytes
+
+    def setMaxBytes(self, maxBytes):
+        self._maxBytes = maxBytes
+        self._evict()
+
+    def get(self, cache, realName):
+        entry = self._entries.pop((cache, realName), None)
+        if entry is not None:
+            self._entries[(cache, realName)] = entry # most recently used
+        return entry
+
+    def put(self, cache, realName, objects, size):
+        self.remove(cache, realName)
+        self._entries[(cache, realName)] = (objects, size)
+        self._bytes += size
+        self._evict()
+
+    def remove(self, cache, realName):
+        entry = self._entries.pop((cache, realName), None)
+        if entry is not None:
+            self._deleteEntry(entry)
+
+    def _evict(self):
+        while self._bytes > self._maxBytes and len(self._entries) > 0:
+            ((cache, realName), entry) = self._entries.popitem(last=False)
+            cache._evicted(realName)
+            self._deleteEntry(entry)
+            self._evictions += 1
+
+    def _deleteEntry(self, entry):
+        (objects, size) = entry
+        for o in objects:
+            o.Delete()
+        self._bytes -= size
+
+    ## Get the store statistics
+    #
+    # \return Dictionary with the number of evictions, entries, and the size in bytes
+    def getStatistics(self):
+        return {"evictions": self._evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self._maxBytes}
+
+_rootObjectCacheStore = RootObjectCacheStore(_rootObjectCacheMaxBytes)
+
+#================================================================================================
+# Class Definition
+#================================================================================================
+class RootObjectCache:
+    '''
+    Cache of the histograms read by Dataset.getRootObjects()
+
+    The histograms (one per ROOT file) are stored with the physical
+    name, i.e. including the analysis directory and the analysis
+    postfix, as key. They are kept in a RootObjectCacheStore, by default
+    the one shared by all Datasets of the process, which evicts the
+    least recently used entries when the estimated size of the stored
+    histograms exceeds its limit (see setRootObjectCacheSize()).
+    Only clones of the stored histograms are handed out, so the callers
+    may modify what they get. Other ROOT objects (directories, TNamed)
+    are not cached.
+
+    In addition the cache holds an index of the keys of the TDirectories
+    looked into by existence checks (Dataset.hasRootHisto()), so that
+    the checks do not need to read the objects themselves.
+    '''
+    ## Constructor
+    #
+    # \param maxBytes  Memory limit of a private store for this cache
+    #                  (default: use the store shared by the process)
+    def __init__(self, maxBytes=None):
+        if maxBytes is None:
+            self._store = _rootObjectCacheStore
+        else:
+            self._store = RootObjectCacheStore(maxBytes)
+        self._names = {} # realName -> size in bytes of the entries in the store
+        self._keyIndex = {} # (file index, directory) -> dictionary of key name -> class name (None if no directory)
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    ## Return clones of the cached objects, or None if \a realName is not in the cache
+    def get(self, realName):
+        entry = self._store.get(self, realName)
+        if entry is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return [aux.Clone(o) for o in entry[0]]
+
+    def contains(self, realName):
+        return realName in self._names
+
+    ## Store clones of the objects (if they all are histograms)
+    def put(self, realName, objects):
+        maxBytes = self._store.getMaxBytes()
+        if maxBytes <= 0:
+            return
+        for o in objects:
+            if not isinstance(o, ROOT.TH1):
+                return
+        size = sum([_estimateHistoBytes(o) for o in objects])
+        if size > maxBytes:
+            return
+        self._names[realName] = size
+        self._store.put(self, realName, [aux.Clone(o) for o in objects], size)
+
+    ## Called by the store when an entry is evicted
+    def _evicted(self, realName):
+        del self._names[realName]
+        self._evictions += 1
+
+    ## Get the class name of an object in a ROOT file without reading the object
+    #
+    # \param fileIndex  Index of the file (for the key index)
+    # \param tfile      TFile
+    # \param realName   Physical path of the object in the file
+    #
+    # \return Class name, or None if the object does not exist
+    def getClassName(self, fileIndex, tfile, realName):
+        if "/" in realName:
+            (directory, name) = realName.rsplit("/", 1)
+        else:
+            (directory, name) = ("", realName)
+        keys = self.getKeys(fileIndex, tfile, directory)
+        if keys is None:
+            return None
+        return keys.get(name, None)
+
+    ## Get the keys of a TDirectory
+    #
+    # \return Dictionary of key name -> class name, or None if the directory does not exist
+    def getKeys(self, fileIndex, tfile, directory):
+        indexKey = (fileIndex, directory)
+        if indexKey in self._keyIndex:
+            return self._keyIndex[indexKey]
+        keys = None
+        d = tfile
+        if directory != "":
+            d = tfile.GetDirectory(directory)
+        if d != None: # important to use '!='
+            keys = {}
+            for key in d.GetListOfKeys():
+                if key.GetName() not in keys: # the highest cycle comes first
+                    keys[key.GetName()] = key.GetClassName()
+        self._keyIndex[indexKey] = keys
+        return keys
+
+    def clear(self):
+        for realName in self._names.keys():
+            self._store.remove(self, realName)
+        self._names = {}
+        self._keyIndex = {}
+
+    ## Get the cache statistics
+    #
+    # \return Dictionary with the number of hits, misses, evictions, entries, and the size in bytes
+    # of this cache, and the memory limit of its store
+    def getStatistics(self):
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._names),
+                "bytes": sum(self._names.values()),
+                "maxBytes": self._store.getMaxBytes()}
+
 ## Dataset class for histogram access from one ROOT file.
 # 
 # The default values for cross section/luminosity are read from
@@ -2633,6 +3264,7 @@ class Dataset:
         self.files = tfiles
         if len(self.files) == 0:
             raise Exception("Expecting at least one TFile, jot 0")
+        self._rootObjectCache = RootObjectCache()
 
         # Now this is really an uhly hack
         self._setBaseDirectory(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(self.files[0].GetName())))))
@@ -2781,6 +3413,7 @@ class Dataset:
     # the memory footprint and not hit the limit of number of open
     # files
     def close(self):
+        self._rootObjectCache.clear()
         for f in self.files:
             f.Close("R")
             f.Delete()
@@ -2948,6 +3581,10 @@ class Dataset:
         if len(self.files) == 0:
             raise Exception("Trying to read object %s from dataset %s, but the file is already closed!" % (name, self.name))
 
+        cached = self._rootObjectCache.get(realName)
+        if cached is not None:
+            return (cached, realName)
+
         for f in self.files:
             # Convert to string (otherwise causes problems in certain PYTHON/ROOT envs)
             o = aux.Get(f, str(realName))
@@ -2957,8 +3594,40 @@ class Dataset:
                 raise HistogramNotFoundException("Unable to find object '%s' (requested '%s') from file '%s'" % (realName, name, self.files[0].GetName()))
 
             ret.append(o)
+        self._rootObjectCache.put(realName, ret)
         return (ret, realName)
 
+    ## Get the histogram cache of getRootObjects() (see RootObjectCache)
+    def getRootObjectCache(self):
+        return self._rootObjectCache
+
+    ## Get the TKey information of a ROOT object without reading the object
+    #
+    # \param name    Path of the ROOT object relative to the analysis
+    #                root directory
+    # \param kwargs  Keyword arguments, forwarded to _translateName()
+    #
+    # \return list of [file name, cycle, datime, nbytes, objlen, seekkey],
+    #         one per file, or None if the object is not found
+    #
+    # The information changes whenever the object is rewritten, so it
+    # can be used as a fingerprint of the object contents.
+    def getRootObjectKeyInfo(self, name, **kwargs):
+        realName = self._translateName(name, **kwargs)
+        (dirName, objName) = os.path.split(realName)
+        ret = []
+        for f in self.files:
+            d = f
+            if dirName != "":
+                d = f.GetDirectory(str(dirName))
+                if d == None:
+                    return None
+            key = d.GetKey(str(objName))
+            if key == None:
+                return None
+            ret.append([f.GetName(), key.GetCycle(), key.GetDatime().Get(), key.GetNbytes(), key.GetObjlen(), key.GetSeekKey()])
+        return ret
+
     ## Read counters
     def _readCounters(self):
         self.counterDir = self._unweightedCounterDir
@@ -3191,17 +3860,21 @@ class Dataset:
         realName = self._translateName(name, **kwargs)
         if hasattr(realName, "draw"):
             return True
+        if self._rootObjectCache.contains(realName):
+            return True
 
-        for f in self.files:
-            o = aux.Get(f, realName)
-            if o != None:
-                status = False
-                if isinstance(o, ROOT.TDirectoryFile):
-                    status = len(o.GetListOfKeys()) > 0
-                else:
-                    status = isinstance(o, ROOT.TH1)
-                o.Delete()
-                return status
+        # Look only at the TKeys, the objects are not read
+        for i, f in enumerate(self.files):
+            className = self._rootObjectCache.getClassName(i, f, realName)
+            if className is None:
+                continue
+            cls = ROOT.TClass.GetClass(className)
+            if cls == None:
+                return False
+            if cls.InheritsFrom("TDirectory"):
+                keys = self._rootObjectCache.getKeys(i, f, realName)
+                return keys is not None and len(keys) > 0
+            return bool(cls.InheritsFrom("TH1"))
         return False
 
     def getDatasetRootHisto(self, name, modify=None, **kwargs):
@@ -3242,7 +3915,7 @@ class Dataset:
             name.addUncertainties(self, wrapper, modify)
         return DatasetRootHisto(wrapper, self) 
 
-    def getDirectoryContent(self, directory, predicate=None):
+    def getDirectoryContent(self, directory, predicate=None, keyPredicate=None):
         '''
         Get the directory content of a given directory in the ROOT file.
         
@@ -3252,6 +3925,10 @@ class Dataset:
         predicate returns true for the name. Predicate
         should be a function taking an object in the directory as an
         argument and returning a boolean.
+
+        \param keyPredicate  As \a predicate, but the function takes
+        the TKey of the object (i.e. the object is not read). Can not be
+        given together with \a predicate.
     
         \return List of names in the directory.
         
@@ -3261,8 +3938,10 @@ class Dataset:
         (dirs, realDir) = self.getRootObjects(directory)
 
         # wrap the predicate
-        wrapped = None
+        wrapped = keyPredicate
         if predicate is not None:
+            if keyPredicate is not None:
+                raise Exception("Only one of predicate and keyPredicate can be given")
             wrapped = lambda key: predicate(key.ReadObj())
 
         return aux.listDirectoryContent(dirs[0], wrapped)
@@ -3496,13 +4175,14 @@ class DatasetMerged:
     #                    predicate returns true for the name. Predicate
     #                    should be a function taking a string as an
     #                    argument and returning a boolean.
+    # \param keyPredicate As \a predicate, but taking the TKey of the object
     # 
     # Returns a list of names in the directory. The contents of the
     # directories of the merged datasets are required to be identical.
-    def getDirectoryContent(self, directory, predicate=lambda x: True):
-        content = self.datasets[0].getDirectoryContent(directory, predicate)
+    def getDirectoryContent(self, directory, predicate=None, keyPredicate=None):
+        content = self.datasets[0].getDirectoryContent(directory, predicate, keyPredicate)
         for d in self.datasets[1:]:
-            if content != d.getDirectoryContent(directory, predicate):
+            if content != d.getDirectoryContent(directory, predicate, keyPredicate):
                 raise Exception("Error: merged datasets have different contents in directory '%s'" % directory)
         return content
 
@@ -4331,13 +5011,168 @@ class DatasetManager:
     # the luminosity JSON file is located (see loadLuminosities())
 
 
+## Name of the dataset metadata index written to the multicrab directory
+_metadataIndexFileName = "datasetMetadata.json"
+_metadataIndexVersion = 1
+
+def _histoToMetadata(histo):
+    '''
+    Convert a 1D histogram to a JSON-serializable dictionary (including under/overflow bins)
+    '''
+    axis = histo.GetXaxis()
+    nbins = histo.GetNbinsX()
+    ret = {"class": histo.ClassName(),
+           "name": histo.GetName(),
+           "title": histo.GetTitle(),
+           "edges": [axis.GetBinLowEdge(i) for i in xrange(1, nbins+2)],
+           "contents": [histo.GetBinContent(i) for i in xrange(0, nbins+2)],
+           "entries": histo.GetEntries()}
+    if histo.GetSumw2N() > 0:
+        ret["errors"] = [histo.GetBinError(i) for i in xrange(0, nbins+2)]
+    return ret
+
+def _metadataToHisto(data):
+    '''
+    Create a histogram (not owned by any TDirectory) from the output of _histoToMetadata()
+    '''
+    edges = array.array("d", data["edges"])
+    histo = getattr(ROOT, str(data["class"]))(str(data["name"]), str(data["title"]), len(edges)-1, edges)
+    histo.SetDirectory(0)
+    if "errors" in data:
+        histo.Sumw2()
+    for i, value in enumerate(data["contents"]):
+        histo.SetBinContent(i, value)
+    if "errors" in data:
+        for i, value in enumerate(data["errors"]):
+            histo.SetBinError(i, value)
+    histo.SetEntries(data["entries"])
+    return histo
+
+def _readFileMetadata(rf):
+    '''
+    Read the metadata needed by DatasetPrecursor and DatasetManagerCreator from an open ROOT file
+
+    \return JSON-serializable dictionary, see DatasetMetadataIndex
+    '''
+    ret = {"dataVersion": None,
+           "isTree": False,
+           "pileup": None,
+           "pileup_up": None,
+           "pileup_down": None,
+           "skimCounter": None,
+           "directories": aux.listDirectoryContent(rf, lambda key: key.IsFolder())}
+
+    # Get the data version (e.g. 80Xdata or 80Xmc)
+    dv = aux.Get(rf, "configInfo/dataVersion")
+    if dv == None:
+        return ret
+    ret["dataVersion"] = dv.GetTitle()
+
+    # Get the TTree
+    ret["isTree"] = aux.Get(rf, "Events") != None
+    if not ret["isTree"]:
+        return ret
+
+    # Get the "pileup" histograms under folder "configInfo"
+    for puName in ["pileup", "pileup_up", "pileup_down"]:
+        pileup = aux.Get(rf, "configInfo/"+puName)
+        if pileup != None:
+            ret[puName] = _histoToMetadata(pileup)
+
+    counters = aux.Get(rf, "configInfo/SkimCounter")
+    if counters != None and counters.GetNbinsX() > 0:
+        ret["skimCounter"] = {"label": counters.GetXaxis().GetBinLabel(1),
+                              "value": counters.GetBinContent(1)}
+    return ret
+
+
+class DatasetMetadataIndex:
+    '''
+    Index of the ROOT file metadata of a multicrab directory
+
+    The metadata read by DatasetPrecursor (dataVersion, pileup
+    histograms, number of all events, list of analysis directories) is
+    stored per ROOT file in a JSON file, keyed by the file path and
+    validated with the file size and modification time. With the index
+    the precursors (and the listing of the available analyses) can be
+    created without opening the ROOT files.
+    '''
+    def __init__(self, filename):
+        self._filename = filename
+        self._entries = {}
+        self._modified = False
+        if os.path.exists(filename):
+            try:
+                f = open(filename)
+                data = json.load(f)
+                f.close()
+                if data.get("version", None) == _metadataIndexVersion:
+                    self._entries = data["files"]
+            except (IOError, ValueError, KeyError):
+                Print("Ignoring unreadable metadata index %s" % filename, True)
+                self._entries = {}
+
+    def getFileName(self):
+        return self._filename
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None # e.g. remote file
+        return [st.st_size, st.st_mtime]
+
+    def get(self, path):
+        '''
+        Return the metadata of a ROOT file, or None if it is missing or out of date
+        '''
+        entry = self._entries.get(path, None)
+        if entry == None:
+            return None
+        stat = self._stat(path)
+        if stat == None or entry["stat"] != stat:
+            return None
+        return entry["metadata"]
+
+    def set(self, path, metadata):
+        stat = self._stat(path)
+        if stat == None:
+            return
+        self._entries[path] = {"stat": stat, "metadata": metadata}
+        self._modified = True
+
+    def save(self):
+        '''
+        Write the index if it was modified (failures are only reported, the index is just an optimisation)
+        '''
+        if not self._modified:
+            return
+        tmpName = self._filename + ".tmp%d" % os.getpid()
+        try:
+            f = open(tmpName, "w")
+            json.dump({"version": _metadataIndexVersion, "files": self._entries}, f)
+            f.close()
+            os.rename(tmpName, self._filename)
+        except (IOError, OSError), e:
+            Print("Unable to write metadata index %s: %s" % (self._filename, str(e)), True)
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            return
+        self._modified = False
+
+
 class DatasetPrecursor:
     '''
     Precursor dataset, helper class for DatasetManagerCreator
     
     This holds the name, ROOT file, and data/MC status of a dataset.
+
+    If \a metadataIndex (DatasetMetadataIndex) is given, the metadata
+    of the files found (and up to date) in the index is taken from
+    there, and the ROOT files are opened only when getFiles() is
+    called. Files missing from the index are read and added to it.
     '''
-    def __init__(self, name, filenames):
+    def __init__(self, name, filenames, metadataIndex=None):
         Verbose("__init__", True)
         self._name = name
         if isinstance(filenames, basestring):
@@ -4345,90 +5180,24 @@ class DatasetPrecursor:
         else:
             self._filenames = filenames
 
-        self._rootFiles = []
+        self._rootFiles = {}
         self._dataVersion = None
         self._pileup = None
         self._pileup_up = None
         self._pileup_down = None
         self._nAllEvents = 0.0
+        self._directories = None
 
-        Verbose("Opening ROOT files", False)
+        Verbose("Reading metadata of ROOT files", False)
         for name in self._filenames:
-
-            Verbose("Opening ROOT file \"%s\"" % (name), False)
-#	    print "Opening ROOT file \"%s\"" % (name)
-            rf = ROOT.TFile.Open(name)
-
-            # Below is important to use '==' instead of 'is' to check for
-            # null file
-            if rf == None:
-                raise Exception("Unable to open ROOT file '%s' for dataset '%s'" % (name, self._name))
-
-            self._rootFiles.append(rf)
-
-            # Get the data version (e.g. 80Xdata or 80Xmc)
-            dv = aux.Get(rf, "configInfo/dataVersion")
-            if dv == None:
-                print "Unable to find 'configInfo/dataVersion' from ROOT file '%s', I have no idea if this file is data, MC, or pseudo" % name
-                continue                
-            if self._dataVersion is None:
-                self._dataVersion = dv.GetTitle()
-            else:
-                if self._dataVersion != dv.GetTitle():
-                    raise Exception("Mismatch in dataVersion when creating multi-file DatasetPrecursor, got %s from file %s, and %s from %s" % (dataVersion, self._filenames[0], dv.GetTitle(), name))
-
-            # Get the TTree
-            isTree = aux.Get(rf, "Events") != None
-            if isTree:
-
-                # Get the "pileup" histogram under folder "configInfo"
-                puName = "configInfo/pileup"
-                pileup = aux.Get(rf, puName)
-
-                # Sanity checks
-                if pileup == None:
-                    Print("Unable to find 'configInfo/pileup' from ROOT file '%s'" % name, True)
-                    sys.exit()
-                if (pileup.Integral() == 0):
-                    raise Exception("Empty pileup histogram \"%s\" in ROOT file \"%s\". Entries = \"%s\"." % (puName, rf.GetName(), pileup.GetEntries()) )
-
-                if self._pileup is None:
-                    if pileup != None:
-                        self._pileup = pileup
-                else:
-                    self._pileup.Add(pileup)
-                if ("data" in self._dataVersion):
-                    # pileup (up)
-                    pileup_up = aux.Get(rf, "configInfo/pileup_up")
-                    if pileup_up == None:
-                        print "Unable to find 'configInfo/pileup_up' from ROOT file '%s'" % name
-                    if self._pileup_up is None:
-                        if pileup_up != None:
-                            self._pileup_up = pileup_up
-                    else:
-                        self._pileup_up.Add(pileup_up)
-                    # pileup (down)
-                    pileup_down = aux.Get(rf, "configInfo/pileup_down")
-                    if pileup_down == None:
-                        print "Unable to find 'configInfo/pileup_down' from ROOT file '%s'" % name
-                    if self._pileup_down is None:
-                        if pileup_down != None:
-                            self._pileup_down = pileup_down
-                    else:
-                        self._pileup_down.Add(pileup_down)
-            
-            # Obtain nAllEvents
-            if isTree:
-                counters = aux.Get(rf, "configInfo/SkimCounter")
-                if counters != None:
-                    if counters.GetNbinsX() > 0:
-                        if not "All" in counters.GetXaxis().GetBinLabel(1):
-                            raise Exception("Error: The first bin of the counters histogram should be the all events bin!")
-                        self._nAllEvents += counters.GetBinContent(1)
-                if self._nAllEvents == 0.0:
-                    print "Warning (DatasetPrecursor): N(allEvents) = 0 !!!"
-
-#            rf.Close()
+            metadata = None
+            if metadataIndex is not None:
+                metadata = metadataIndex.get(name)
+            if metadata is None:
+                metadata = _readFileMetadata(self._openFile(name))
+                if metadataIndex is not None:
+                    metadataIndex.set(name, metadata)
+            self._addFileMetadata(name, metadata)
 
         if self._dataVersion is None:
             self._isData = False
@@ -4439,16 +5208,85 @@ class DatasetPrecursor:
             self._isPseudo = "pseudo" in self._dataVersion
             self._isMC = not (self._isData or self._isPseudo)
 
+    def _openFile(self, name):
+        if name in self._rootFiles:
+            return self._rootFiles[name]
+
+        Verbose("Opening ROOT file \"%s\"" % (name), False)
+        rf = ROOT.TFile.Open(name)
+
+        # Below is important to use '==' instead of 'is' to check for
+        # null file
+        if rf == None:
+            raise Exception("Unable to open ROOT file '%s' for dataset '%s'" % (name, self._name))
+        self._rootFiles[name] = rf
+        return rf
+
+    def _addFileMetadata(self, name, metadata):
+        if self._directories is None:
+            self._directories = metadata["directories"]
+
+        dv = metadata["dataVersion"]
+        if dv == None:
+            print "Unable to find 'configInfo/dataVersion' from ROOT file '%s', I have no idea if this file is data, MC, or pseudo" % name
+            return
+        if self._dataVersion is None:
+            self._dataVersion = dv
+        else:
+            if self._dataVersion != dv:
+                raise Exception("Mismatch in dataVersion when creating multi-file DatasetPrecursor, got %s from file %s, and %s from %s" % (self._dataVersion, self._filenames[0], dv, name))
+
+        if not metadata["isTree"]:
+            return
+
+        # Sanity checks of the "pileup" histogram under folder "configInfo"
+        puName = "configInfo/pileup"
+        pileup = metadata["pileup"]
+        if pileup == None:
+            Print("Unable to find 'configInfo/pileup' from ROOT file '%s'" % name, True)
+            sys.exit()
+        if sum(pileup["contents"][1:-1]) == 0:
+            raise Exception("Empty pileup histogram \"%s\" in ROOT file \"%s\". Entries = \"%s\"." % (puName, name, pileup["entries"]) )
+        self._pileup = self._addPileUp(self._pileup, pileup)
+
+        if ("data" in self._dataVersion):
+            for direction in ["up", "down"]:
+                pileup = metadata["pileup_"+direction]
+                if pileup == None:
+                    print "Unable to find 'configInfo/pileup_%s' from ROOT file '%s'" % (direction, name)
+                    continue
+                setattr(self, "_pileup_"+direction, self._addPileUp(getattr(self, "_pileup_"+direction), pileup))
+
+        # Obtain nAllEvents
+        counter = metadata["skimCounter"]
+        if counter != None:
+            if not "All" in counter["label"]:
+                raise Exception("Error: The first bin of the counters histogram should be the all events bin!")
+            self._nAllEvents += counter["value"]
+        if self._nAllEvents == 0.0:
+            print "Warning (DatasetPrecursor): N(allEvents) = 0 !!!"
+
+    def _addPileUp(self, histo, pileup):
+        h = _metadataToHisto(pileup)
+        if histo is None:
+            return h
+        histo.Add(h)
+        return histo
 
     def getName(self):
         return self._name
 
+    ## Return the ROOT files (opened if necessary)
     def getFiles(self):
-        return self._rootFiles
+        return [self._openFile(name) for name in self._filenames]
 
     def getFileNames(self):
         return self._filenames
 
+    ## Return the names of the top-level TDirectories of the first ROOT file
+    def getDirectoryNames(self):
+        return self._directories
+
     def isData(self):
         return self._isData
 
@@ -4474,10 +5312,18 @@ class DatasetPrecursor:
 
     ## Close the ROOT files
     def close(self):
-        for f in self._rootFiles:
+        for f in self._rootFiles.values():
             f.Close("R")
             f.Delete()
-        self._rootFiles = []
+        self._rootFiles = {}
+
+    ## Forget the opened ROOT files, getFiles() opens them again
+    #
+    # For a forked process: the file descriptors of the files opened
+    # by the parent process share the file offset with the parent, so
+    # the files must not be read through them.
+    def reopenFiles(self):
+        self._rootFiles = {}
 
 _analysisNameSkipList = [re.compile("^SystVar"), re.compile("configInfo"), re.compile("PUWeightProducer")]
 _analysisSearchModes = re.compile("_\d+to\d+_")
@@ -4505,13 +5351,30 @@ class DatasetManagerCreator:
         
         <b>Keyword arguments</b>
         \li \a baseDirectory    Base directory of the datasets (delivered later to DatasetManager._setBaseDirectory())
+        \li \a useMetadataIndex Read the dataset metadata from (and update) the metadata index in
+                                \a baseDirectory instead of opening all ROOT files (default True if
+                                \a baseDirectory is given, see DatasetMetadataIndex). The index is
+                                created on the first run, so that the later runs do not need to
+                                open the files of the datasets that are not used.
+        \li \a opts             Optional OptionParser object, its \a useMetadataIndex (if set) overrides the keyword argument
     
         Creates DatasetPrecursor objects for each ROOT file, reads the
         contents of first MC file to get list of available analyses.
+        With the metadata index, the ROOT files are opened only when
+        the Dataset objects are created in createDatasetManager().
         '''
         self._label = None
-        self._precursors = [DatasetPrecursor(name, filenames) for name, filenames in rootFileList]
         self._baseDirectory = kwargs.get("baseDirectory", "")
+        useMetadataIndex = kwargs.get("useMetadataIndex", len(self._baseDirectory) > 0)
+        opts = kwargs.get("opts", None)
+        if opts is not None and getattr(opts, "useMetadataIndex", None) is not None:
+            useMetadataIndex = opts.useMetadataIndex
+        metadataIndex = None
+        if useMetadataIndex:
+            metadataIndex = DatasetMetadataIndex(os.path.join(self._baseDirectory, _metadataIndexFileName))
+        self._precursors = [DatasetPrecursor(name, filenames, metadataIndex) for name, filenames in rootFileList]
+        if metadataIndex is not None:
+            metadataIndex.save()
         mcRead = False
         for d in self._precursors:
             #if d.isMC() or d.isPseudo():
@@ -4544,7 +5407,7 @@ class DatasetManagerCreator:
 
     def _readAnalysisContent(self, precursor):
         Verbose("_readAnalysisContent()", True)
-        contents = aux.listDirectoryContent(precursor.getFiles()[0], lambda key: key.IsFolder())
+        contents = precursor.getDirectoryNames()
 
         def skipItem(name):
             for skip_re in _analysisNameSkipList:
@@ -4646,6 +5509,8 @@ class DatasetManagerCreator:
     def createDatasetManager(self, **kwargs):
         _args = {}
         _args.update(kwargs)
+        if "useMetadataIndex" in _args:
+            del _args["useMetadataIndex"]
         print "creating datasetmanager"
         # First check that if some of these is not given, if there is
         # exactly one it available, use that.
@@ -4829,6 +5694,11 @@ class DatasetManagerCreator:
         for precursor in self._precursors:
             precursor.close()
 
+    ## Make the ROOT files to be opened again by the next createDatasetManager() (e.g. in a forked process)
+    def reopenFiles(self):
+        for precursor in self._precursors:
+            precursor.reopenFiles()
+
 ## Helper class to plug NtupleCache to the existing framework
 #
 # User should not construct an object by herself, but use
@@ -4871,6 +5741,13 @@ class NtupleCache:
     # \param printStatus    Print processing status information
     # \param macros         Additional macro files to compile and load
     #
+    # The cache file is kept between the runs. A dataset is processed
+    # only if its cache key (a hash of the macro sources, the selector
+    # arguments, the tree name, maxEvents and the input files with
+    # their sizes and mtimes) differs from the one stored in the cache
+    # file. Each dataset is flushed to the file when it is done, so
+    # the finished datasets survive an interrupted run.
+    #
     # I would like to make \a process redundant, but so far I haven't
     # figured out a bullet-proof method for that.
     def __init__(self, treeName, selector, selectorArgs=[], process=True, cacheFileName="histogramCache.root", maxEvents=-1, printStatus=True, macros=[]):
@@ -4896,12 +5773,13 @@ class NtupleCache:
             ]
         self.cacheFile = None
 
-    ## Compile and load the macros
-    def _loadMacros(self):
+    def _getMacroPaths(self):
         base = os.path.join(aux.higgsAnalysisPath(), "NtupleAnalysis", "test", "ntuple")
-        macros = [os.path.join(base, x) for x in self.macros]
+        return [os.path.join(base, x) for x in self.macros]
 
-        for m in macros:
+    ## Compile and load the macros
+    def _loadMacros(self):
+        for m in self._getMacroPaths():
             ret = ROOT.gROOT.LoadMacro(m+"+g")
             if ret != 0:
                 raise Exception("Failed to load "+m)
@@ -4917,6 +5795,33 @@ class NtupleCache:
             self.datasetSelectorArgs[selectorName] = {}
         self.datasetSelectorArgs[selectorName].update(dictionary)
 
+    ## Calculate the cache key of a dataset
+    #
+    # \param tree          TChain of the dataset
+    # \param realTreeName  Name of the tree
+    # \param selectorArgs  Dictionary of selector name -> selector arguments
+    #
+    # \return SHA1 hex digest
+    def _getCacheKey(self, tree, realTreeName, selectorArgs):
+        digest = hashlib.sha1()
+        for m in self._getMacroPaths():
+            digest.update(m)
+            if os.path.exists(m):
+                f = open(m)
+                digest.update(f.read())
+                f.close()
+        digest.update(realTreeName)
+        digest.update(str(self.maxEvents))
+        for name in sorted(selectorArgs.keys()):
+            digest.update("%s %s" % (name, str(selectorArgs[name])))
+        for element in tree.GetListOfFiles():
+            fileName = element.GetTitle()
+            digest.update(fileName)
+            if os.path.exists(fileName):
+                st = os.stat(fileName)
+                digest.update("%d %f" % (st.st_size, st.st_mtime))
+        return digest.hexdigest()
+
     # def _isMacroNewerThanCacheFile(self):
     #     latestMacroTime = max([os.path.getmtime(m) for m in self.macros])
     #     cacheTime = 0
@@ -4941,12 +5846,10 @@ class NtupleCache:
             return
         self.processedDatasets[procName] = 1
 
-        if not self.macrosLoaded:
-            self._loadMacros()
-            self.macrosLoaded = True
-        
         if self.cacheFile == None:
-            self.cacheFile = ROOT.TFile.Open(self.cacheFileName, "RECREATE")
+            self.cacheFile = ROOT.TFile.Open(self.cacheFileName, "UPDATE")
+            if self.cacheFile == None or self.cacheFile.IsZombie():
+                raise Exception("Failed to open the cache file %s" % self.cacheFileName)
             self.cacheFile.cd()
 
         rootDirectory = self.cacheFile.Get(pathDigest)
@@ -4975,6 +5878,27 @@ class NtupleCache:
         selectorArgs = getSelectorArgs(None, self.selectorArgs)
         (tree, realTreeName) = dataset.createRootChain(self.treeName)
 
+        # Use the cached result if nothing affecting it has changed
+        allSelectorArgs = {"mainSelector": selectorArgs}
+        for name, (selecName, selecArgs) in self.additionalSelectors.iteritems():
+            allSelectorArgs[name] = (selecName, getSelectorArgs(name, selecArgs))
+        cacheKey = self._getCacheKey(tree, realTreeName, allSelectorArgs)
+        cachedDirectory = rootDirectory.Get("mainSelector/"+datasetName)
+        if cachedDirectory != None:
+            cachedKey = cachedDirectory.Get("cacheKey")
+            if cachedKey != None and cachedKey.GetTitle() == cacheKey:
+                print "Dataset %s found from cache %s" % (datasetName, self.cacheFileName)
+                return
+            # Remove the outdated results
+            for name in allSelectorArgs.keys():
+                d = rootDirectory.Get(name)
+                if d != None and d.Get(datasetName) != None:
+                    d.Delete(datasetName+";*")
+
+        if not self.macrosLoaded:
+            self._loadMacros()
+            self.macrosLoaded = True
+
         N = tree.GetEntries()
         useMaxEvents = False
         if self.maxEvents >= 0 and N > self.maxEvents:
@@ -5034,6 +5958,14 @@ class NtupleCache:
         for d in directories:
             d.Write()
 
+        # The cache key is written last, so that an interrupted dataset is reprocessed
+        directories[0].cd()
+        keyNamed = ROOT.TNamed("cacheKey", cacheKey)
+        keyNamed.Write()
+        for d in [getSelectorDir(name) for name in allSelectorArgs.keys()] + [rootDirectory, self.cacheFile]:
+            d.SaveSelf(True)
+        self.cacheFile.Flush()
+
     ## Get a histogram from the cache file
     #
     # \param Datase        Dataset object for which histogram is to be obtained
@@ -38,10 +38,17 @@ in doing so.
 #================================================================================================
 # Import Modules
 #================================================================================================
+import os
+import re
 import sys
 import array
 import math
 import copy
+import json
+import atexit
+import hashlib
+import traceback
+import multiprocessing
 
 import ROOT
 
@@ -1654,6 +1661,7 @@ class PlotBase:
         self.plotObjectsAfter = []
 
         self.drawOptions = {}
+        self.drawKwargs = None
 
     ## Set the default legend styles
     #
@@ -1921,16 +1929,7 @@ class PlotBase:
     #                  given in the constructor and in
     #                  appendSaveFormat() are used
     def save(self, formats=None):
-        if formats == None:
-            formats = self.saveFormats
-
-        backup = ROOT.gErrorIgnoreLevel
-        ROOT.gErrorIgnoreLevel = ROOT.kWarning
-
-        for f in formats:
-            self.cf.canvas.SaveAs(self.cf.canvas.GetName()+f)
-
-        ROOT.gErrorIgnoreLevel = backup
+        self.saveAs(self.cf.canvas.GetName(), formats)
         
     ## Save the plot to file(s)
     #
@@ -1938,10 +1937,28 @@ class PlotBase:
     #                  given in the constructor and in
     #                  appendSaveFormat() are used
     # \param saveName  Alternative name for saving
+    #
+    # With incremental saving enabled (see setIncrementalSave()), and if
+    # the inputs of the plot are known (see getInputFingerprint()), the
+    # plot is recorded in the PlotManifest of the output directory, and
+    # the saving is skipped if the inputs have not changed since the
+    # plot was last saved.
     def saveAs(self, saveName, formats=None):
         if formats == None:
             formats = self.saveFormats
 
+        manifest = None
+        fingerprint = None
+        if _plotManifestEnabled and len(formats) > 0:
+            fingerprint = self.getInputFingerprint()
+        if fingerprint != None:
+            manifest = getPlotManifest(os.path.dirname(saveName))
+            # A plot saved again in the same process may have been modified in between
+            firstSave = saveName not in _plotManifestSaved
+            _plotManifestSaved.add(saveName)
+            if firstSave and manifest.isUpToDate(os.path.basename(saveName), fingerprint, formats):
+                return
+
         backup = ROOT.gErrorIgnoreLevel
         ROOT.gErrorIgnoreLevel = ROOT.kWarning
 
@@ -1950,6 +1967,17 @@ class PlotBase:
 
         ROOT.gErrorIgnoreLevel = backup
 
+        if manifest != None:
+            manifest.update(os.path.basename(saveName), fingerprint, formats)
+
+    ## Get the fingerprint of the inputs of the plot for PlotManifest
+    #
+    # \return fingerprint string, or None if the inputs are not known
+    #
+    # The base class does not know where the histograms come from.
+    def getInputFingerprint(self):
+        return None
+
     ## \var histoMgr
     # histograms.HistoManager object for histogram management
     ## \var saveFormats
@@ -1964,6 +1992,8 @@ class PlotBase:
     # histograms.CanvasFrame object to hold the TCanvas and TH1 for frame
     ## \var frame
     # TH1 object for the frame (from the cf object)
+    ## \var drawKwargs
+    # Arguments of the plots.PlotDrawer call drawing the plot (None if not drawn with PlotDrawer)
 
 ## Base class for plots with ratio (intended for multiple inheritance)
 #
@@ -2282,6 +2312,8 @@ class PlotSameBase(PlotBase):
         self.datasetMgr = datasetMgr
         self.rootHistoPath = name
         self.normalizeToOne = normalizeToOne
+        self.datasetRootHistoArgs = datasetRootHistoArgs
+        self.normalization = {}
 
         self.setEnergy(self.datasetMgr.getEnergies())
 
@@ -2289,6 +2321,21 @@ class PlotSameBase(PlotBase):
     def getRootHistoPath(self):
         return self.rootHistoPath
 
+    ## Get the fingerprint of the inputs of the plot for PlotManifest
+    #
+    # Contains the histograms and normalization of the datasets (see
+    # plots.plotInputFingerprint()), the normalization arguments, the
+    # plots.PlotDrawer arguments, and the styles and legend labels of
+    # the drawn histograms. Plots not drawn with plots.PlotDrawer (e.g.
+    # frame and texts created by hand) are not fingerprinted.
+    def getInputFingerprint(self):
+        if self.drawKwargs == None or len(self.datasetRootHistoArgs) > 0:
+            return None
+        styles = [_histoManagerStyleRepr(self.histoMgr)]
+        if hasattr(self, "ratioHistoMgr"):
+            styles.append(_histoManagerStyleRepr(self.ratioHistoMgr))
+        return plotInputFingerprint(self.datasetMgr, self.rootHistoPath, [self.__class__.__name__, self.normalizeToOne, self.normalization, self.drawOptions, self.drawKwargs, styles])
+
     ## Stack MC histograms
     #
     # \param stackSignal  Should the signal histograms be stacked too?
@@ -2401,6 +2448,7 @@ class MCPlot(PlotSameBase):
 
         # Base class constructor
         PlotSameBase.__init__(self, datasetMgr, name, **kwargs)
+        self.normalization = arg
         
         # Normalize the histograms
         if self.normalizeToOne or arg.get("normalizeByCrossSection", False):
@@ -2481,6 +2529,7 @@ class DataMCPlot(PlotSameBase, PlotRatioBase):
         '''
         PlotSameBase.__init__(self, datasetMgr, name, **kwargs)
         PlotRatioBase.__init__(self)
+        self.normalization = {"normalizeToLumi": normalizeToLumi}
         
         # Normalize the MC histograms to the data luminosity
         if normalizeToLumi == None:
@@ -3017,6 +3066,7 @@ class PlotDrawer:
     # work. These methods pick the arguments they are interested of.
     # For further documentation, please look the individual methods
     def __call__(self, p, name, *args, **kwargs):
+        p.drawKwargs = [name, args, kwargs]
         self.rebin(p, name, **kwargs)
         self.stackMCHistograms(p, **kwargs)
         self.createFrame(p, name, **kwargs)
@@ -3510,3 +3560,363 @@ class PlotDrawer:
 
 
 drawPlot = PlotDrawer()
+
+
+#================================================================================================
+# Plot manifest
+#================================================================================================
+## Name of the manifest file in each output directory
+plotManifestFileName = ".plotManifest.json"
+
+_plotManifestEnabled = False
+_plotManifestForceRebuild = False
+_plotManifests = {}
+_plotManifestSaved = set() # plots seen by PlotBase.saveAs() in this process
+
+## Enable skipping the saving of plots whose inputs have not changed (see PlotBase.saveAs())
+#
+# Only plots drawn with plots.PlotDrawer (e.g. plots.drawPlot) from
+# histograms of a DatasetManager are skipped. Changes made to the canvas
+# after PlotDrawer (e.g. additional texts) are not detected, except that
+# a plot saved again in the same process is always written.
+def setIncrementalSave(value=True):
+    global _plotManifestEnabled
+    _plotManifestEnabled = value
+
+## Force saving of all plots, even if their inputs have not changed
+def setForceRebuild(value=True):
+    global _plotManifestForceRebuild
+    _plotManifestForceRebuild = value
+
+## Raised by _canonicalRepr() for objects without a representation stable between runs
+class UnstableInputException(Exception):
+    pass
+
+_memoryAddress_re = re.compile("at 0x[0-9a-fA-F]+")
+
+## Canonical string representation of plot inputs for hashing
+#
+# Dictionaries are sorted by key, functions are represented by their
+# name and code, and classes by their qualified name. Other objects
+# are represented by repr(), and if that contains a memory address
+# (e.g. TObjects, style objects), UnstableInputException is raised,
+# since the representation would be different in every run.
+def _canonicalRepr(obj):
+    if obj is None or isinstance(obj, (basestring, bool, int, long, float)):
+        return repr(obj)
+    if isinstance(obj, dict):
+        return "{" + ", ".join("%s: %s" % (_canonicalRepr(k), _canonicalRepr(obj[k])) for k in sorted(obj.keys())) + "}"
+    if isinstance(obj, (list, tuple)):
+        return "[" + ", ".join(_canonicalRepr(o) for o in obj) + "]"
+    if hasattr(obj, "__code__"):
+        code = obj.__code__
+        return "%s.%s:%s" % (obj.__module__, obj.__name__, hashlib.md5(code.co_code + repr(code.co_consts)).hexdigest())
+    if hasattr(obj, "__module__") and hasattr(obj, "__name__"):
+        return "%s.%s" % (obj.__module__, obj.__name__)
+    ret = repr(obj)
+    if _memoryAddress_re.search(ret):
+        raise UnstableInputException("Object %s can not be fingerprinted" % ret)
+    return ret
+
+_rootStyleGetters = ["GetLineColor", "GetLineStyle", "GetLineWidth", "GetFillColor", "GetFillStyle", "GetMarkerColor", "GetMarkerStyle", "GetMarkerSize"]
+
+## Describe the line, fill and marker attributes of a ROOT object (THStack: of its histograms)
+def _rootStyleRepr(obj):
+    if obj == None: # important to use '==' instead of 'is'
+        return None
+    if hasattr(obj, "GetHists"):
+        hists = obj.GetHists()
+        if hists == None:
+            return []
+        return [_rootStyleRepr(h) for h in hists]
+    return [getattr(obj, name)() for name in _rootStyleGetters if hasattr(obj, name)]
+
+## Describe the names, legend labels, draw styles and attributes of the histograms of a histograms.HistoManager
+def _histoManagerStyleRepr(histoMgr):
+    ret = []
+    for h in histoMgr.getHistos():
+        ret.append([h.getName(), getattr(h, "legendLabel", None), getattr(h, "legendStyle", None), getattr(h, "drawStyle", None), _rootStyleRepr(h.getRootHisto())])
+    return ret
+
+## Describe the input histogram of a dataset for hashing
+#
+# \return list of the dataset name, the TKey information of the
+# histogram (see dataset.Dataset.getRootObjectKeyInfo()) and the
+# normalization (cross section, luminosity, number of all events), or
+# None if the histogram can not be identified
+def _datasetHistoFingerprint(dset, histoPath):
+    if hasattr(dset, "datasets"):
+        ret = []
+        for d in dset.datasets:
+            f = _datasetHistoFingerprint(d, histoPath)
+            if f == None:
+                return None
+            ret.append(f)
+        return [dset.getName(), ret]
+    if not hasattr(dset, "getRootObjectKeyInfo"):
+        return None
+    keyInfo = dset.getRootObjectKeyInfo(histoPath)
+    if keyInfo == None:
+        return None
+    norm = [dset.info.get("crossSection", None), dset.info.get("luminosity", None), getattr(dset, "nAllEvents", None)]
+    return [dset.getName(), keyInfo, norm]
+
+## Fingerprint of a plot made of a histogram from the datasets of a dataset.DatasetManager
+#
+# \param datasetMgr  dataset.DatasetManager
+# \param histoPath   Path of the histogram in the ROOT files
+# \param extra       Additional information (e.g. plot kwargs) to include
+#
+# \return fingerprint string, or None if the inputs can not be identified
+# (then the plot is always saved)
+def plotInputFingerprint(datasetMgr, histoPath, extra=None):
+    if not isinstance(histoPath, basestring):
+        return None
+    inputs = []
+    for d in datasetMgr.getAllDatasets():
+        f = _datasetHistoFingerprint(d, histoPath)
+        if f == None:
+            return None
+        inputs.append(f)
+    try:
+        return hashlib.md5(_canonicalRepr([histoPath, inputs, extra])).hexdigest()
+    except UnstableInputException:
+        return None
+
+## Record of the plots saved in a directory and the fingerprints of their inputs
+#
+# The manifest is stored in plotManifestFileName in the directory. It
+# is written by save(), which is called at the end of PlotFarm.run()
+# and for all manifests at exit.
+class PlotManifest:
+    def __init__(self, directory):
+        self._fileName = os.path.join(directory, plotManifestFileName)
+        self._entries = {}
+        self._modified = False
+        if os.path.exists(self._fileName):
+            try:
+                f = open(self._fileName)
+                self._entries = json.load(f)
+                f.close()
+            except (IOError, ValueError):
+                self._entries = {}
+
+    ## Check if a plot has been saved with the fingerprint to all the formats
+    def isUpToDate(self, name, fingerprint, formats):
+        if _plotManifestForceRebuild:
+            return False
+        entry = self._entries.get(name, None)
+        if entry == None or entry["fingerprint"] != fingerprint:
+            return False
+        directory = os.path.dirname(self._fileName)
+        for f in formats:
+            if f not in entry["formats"] or not os.path.exists(os.path.join(directory, name+f)):
+                return False
+        return True
+
+    ## Record a saved plot
+    def update(self, name, fingerprint, formats):
+        entry = self._entries.get(name, None)
+        if entry != None and entry["fingerprint"] == fingerprint:
+            formats = sorted(set(entry["formats"]) | set(formats))
+        self._entries[name] = {"fingerprint": fingerprint, "formats": sorted(formats)}
+        self._modified = True
+
+    ## Forget a plot
+    def remove(self, name):
+        if self._entries.pop(name, None) != None:
+            self._modified = True
+
+    ## Write the manifest if it has been modified (failures are ignored, the manifest is just an optimisation)
+    def save(self):
+        if not self._modified:
+            return
+        if not os.path.isdir(os.path.dirname(self._fileName) or "."):
+            return
+        tmpName = self._fileName + ".tmp%d" % os.getpid()
+        try:
+            f = open(tmpName, "w")
+            json.dump(self._entries, f, indent=2, sort_keys=True)
+            f.close()
+            os.rename(tmpName, self._fileName)
+        except (IOError, OSError):
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            return
+        self._modified = False
+
+## Get the PlotManifest of a directory
+def getPlotManifest(directory):
+    directory = os.path.abspath(directory)
+    if not directory in _plotManifests:
+        _plotManifests[directory] = PlotManifest(directory)
+    return _plotManifests[directory]
+
+## Write all modified manifests
+def savePlotManifests():
+    for manifest in _plotManifests.values():
+        manifest.save()
+
+atexit.register(savePlotManifests)
+
+#================================================================================================
+# Plotting job engine
+#================================================================================================
+## Job of PlotFarm
+class PlotFarmJob:
+    def __init__(self, histoPath, saveName, kwargs):
+        self.histoPath   = histoPath
+        self.saveName    = saveName
+        self.kwargs      = kwargs
+        self.fingerprint = None
+
+## Render a list of plots, optionally in forked worker processes
+#
+# Each job is given as a histogram path and the keyword arguments for
+# the plot. The plot function is called as
+# plotFunction(datasetMgr, histoPath, saveName, **kwargs), and it must
+# return the drawn plots.PlotBase object. It should not save the plot
+# (e.g. create it with saveFormats=[]), PlotFarm saves every plot once
+# to each of the formats.
+#
+# The worker processes are forked, and each of them creates its own
+# dataset.DatasetManager with createDatasetManager() (TFiles can not be
+# shared between processes). The plots are rendered in ROOT batch mode.
+#
+# The fingerprint of each job (see plotInputFingerprint(), with the
+# kwargs of the job) is recorded in the PlotManifest of the output
+# directory by this process. Jobs whose inputs have not changed since
+# the plot was last rendered are skipped.
+class PlotFarm:
+    ## Constructor
+    #
+    # \param createDatasetManager  Function returning a configured dataset.DatasetManager
+    # \param plotFunction          Function creating and drawing a plot (see above)
+    # \param saveDir               Output directory
+    # \param saveFormats           List of formats to save the plots to
+    # \param jobs                  Number of worker processes (1 for rendering in this process)
+    # \param forceRebuild          Render all plots even if the output is up to date
+    # \param verbose               Print the skipped and saved plots
+    def __init__(self, createDatasetManager, plotFunction, saveDir, saveFormats=[".png", ".pdf", ".C"], jobs=1, forceRebuild=False, verbose=False):
+        self._createDatasetManager = createDatasetManager
+        self._plotFunction = plotFunction
+        self._saveDir = saveDir
+        self._saveFormats = saveFormats[:]
+        self._jobs = jobs
+        self._forceRebuild = forceRebuild
+        self._verbose = verbose
+        self._jobList = []
+        self._datasetMgr = None
+
+    ## Add a job
+    #
+    # \param histoPath  Path of the histogram (passed to the plot function)
+    # \param saveName   Name of the output files without extension (default: histoPath with "/" replaced by "_")
+    # \param kwargs     Keyword arguments for the plot function
+    def addJob(self, histoPath, saveName=None, **kwargs):
+        if saveName == None:
+            saveName = histoPath.replace("/", "_")
+        self._jobList.append(PlotFarmJob(histoPath, saveName, kwargs))
+
+    ## Add jobs from a list of (histogram path, kwargs) pairs
+    def addJobs(self, specs):
+        for (histoPath, kwargs) in specs:
+            self.addJob(histoPath, **kwargs)
+
+    ## Get the dataset.DatasetManager of this process (created on the first call)
+    def getDatasetManager(self):
+        if self._datasetMgr == None:
+            self._datasetMgr = self._createDatasetManager()
+        return self._datasetMgr
+
+    def _getSavePath(self, job):
+        return os.path.join(self._saveDir, job.saveName)
+
+    ## Render the plot of a job
+    #
+    # The manifest is not updated by saveAs(), this is done by run()
+    #
+    # \return None on success, otherwise the error message
+    def _render(self, job, datasetMgr):
+        global _plotManifestEnabled
+        backup = _plotManifestEnabled
+        _plotManifestEnabled = False
+        try:
+            p = self._plotFunction(datasetMgr, job.histoPath, job.saveName, **job.kwargs)
+            p.saveAs(self._getSavePath(job), formats=self._saveFormats)
+        except Exception:
+            return traceback.format_exc()
+        finally:
+            _plotManifestEnabled = backup
+        return None
+
+    ## Render the plots
+    #
+    # \return list of the saved plot names (without extensions)
+    def run(self):
+        if not os.path.exists(self._saveDir):
+            os.makedirs(self._saveDir)
+
+        manifest = getPlotManifest(self._saveDir)
+        todo = []
+        for job in self._jobList:
+            job.fingerprint = plotInputFingerprint(self.getDatasetManager(), job.histoPath, [job.kwargs, self._plotFunction])
+            if not self._forceRebuild and job.fingerprint != None and manifest.isUpToDate(job.saveName, job.fingerprint, self._saveFormats):
+                if self._verbose:
+                    print "Skipping up-to-date plot %s" % self._getSavePath(job)
+                continue
+            todo.append(job)
+
+        saved = []
+        errors = []
+        if self._jobs > 1 and len(todo) > 1:
+            results = self._runParallel(todo)
+        else:
+            results = ((i, self._render(job, self.getDatasetManager())) for i, job in enumerate(todo))
+        try:
+            for (i, error) in results:
+                job = todo[i]
+                if error != None:
+                    errors.append("%s:\n%s" % (job.histoPath, error))
+                    manifest.remove(job.saveName)
+                    continue
+                if job.fingerprint != None:
+                    manifest.update(job.saveName, job.fingerprint, self._saveFormats)
+                saved.append(self._getSavePath(job))
+                if self._verbose:
+                    print "Saved %s (%s)" % (self._getSavePath(job), ", ".join(self._saveFormats))
+        finally:
+            manifest.save()
+
+        if len(errors) > 0:
+            raise Exception("Rendering of %d plots failed:\n%s" % (len(errors), "\n".join(errors)))
+        return saved
+
+    def _runParallel(self, todo):
+        global _plotFarm, _plotFarmJobs
+        myJobs = min(self._jobs, len(todo))
+        _plotFarm = self
+        _plotFarmJobs = todo
+        pool = multiprocessing.Pool(myJobs, _initPlotFarmWorker)
+        try:
+            for result in pool.imap_unordered(_renderPlotFarmJob, range(len(todo))):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+            _plotFarm = None
+            _plotFarmJobs = None
+
+_plotFarm = None
+_plotFarmJobs = None
+_plotFarmDatasetMgr = None
+
+## Creates the dataset manager of a PlotFarm worker process
+def _initPlotFarmWorker():
+    global _plotFarmDatasetMgr
+    ROOT.gROOT.SetBatch(True)
+    _plotFarmDatasetMgr = _plotFarm._createDatasetManager()
+
+## Renders one PlotFarm job in a worker process
+def _renderPlotFarmJob(index):
+    return (index, _plotFarm._render(_plotFarmJobs[index], _plotFarmDatasetMgr))
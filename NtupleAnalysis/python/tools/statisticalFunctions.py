@@ -133,53 +133,25 @@ def signalXsecAtNsigma(nSignal,tanbRef,nSignalAtLimit,mHp,mu):
         #return -1
     #return tanb
 
+## Solve tanb for which BR(t->bH+) equals brAtLimit on the branch where the BR increases with tanb
+#
+# \return tanb closest to tanbRef, or -1 if there is no solution
 def tanbForBR(brAtLimit, mHp, tanbRef, mu):
-    tanb = tanbRef
-    
-    br = getBR_top2bHp(mHp, tanb, mu)
-    maxIter = 100
-    i = 0
-    while abs(br - brAtLimit)/brAtLimit > 0.01 and br > 0 and tanb < 219 and i < maxIter:
-        i += 1
-        tanb_delta = 0.1*(brAtLimit - br)/brAtLimit * tanb
-        tanb = tanb + tanb_delta
-        br = getBR_top2bHp(mHp, tanb, mu)
-#        print "       tanbForBR loop, tanb %f, tanb_delta %f, br %f" % (tanb, tanb_delta, br)
-#    print "check tanbForBR ",tanb
-    if i >= maxIter:
-        print "Maximum number of iterations reached (%d), difference in (br-limit)/limit = %f" % (maxIter, (br-brAtLimit)/brAtLimit)
-
-    if tanb > 219 or br <= 0:
-        return -1
-    return tanb
+    return getTanb(mHp, mu, brAtLimit, tanbRef, increasing=True)
 #    return tanbForXsec(crosssection.whTauNuCrossSection(brAtLimit, 1), mHp, tanbRef, mu)
 
+## Solve tanb for which BR(t->bH+) equals brAtLimit on the branch where the BR decreases with tanb
+#
+# \return tanb closest to tanbRef, or -1 if there is no solution
 def tanbForBRlow(brAtLimit, mHp, tanbRef, mu):
-    tanb = tanbRef
-    
-    br = getBR_top2bHp(mHp, tanb, mu)
-    maxIter = 100
-    i = 0
-    while abs(br - brAtLimit)/brAtLimit > 0.01 and br > 0 and tanb > 1.1 and i < maxIter:
-        i += 1
-        tanb_delta = 0.1*(brAtLimit - br)/brAtLimit * tanb
-        tanb = tanb - tanb_delta
-        br = getBR_top2bHp(mHp, tanb, mu)
-#        print "       tanbForBR loop, tanb %f, tanb_delta %f, br %f" % (tanb, tanb_delta, br)
-#    print "check tanbForBR ",tanb
-    if i >= maxIter:
-        print "Maximum number of iterations reached (%d), difference in (br-limit)/limit = %f" % (maxIter, (br-brAtLimit)/brAtLimit)
-
-    if tanb < 1.1 or br <= 0:
-        return -1
-    return tanb
+    return getTanb(mHp, mu, brAtLimit, tanbRef, increasing=False)
 #    return tanbForXsec(crosssection.whTauNuCrossSection(brAtLimit, 1), mHp, tanbRef, mu)
 
 def tanbForTheoryLimit(mHp,mu):
     nTanbs = 0
     lastTanb = 0
     nValidTanbs = 0
-    tanbs = hplusBranchingRatio[mHp].keys()
+    tanbs = getTanbValues(mHp)
     for tanb in tanbs:
 #        print "    check loop tanb ",tanb,getBR_top2bHp(mHp,tanb,mu),mHp,tanb,mu
 	nTanbs = nTanbs+1
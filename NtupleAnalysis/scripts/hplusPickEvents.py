@@ -8,30 +8,47 @@ import ROOT
 
 def usage():
     print
-    print "### Usage:   ",os.path.basename(sys.argv[0])," <rootfile> <pickEvents.txt>"
+    print "### Usage:   ",os.path.basename(sys.argv[0])," <rootfile> [<rootfile> ...] <pickEvents.txt> [<pickEvents2.txt> ...]"
     print
     sys.exit()
 
-def main():
-
-    if len(sys.argv) < 3:
-        usage()
-
-    root_re = re.compile("(?P<filename>[^/]*\.root)")
-    pick_re = re.compile("(?P<filename>pick\S*\.txt)")
-
-    rootFile = ""
-    pickFile = ""
-    for argv in sys.argv:
-        match = root_re.search(argv)
-        if match:
-            rootFile = argv
-        match = pick_re.search(argv)
-        if match:
-            pickFile = argv
-
-    #print rootFile,pickFile
+# Number of entries read at a time when looking for the picked events
+chunkSize = 1000000
 
+def readPickFiles(pickFiles):
+    rle_re = re.compile("(?P<run>\d+):(?P<lumi>\d+):(?P<event>\d+)")
+    picked = set()
+    for pickFile in pickFiles:
+        fPick = open(pickFile)
+        for line in fPick:
+            match = rle_re.search(line)
+            if match:
+                picked.add((int(match.group("run")), int(match.group("lumi")), int(match.group("event"))))
+        fPick.close()
+    return picked
+
+def findPickedEntries(tree, picked):
+    # Read only the run, lumi and event branches (in chunks with TTree::Draw) and
+    # look the triplets up from the set of picked events
+    entries = []
+    nentries = tree.GetEntries()
+    tree.SetEstimate(min(chunkSize, nentries)+1)
+    first = 0
+    while first < nentries:
+        n = tree.Draw("run:lumi:event", "", "goff", chunkSize, first)
+        runs = tree.GetV1()
+        lumis = tree.GetV2()
+        events = tree.GetV3()
+        for i in xrange(n):
+            if (int(runs[i]), int(lumis[i]), int(events[i])) in picked:
+                entries.append(first+i)
+        first += chunkSize
+        sys.stdout.write("Processed %i/%i entries          "%(min(first, nentries), nentries))
+        sys.stdout.flush()
+        restart_line()
+    return entries
+
+def pickEvents(rootFile, picked):
     newFile = os.path.basename(rootFile.replace(".root","_PickEvents.root"))
 
     fIN = ROOT.TFile.Open(rootFile)
@@ -74,40 +91,15 @@ def main():
 
     fIN.cd()
     tree = fIN.Get("Events")
+    entries = findPickedEntries(tree, picked)
+    print "Found %i/%i picked events in %s          "%(len(entries), len(picked), rootFile)
+
+    # Copy only the matching entries
     fOUT.cd()
     pickTree = tree.CloneTree(0)
-    rle_re = re.compile("(?P<run>\d+):(?P<lumi>\d+):(?P<event>\d+)")
-    fPick = open(pickFile)
-    fSelection = ""
-    for i,line in enumerate(fPick):
-        match = rle_re.search(line)
-        if match:
-            run = match.group("run")
-            lumi = match.group("lumi")
-            event = match.group("event")
-            selection = "(run == %s && lumi == %s && event == %s)"%(run,lumi,event)
-            if len(fSelection) == 0:
-                fSelection += selection
-            else:
-                fSelection += "||"+selection 
-            if i > 0 and i%50 == 0:
-                sys.stdout.write("Processing %ith event          "%i)
-                sys.stdout.flush()
-                restart_line()
-                fIN.cd()
-                tmptree = tree.CopyTree(fSelection)
-                treelist = ROOT.TList()
-                treelist.Add(tmptree)
-                fOUT.cd()
-                pickTree.Merge(treelist)
-                fSelection = ""
-    fIN.cd()
-    tmptree = tree.CopyTree(fSelection)
-    treelist = ROOT.TList()
-    treelist.Add(tmptree)
-    fOUT.cd()
-    print "Processed all events         "
-    pickTree.Merge(treelist)
+    for entry in entries:
+        tree.GetEntry(entry)
+        pickTree.Fill()
 
     pickTree.Write()
 
@@ -127,6 +119,33 @@ def main():
     fOUT.Close()
     fIN.Close()
 
+def main():
+
+    if len(sys.argv) < 3:
+        usage()
+
+    root_re = re.compile("(?P<filename>[^/]*\.root)")
+    pick_re = re.compile("(?P<filename>pick\S*\.txt)")
+
+    rootFiles = []
+    pickFiles = []
+    for argv in sys.argv[1:]:
+        match = root_re.search(argv)
+        if match:
+            rootFiles.append(argv)
+        match = pick_re.search(argv)
+        if match:
+            pickFiles.append(argv)
+
+    #print rootFiles,pickFiles
+    if len(rootFiles) == 0 or len(pickFiles) == 0:
+        usage()
+
+    picked = readPickFiles(pickFiles)
+    print "Picking %i events from %i file(s)"%(len(picked), len(rootFiles))
+    for rootFile in rootFiles:
+        pickEvents(rootFile, picked)
+
 def restart_line():
     sys.stdout.write('\r')
     sys.stdout.flush()
@@ -328,7 +328,7 @@ def SavePlot(plot, plotName, saveDir, saveFormats = [".pdf", ".png", ".C"]):
         saveNameURL = saveName + ext
         saveNameURL = aux.convertToURL(saveNameURL, opts.url)
         Verbose(saveNameURL, i==0)
-        plot.saveAs(saveName, formats=saveFormats)
+    plot.saveAs(saveName, formats=saveFormats)
     return
 
 def GetDatasetsFromDir(opts):
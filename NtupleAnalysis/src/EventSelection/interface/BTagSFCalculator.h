@@ -106,6 +106,10 @@ private:
   void handleEfficiencyInput(boost::optional<std::vector<ParameterSet>> psets);
   /// Method for handling the SF input
   void handleSFInput(boost::optional<std::vector<ParameterSet>> psets);
+  /// Method for handling the SF input given as packed columns
+  void handleSFTableInput(boost::optional<ParameterSet> table);
+  /// Add a single SF payload row
+  void addSFInput(BTagSFInputStash::BTagJetFlavorType flavor, float ptMin, float ptMax, const std::string& sysType, const std::string& formula);
   /// Method for converting flavor string to flavor type
   BTagSFInputStash::BTagJetFlavorType getFlavorTypeForEfficiency(const std::string& str) const;
   /// Method for converting flavor string to flavor type
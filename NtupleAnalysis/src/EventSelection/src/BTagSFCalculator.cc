@@ -186,6 +186,7 @@ BTagSFCalculator::BTagSFCalculator(const ParameterSet& config)
   fEfficienciesUp.setOverflowBinByPt("EfficiencyUp");
   fEfficienciesDown.setOverflowBinByPt("EfficiencyDown");
   // Import scale factors
+  handleSFTableInput(config.getParameterOptional<ParameterSet>("btagSFTable"));
   handleSFInput(config.getParameterOptional<std::vector<ParameterSet>>("btagSF"));
   fSF.setOverflowBinByPt("SFnominal");
   fSFUp.setOverflowBinByPt("SFup");
@@ -363,38 +364,57 @@ void BTagSFCalculator::handleEfficiencyInput(boost::optional<std::vector<Paramet
 void BTagSFCalculator::handleSFInput(boost::optional<std::vector<ParameterSet>> psets) {
   if (!psets) return;
   for (auto &p: *psets) {
-    // Obtain variables
-    float ptMin = p.getParameter<float>("ptMin");
-    float ptMax = p.getParameter<float>("ptMax");
-    std::string formula = p.getParameter<std::string>("formula");
-    std::string sysType = p.getParameter<std::string>("sysType");
-    BTagSFInputStash::BTagJetFlavorType flavor = getFlavorTypeForSF(p.getParameter<int>("jetFlavor"));
-    std::vector<BTagSFInputStash::BTagJetFlavorType> flavorCollection;
-    if (flavor == BTagSFInputStash::kUDSGJet) {
-      // flavorCollection.push_back(BTagSFInputStash::kUDSJet);
-      // flavorCollection.push_back(BTagSFInputStash::kGJet);
-      flavorCollection.push_back(BTagSFInputStash::kUDSGJet);
-    } else {
-      flavorCollection.push_back(flavor);
-    }
-    for (auto pflavor: flavorCollection) {
-      if (sysType == " central") {
-        fSF.addInput(pflavor, ptMin, ptMax, formula);
-      } else if (sysType == " up") {
-        fSFUp.addInput(pflavor, ptMin, ptMax, formula);
-      } else if (sysType == " down") {
-        fSFDown.addInput(pflavor, ptMin, ptMax, formula);
-      } else {
-        throw hplus::Exception("config") << "Undefined value for sysType '" << sysType << "'!";
-      }
-      //std::cout << "sf " << pflavor << std::endl;
-    }
+    addSFInput(getFlavorTypeForSF(p.getParameter<int>("jetFlavor")),
+               p.getParameter<float>("ptMin"),
+               p.getParameter<float>("ptMax"),
+               p.getParameter<std::string>("sysType"),
+               p.getParameter<std::string>("formula"));
   }
+  return;
+}
 
-  //std::cout << fBToBSF.size() << " " << fCToBSF.size() << " " << fGToBSF.size() << " " << fUdsToBSF.size() << std::endl;
+// Import scale factors given as a table of packed columns (one entry per payload row)
+void BTagSFCalculator::handleSFTableInput(boost::optional<ParameterSet> table) {
+  if (!table) return;
+  std::vector<int> jetFlavor = table->getParameter<std::vector<int>>("jetFlavor");
+  std::vector<float> ptMin = table->getParameter<std::vector<float>>("ptMin");
+  std::vector<float> ptMax = table->getParameter<std::vector<float>>("ptMax");
+  std::vector<std::string> sysType = table->getParameter<std::vector<std::string>>("sysType");
+  std::vector<std::string> formula = table->getParameter<std::vector<std::string>>("formula");
+  const size_t n = jetFlavor.size();
+  if (ptMin.size() != n || ptMax.size() != n || sysType.size() != n || formula.size() != n) {
+    throw hplus::Exception("config") << "btagSFTable columns have different lengths!";
+  }
+  for (size_t i = 0; i < n; ++i) {
+    addSFInput(getFlavorTypeForSF(jetFlavor[i]), ptMin[i], ptMax[i], sysType[i], formula[i]);
+  }
   return;
 }
 
+// Add a single scale factor payload row
+void BTagSFCalculator::addSFInput(BTagSFInputStash::BTagJetFlavorType flavor, float ptMin, float ptMax, const std::string& sysType, const std::string& formula) {
+  std::vector<BTagSFInputStash::BTagJetFlavorType> flavorCollection;
+  if (flavor == BTagSFInputStash::kUDSGJet) {
+    // flavorCollection.push_back(BTagSFInputStash::kUDSJet);
+    // flavorCollection.push_back(BTagSFInputStash::kGJet);
+    flavorCollection.push_back(BTagSFInputStash::kUDSGJet);
+  } else {
+    flavorCollection.push_back(flavor);
+  }
+  for (auto pflavor: flavorCollection) {
+    if (sysType == " central") {
+      fSF.addInput(pflavor, ptMin, ptMax, formula);
+    } else if (sysType == " up") {
+      fSFUp.addInput(pflavor, ptMin, ptMax, formula);
+    } else if (sysType == " down") {
+      fSFDown.addInput(pflavor, ptMin, ptMax, formula);
+    } else {
+      throw hplus::Exception("config") << "Undefined value for sysType '" << sysType << "'!";
+    }
+    //std::cout << "sf " << pflavor << std::endl;
+  }
+}
+
 // Get flavor type for efficiency (from .json file evaluated with BTagEfficiencyAnalysis)
 BTagSFInputStash::BTagJetFlavorType BTagSFCalculator::getFlavorTypeForEfficiency(const std::string& str) const {
   if (str == "B") {
@@ -222,7 +222,7 @@ def SavePlot(plot, plotName, saveDir, saveFormats = [".C", ".png", ".pdf"]):
         saveNameURL = saveName + ext
         saveNameURL = aux.convertToURL(saveNameURL, opts.url)
         Print(saveNameURL, i==0)
-        plot.saveAs(saveName, formats=saveFormats)
+    plot.saveAs(saveName, formats=saveFormats)
     return
 
 def getLegend(opts, xLeg1=0.53):
@@ -19,6 +19,33 @@
 #include <sstream>
 #include <unordered_set>
 
+namespace {
+  // Replace the "@PSetRef:<index>" strings (written by PSetSerializationCache
+  // in main.py) with the shared configurations "psetref_<index>" of the input list
+  std::string expandPSetReferences(const std::string& config, const TList *input) {
+    const std::string prefix = "\"@PSetRef:";
+    std::string result;
+    std::string::size_type pos = 0;
+    while(true) {
+      std::string::size_type begin = config.find(prefix, pos);
+      if(begin == std::string::npos)
+        break;
+      std::string::size_type end = config.find('"', begin+prefix.size());
+      if(end == std::string::npos)
+        throw hplus::Exception("config") << "Unterminated shared configuration reference in analyzer configuration";
+      std::string name = "psetref_" + config.substr(begin+prefix.size(), end-begin-prefix.size());
+      const TNamed *shared = dynamic_cast<const TNamed *>(input->FindObject(name.c_str()));
+      if(!shared)
+        throw hplus::Exception("config") << "Shared configuration " << name << " not found from the input list";
+      result.append(config, pos, begin-pos);
+      result.append(shared->GetTitle());
+      pos = end+1;
+    }
+    result.append(config, pos, std::string::npos);
+    return result;
+  }
+}
+
 ClassImp(SelectorImplParams)
 
 ClassImp(SelectorImpl)
@@ -208,7 +235,7 @@ void SelectorImpl::SlaveBegin(TTree * /*tree*/) {
       std::string title(nm->GetTitle());
       std::string::size_type pos = title.find(":");
       std::string className = title.substr(0, pos);
-      std::string config = title.substr(pos+1);
+      std::string config = expandPSetReferences(title.substr(pos+1), fInput);
 
       auto selector = SelectorFactory::create(className, config, bIsMC, hLocalSkimCounters);
       selector->setEventSaver(fEventSaver);
@@ -474,7 +474,7 @@ def SavePlot(plot, plotName, saveDir, saveFormats = [".png", ".C", ".eps"]):
             Print(saveNameURL, i==0)
         else:
             Print(saveName + ext, i==0)
-        plot.saveAs(saveName, formats=saveFormats)
+    plot.saveAs(saveName, formats=saveFormats)
     return
 
 
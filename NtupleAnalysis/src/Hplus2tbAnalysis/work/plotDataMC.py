@@ -111,54 +111,55 @@ def main(opts):
     for opt in optModes:
         opts.optMode = opt
 
-        # Setup & configure the dataset manager 
-        datasetsMgr = GetDatasetsFromDir(opts)
-        datasetsMgr.updateNAllEventsToPUWeighted()
-        datasetsMgr.loadLuminosities() # from lumi.json
-
-        # Set/Overwrite cross-sections
-        for d in datasetsMgr.getAllDatasets():
-            if "ChargedHiggs" in d.getName():
-                datasetsMgr.getDataset(d.getName()).setCrossSection(1.0) # ATLAS 13 TeV H->tb exclusion limits
-                
-        if opts.verbose:
-            datasetsMgr.PrintCrossSections()
-            datasetsMgr.PrintLuminosities()
-
-        # Merge histograms (see NtupleAnalysis/python/tools/plots.py) 
-        plots.mergeRenameReorderForDataMC(datasetsMgr) 
-   
-        # Custom Filtering of datasets 
-        datasetsMgr.remove(filter(lambda name: "QCD-b" in name, datasetsMgr.getAllDatasetNames()))
-        # datasetsMgr.remove(filter(lambda name: "Charged" in name, datasetsMgr.getAllDatasetNames()))
-
-        # Re-order datasets (different for inverted than default=baseline)
-        newOrder = ["Data"]
-        if opts.signalMass != 0:
-            signal = "ChargedHiggs_HplusTB_HplusToTB_M_%.0f" % opts.signalMass
-            newOrder.extend([signal])
-        else:
-            newOrder.extend(["QCD-Data"])
-        newOrder.extend(["QCD"])
-        newOrder.extend(GetListOfEwkDatasets())
-        datasetsMgr.selectAndReorder(newOrder)
-        
-        # Merge EWK samples
-        if opts.mergeEWK:
-            datasetsMgr.merge("EWK", GetListOfEwkDatasets())
-            plots._plotStyles["EWK"] = styles.getAltEWKStyle()
-
-        # Print dataset information
-        datasetsMgr.PrintInfo()
-
         # Apply TDR style
         style = tdrstyle.TDRStyle()
         style.setOptStat(True)
 
         # Do Data-MC histograms with DataDriven QCD
-        DataMCHistograms(datasetsMgr)
+        DataMCHistograms(opts)
     return
 
+def CreateDatasetsManager(opts):
+    Verbose("Creating the datasets manager")
+
+    # Setup & configure the dataset manager 
+    datasetsMgr = GetDatasetsFromDir(opts)
+    datasetsMgr.updateNAllEventsToPUWeighted()
+    datasetsMgr.loadLuminosities() # from lumi.json
+
+    # Set/Overwrite cross-sections
+    for d in datasetsMgr.getAllDatasets():
+        if "ChargedHiggs" in d.getName():
+            datasetsMgr.getDataset(d.getName()).setCrossSection(1.0) # ATLAS 13 TeV H->tb exclusion limits
+            
+    if opts.verbose:
+        datasetsMgr.PrintCrossSections()
+        datasetsMgr.PrintLuminosities()
+
+    # Merge histograms (see NtupleAnalysis/python/tools/plots.py) 
+    plots.mergeRenameReorderForDataMC(datasetsMgr) 
+   
+    # Custom Filtering of datasets 
+    datasetsMgr.remove(filter(lambda name: "QCD-b" in name, datasetsMgr.getAllDatasetNames()))
+    # datasetsMgr.remove(filter(lambda name: "Charged" in name, datasetsMgr.getAllDatasetNames()))
+
+    # Re-order datasets (different for inverted than default=baseline)
+    newOrder = ["Data"]
+    if opts.signalMass != 0:
+        signal = "ChargedHiggs_HplusTB_HplusToTB_M_%.0f" % opts.signalMass
+        newOrder.extend([signal])
+    else:
+        newOrder.extend(["QCD-Data"])
+    newOrder.extend(["QCD"])
+    newOrder.extend(GetListOfEwkDatasets())
+    datasetsMgr.selectAndReorder(newOrder)
+    
+    # Merge EWK samples
+    if opts.mergeEWK:
+        datasetsMgr.merge("EWK", GetListOfEwkDatasets())
+        plots._plotStyles["EWK"] = styles.getAltEWKStyle()
+    return datasetsMgr
+
 def GetHistoKwargs(histoList, opts):
     '''
     Dictionary with 
@@ -395,12 +396,21 @@ def GetHistoKwargs(histoList, opts):
         histoKwargs[h] = kwargs
     return histoKwargs
     
-def DataMCHistograms(datasetsMgr):
+def DataMCHistograms(opts):
     Verbose("Plotting Data-MC Histograms")
 
     # Definitions
     histoNames  = []
     saveFormats = [".png"] #[".C", ".png", ".pdf"]
+    saveDir     = os.path.join(opts.saveDir, opts.optMode)
+
+    # The plots are rendered by worker processes, each with its own datasets manager
+    farm = plots.PlotFarm(lambda: CreateDatasetsManager(opts), DataMCPlot, saveDir, saveFormats,
+                          jobs=opts.jobs, forceRebuild=opts.forceRebuild, verbose=opts.verbose)
+    datasetsMgr = farm.getDatasetManager()
+
+    # Print dataset information
+    datasetsMgr.PrintInfo()
 
     # Get list of histograms
     dataPath    = "ForDataDrivenCtrlPlots"
@@ -448,33 +458,40 @@ def DataMCHistograms(datasetsMgr):
         if "_BtagDiscriminator_" in histoName:
             continue
 
-        kwargs_  = histoKwargs[histoName]
-        saveName = histoName.replace("/", "_")
+        # The signal mass is passed explicitly, so that it is part of the fingerprint of the job
+        farm.addJob(histoName, signalMass=opts.signalMass, **histoKwargs[histoName])
 
-        # Create the plotting object
-        p = plots.DataMCPlot(datasetsMgr, histoName, saveFormats=[])
+    # Draw and save the plots (each format is written once)
+    for saveName in farm.run():
+        PrintSavedPlot(saveName, saveFormats)
+    return
 
-        # Apply QCD data-driven style
-        if opts.signalMass != 0:
-            signal = "ChargedHiggs_HplusTB_HplusToTB_M_%.0f" % opts.signalMass
-            mHPlus = "%s" % int(opts.signalMass)
-            p.histoMgr.forHisto(signal, styles.getSignalStyleHToTB_M(mHPlus))
+def DataMCPlot(datasetsMgr, histoName, saveName, signalMass=0, **kwargs_):
+    Verbose("Drawing %s" % (histoName))
 
-        #p.histoMgr.forHisto(opts.signalMass, styles.getSignalStyleHToTB())
-        p.histoMgr.setHistoLegendLabelMany({
-                "QCD": "QCD (MC)",
-                })            
+    # Create the plotting object
+    p = plots.DataMCPlot(datasetsMgr, histoName, saveFormats=[])
 
-        # Apply blinding of signal region
-        if "blindingRangeString" in kwargs_:
-            startBlind = float(kwargs_["blindingRangeString"].split("-")[1])
-            endBlind   = float(kwargs_["blindingRangeString"].split("-")[0])
-            plots.partiallyBlind(p, maxShownValue=startBlind, minShownValue=endBlind, invert=True, moveBlindedText=kwargs_["moveBlindedText"])
+    # Apply QCD data-driven style
+    if signalMass != 0:
+        signal = "ChargedHiggs_HplusTB_HplusToTB_M_%.0f" % signalMass
+        mHPlus = "%s" % int(signalMass)
+        p.histoMgr.forHisto(signal, styles.getSignalStyleHToTB_M(mHPlus))
 
-        # Draw and save the plot
-        plots.drawPlot(p, saveName, **kwargs_) #the "**" unpacks the kwargs_ dictionary
-        SavePlot(p, saveName, os.path.join(opts.saveDir, opts.optMode), [".png"] )
-    return
+    #p.histoMgr.forHisto(opts.signalMass, styles.getSignalStyleHToTB())
+    p.histoMgr.setHistoLegendLabelMany({
+            "QCD": "QCD (MC)",
+            })            
+
+    # Apply blinding of signal region
+    if "blindingRangeString" in kwargs_:
+        startBlind = float(kwargs_["blindingRangeString"].split("-")[1])
+        endBlind   = float(kwargs_["blindingRangeString"].split("-")[0])
+        plots.partiallyBlind(p, maxShownValue=startBlind, minShownValue=endBlind, invert=True, moveBlindedText=kwargs_["moveBlindedText"])
+
+    # Draw the plot
+    plots.drawPlot(p, saveName, **kwargs_) #the "**" unpacks the kwargs_ dictionary
+    return p
 
 def getHisto(datasetsMgr, datasetName, histoName):
     Verbose("getHisto()", True)
@@ -483,16 +500,7 @@ def getHisto(datasetsMgr, datasetName, histoName):
     h1.setName(datasetName)
     return h1
 
-def SavePlot(plot, plotName, saveDir, saveFormats = [".png", ".pdf"]):
-    Verbose("Saving the plot in %s formats: %s" % (len(saveFormats), ", ".join(saveFormats) ) )
-
-    # Check that path exists
-    if not os.path.exists(saveDir):
-        os.makedirs(saveDir)
-
-    # Create the name under which plot will be saved
-    saveName = os.path.join(saveDir, plotName.replace("/", "_"))
-
+def PrintSavedPlot(saveName, saveFormats):
     # For-loop: All save formats
     for i, ext in enumerate(saveFormats):
         saveNameURL = saveName + ext
@@ -501,7 +509,6 @@ def SavePlot(plot, plotName, saveDir, saveFormats = [".png", ".pdf"]):
             Print(saveNameURL, i==0)
         else:
             Print(saveName + ext, i==0)
-        plot.saveAs(saveName, formats=saveFormats)
     return
 
 
@@ -543,6 +550,8 @@ if __name__ == "__main__":
     SAVEDIR      = "/publicweb/a/aattikis/DataMC/"
     VERBOSE      = False
     HISTOLEVEL   = "Vital" # 'Vital' , 'Informative' , 'Debug' 
+    JOBS         = 1
+    FORCEREBUILD = False
 
     # Define the available script options
     parser = OptionParser(usage="Usage: %prog [options]")
@@ -595,6 +604,12 @@ if __name__ == "__main__":
     parser.add_option("-e", "--excludeTasks", dest="excludeTasks", action="store", 
                       help="List of datasets in mcrab to exclude")
 
+    parser.add_option("-j", "--jobs", dest="jobs", type=int, default=JOBS,
+                      help="Number of processes rendering the plots in parallel [default: %s]" % JOBS)
+
+    parser.add_option("--forceRebuild", dest="forceRebuild", action="store_true", default=FORCEREBUILD,
+                      help="Render all plots, including the ones whose inputs have not changed since the last rendering [default: %s]" % FORCEREBUILD)
+
     (opts, parseArgs) = parser.parse_args()
 
     # Require at least two arguments (script-name, path to multicrab)
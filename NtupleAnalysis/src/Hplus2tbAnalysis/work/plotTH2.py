@@ -343,7 +343,7 @@ def SavePlot(plot, plotName, saveDir, saveFormats = [".png", ".pdf"]):
             Verbose(saveNameURL, i==0)
         else:
             Verbose(saveName + ext, i==0)
-        plot.saveAs(saveName, formats=saveFormats)
+    plot.saveAs(saveName, formats=saveFormats)
     return
 
 
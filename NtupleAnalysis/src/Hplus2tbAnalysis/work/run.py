@@ -237,6 +237,9 @@ def main():
     if opts.jCores:
         Print("Running process with PROOF (proofWorkes=%s)" % ( str(opts.jCores) ) )
         process.run(proof=True, proofWorkers=opts.jCores)
+    elif opts.workers:
+        Print("Running process with %s local worker processes" % ( str(opts.workers) ) )
+        process.run(workers=opts.workers, filesPerJob=opts.filesPerJob, entriesPerJob=opts.entriesPerJob)
     else:
         Print("Running process")
         process.run()
@@ -264,6 +267,9 @@ def PrintOptions(opts):
     table.append(hLine)
     #table.append( msgAlign.format("mcrab" , opts.mcrab , "") )
     table.append( msgAlign.format("jCores", opts.jCores, "") )
+    table.append( msgAlign.format("workers", opts.workers, "") )
+    table.append( msgAlign.format("filesPerJob", opts.filesPerJob, "") )
+    table.append( msgAlign.format("entriesPerJob", opts.entriesPerJob, "") )
     table.append( msgAlign.format("includeOnlyTasks", opts.includeOnlyTasks, "") )
     table.append( msgAlign.format("excludeTasks", opts.excludeTasks, "") )
     table.append( msgAlign.format("nEvts", opts.nEvts, NEVTS) )
@@ -314,6 +320,15 @@ if __name__ == "__main__":
     parser.add_option("-j", "--jCores", dest="jCores", action="store", type=int, 
                       help="Number of CPU cores (PROOF workes) to use. (default: all available)")
 
+    parser.add_option("-w", "--workers", dest="workers", action="store", type=int, 
+                      help="Number of local worker processes to use, one dataset (or file chunk) per process")
+
+    parser.add_option("--filesPerJob", dest="filesPerJob", action="store", type=int, 
+                      help="Split datasets into file chunks of this size when running with --workers")
+
+    parser.add_option("--entriesPerJob", dest="entriesPerJob", action="store", type=int, 
+                      help="Split datasets into entry ranges of this size when running with --workers (merged automatically)")
+
     parser.add_option("-i", "--includeOnlyTasks", dest="includeOnlyTasks", action="store", 
                       help="List of datasets in mcrab to include")
 
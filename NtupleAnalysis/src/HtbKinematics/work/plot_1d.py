@@ -424,7 +424,7 @@ def SavePlot(plot, saveName, saveDir, saveFormats = [".C", ".png", ".pdf"]):
             Print(saveNameURL, i==0)
         else:
             Print(savePath + ext, i==0)
-        plot.saveAs(savePath, formats=saveFormats)
+    plot.saveAs(savePath, formats=saveFormats)
     return
 
 
@@ -468,7 +468,7 @@ def SavePlot(plot, plotName, saveDir, saveFormats = [".png"]):
             print "\t", saveNameURL
         else:
             print "\t", saveName + ext
-        plot.saveAs(saveName, formats=saveFormats)
+    plot.saveAs(saveName, formats=saveFormats)
     return
 
 
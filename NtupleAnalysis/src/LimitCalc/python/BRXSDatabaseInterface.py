@@ -4,6 +4,7 @@ import sys
 import re
 from array import array
 import math
+import numpy
 
 import ROOT
 ROOT.gROOT.SetBatch(True)
@@ -14,6 +15,12 @@ uncert_missing2loopQCD = 0.02
 uncert_deltab          = 0.03
 uncert_missing_HO_tt   = 0.03
 
+# Columns of the sorted index of the in-memory column store (the first one is the primary key)
+_indexVariables = ["mHp", "mA", "tanb", "mu"]
+_identifier_re  = re.compile("[A-Za-z_][A-Za-z0-9_]*")
+_unsupported_re = re.compile("::|\?|\[|\^|!(?!=)|\$")
+_indexCut_re    = re.compile("^\s*(?P<variable>[A-Za-z_][A-Za-z0-9_]*)\s*(?P<op>==|>=|<=|>|<)\s*(?P<value>[-+]?[0-9.]+([eE][-+]?[0-9]+)?)\s*$")
+
 class BRXSDatabaseInterface:
     def __init__(self,rootfile, program="FeynHiggs", BRvariable= "BR_tHpb*BR_Hp_taunu", silentStatus=False):
         self.silentStatus = silentStatus
@@ -44,6 +51,12 @@ class BRXSDatabaseInterface:
             self.names.append(branch.GetName())
             self.variableDict[branch.GetName()] = variable
 
+        # In-memory column store, loaded on first use by _loadColumns()
+        self.columns     = None
+        self.indexOrder  = None
+        self.indexValues = None
+        self.compiledExpressions = {}
+
     def __delete__(self):
         self.close()
 
@@ -2146,6 +2159,14 @@ class BRXSDatabaseInterface:
             graph.SetPoint(i, mA, tanb)
         
     def getGraph(self,xVariable,yVariable,selection):
+        (x, y) = self.getArrays(xVariable,yVariable,selection)
+        if x is None:
+            return self.getGraphTreeDraw(xVariable,yVariable,selection)
+        if len(x) == 0:
+            raise Exception("Error: could not find graph!")
+        return ROOT.TGraph(len(x),array("d",x),array("d",y))
+
+    def getGraphTreeDraw(self,xVariable,yVariable,selection):
         graph = ROOT.TGraph()
         #print "check getGraph",xVariable,yVariable,selection,self.floatSelection(selection)
         self.tree.Draw(yVariable+":"+xVariable,self.floatSelection(selection))
@@ -2157,7 +2178,122 @@ class BRXSDatabaseInterface:
         #print "graph SORTED"
         #self.PrintGraph(graph)
         return graph
-        
+
+    def getArrays(self,xVariable,yVariable,selection):
+        """
+        Vectorized equivalent of TTree::Draw("y:x", selection) + TGraph::Sort()
+        on the in-memory column store. Returns a pair of numpy arrays sorted in x,
+        or (None, None) if one of the expressions can not be evaluated with numpy
+        (then the caller should fall back to TTree::Draw).
+        """
+        self._loadColumns()
+        rows = self._selectRows(self.floatSelection(selection))
+        if rows is None:
+            return (None, None)
+        x = self._evaluate(xVariable, rows)
+        y = self._evaluate(yVariable, rows)
+        if x is None or y is None:
+            return (None, None)
+        order = numpy.argsort(x, kind="mergesort")
+        return (x[order], y[order])
+
+    def _loadColumns(self):
+        """
+        Reads the whole tree once into numpy arrays (one per branch) and builds
+        a sorted index on (mHp, mA, tanb, mu). The column arrays are kept in
+        the tree order, the index is a permutation of the rows.
+        """
+        if self.columns is not None:
+            return
+        nentries = self.tree.GetEntries()
+        columns = {}
+        for name in self.names:
+            columns[name] = numpy.empty(nentries)
+        for i in xrange(nentries):
+            self.tree.GetEntry(i)
+            for name, variable in zip(self.names, self.variables):
+                columns[name][i] = variable[0]
+        self.columns = columns
+
+        keys = [columns[name] for name in reversed(_indexVariables) if name in columns]
+        if len(keys) > 0:
+            self.indexOrder  = numpy.lexsort(keys)
+            self.indexValues = columns[_indexVariables[0]][self.indexOrder] if _indexVariables[0] in columns else None
+        return
+
+    def _compile(self, expression, isSelection):
+        """
+        Translates a TTreeFormula expression to a numpy expression. The
+        selections are combinations of comparisons with && and ||, so the
+        comparisons are put into parentheses and the logical operators are
+        replaced by the element-wise ones. Returns None for expressions that
+        use anything else than branch names, numbers and operators.
+        """
+        key = (expression, isSelection)
+        if key in self.compiledExpressions:
+            return self.compiledExpressions[key]
+        code = None
+        if _unsupported_re.search(expression) is None:
+            names = [n for n in _identifier_re.findall(expression) if not re.match("[eE][0-9]*$", n)]
+            if all([n in self.columns for n in names]):
+                expr = expression
+                if isSelection:
+                    expr = "(" + expr.replace("||", ") | (").replace("&&", ") & (") + ")"
+                try:
+                    code = compile(expr, "<%s>" % expression, "eval")
+                except SyntaxError:
+                    code = None
+        self.compiledExpressions[key] = code
+        return code
+
+    def _evaluate(self, expression, rows, isSelection=False):
+        code = self._compile(expression, isSelection)
+        if code is None:
+            return None
+        namespace = {"__builtins__": {}}
+        for name in code.co_names:
+            if rows is None:
+                namespace[name] = self.columns[name]
+            else:
+                namespace[name] = self.columns[name][rows]
+        nrows = len(self.columns[self.names[0]]) if rows is None else len(rows)
+        return numpy.ones(nrows)*eval(code, namespace)
+
+    def _selectRows(self, selection):
+        """
+        Returns the sorted array of the row numbers passing the selection, or
+        None if the selection can not be evaluated with numpy. Cuts on the
+        primary index variable (mHp) are resolved with a binary search of the
+        index before the rest of the selection is evaluated as a mask.
+        """
+        rows = None
+        if self.indexValues is not None and selection.find("||") < 0:
+            lo = 0
+            hi = len(self.indexValues)
+            for cut in selection.split("&&"):
+                match = _indexCut_re.search(cut)
+                if not match or match.group("variable") != _indexVariables[0]:
+                    continue
+                value = float(match.group("value"))
+                op    = match.group("op")
+                if op in [">", "=="]:
+                    lo = max(lo, numpy.searchsorted(self.indexValues, value, side="right" if op == ">" else "left"))
+                if op == ">=":
+                    lo = max(lo, numpy.searchsorted(self.indexValues, value, side="left"))
+                if op in ["<", "=="]:
+                    hi = min(hi, numpy.searchsorted(self.indexValues, value, side="left" if op == "<" else "right"))
+                if op == "<=":
+                    hi = min(hi, numpy.searchsorted(self.indexValues, value, side="right"))
+            rows = numpy.sort(self.indexOrder[lo:max(lo, hi)])
+        if rows is None:
+            rows = numpy.arange(len(self.columns[self.names[0]]))
+        if selection.strip() == "":
+            return rows
+        mask = self._evaluate(selection, rows, isSelection=True)
+        if mask is None:
+            return None
+        return rows[mask != 0]
+
     def getExpLimit(self,selection):
 	selections = selection.split("&&")
 
@@ -1,67 +1,241 @@
-from FeynHiggsBRdata import *
+## \package BRdataInterface
+# Charged Higgs branching ratios from FeynHiggs
+#
+# The branching ratios are stored in FeynHiggsBRdata.npz as arrays on a
+# mHp x tanb x mu grid (generated on Fri Jul  8 10:43:28 2011 by
+# Top2HPlus using FeynHiggs 2.7.3 input,
+# http://cmsdoc.cern.ch/~slehti/Top2HPlus.git). The file is read on the
+# first use, so that importing this module (e.g. via crosssection.py)
+# is cheap. Invalid grid points have all values set to -1.
+
+import os
+import bisect
+import numpy
+
+## Name of the branching ratio table file
+dataFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), "FeynHiggsBRdata.npz")
+
+class BranchingRatio:
+    def __init__(self, BRt2bH, BRH2taunu, mA):
+        self.BRt2bH    = BRt2bH
+        self.BRH2taunu = BRH2taunu
+        self.mA        = mA
+
+## Branching ratio table
+#
+# The value arrays are indexed as [mHp][tanb][mu], the axes are sorted.
+class BRTable:
+    quantities = ["BRt2bH", "BRH2taunu", "mA"]
+
+    def __init__(self, fileName):
+        data = numpy.load(fileName)
+        self.mHp  = data["mHp"]
+        self.tanb = data["tanb"]
+        self.mu   = data["mu"]
+        self.values = {}
+        for name in self.quantities:
+            self.values[name] = data[name]
+        data.close()
+        self._mHpIndex  = dict((m, i) for i, m in enumerate(self.mHp.tolist()))
+        self._tanbIndex = dict((t, i) for i, t in enumerate(self.tanb.tolist()))
+        self._muIndex   = dict((m, i) for i, m in enumerate(self.mu.tolist()))
+        self.tanbList = self.tanb.tolist()
+
+    def getMHpIndex(self, mHp):
+        return self._mHpIndex[mHp]
+
+    def getTanbIndex(self, tanb):
+        return self._tanbIndex[tanb]
+
+    def getMuIndex(self, mu):
+        return self._muIndex[mu]
+
+    ## Return the values of a quantity as a function of tanb for given mHp and mu
+    def getTanbCurve(self, name, mHp, mu):
+        return self.values[name][self.getMHpIndex(mHp), :, self.getMuIndex(mu)]
+
+    ## Return the indices of the grid points of an axis for an array of values
+    def getAxisIndices(self, axis, values, axisName):
+        indices = numpy.clip(numpy.searchsorted(axis, values), 0, len(axis)-1)
+        notFound = axis[indices] != values
+        if numpy.any(notFound):
+            raise KeyError("%s = %s is not a grid point of the branching ratio table" % (axisName, numpy.asarray(values)[notFound].ravel()[0]))
+        return indices
+
+_table = None
+
+## Return the branching ratio table, reading it on the first call
+def getTable():
+    global _table
+    if _table == None:
+        _table = BRTable(dataFileName)
+    return _table
+
+## Convert a branching ratio table generated by Top2HPlus to the file format used here
+#
+# \param pyFileName   Generated python file defining hplusBranchingRatio[mHp][tanb][mu]
+# \param npzFileName  Output file (default: dataFileName)
+def convertGeneratedTable(pyFileName, npzFileName=None):
+    namespace = {}
+    execfile(pyFileName, namespace)
+    data = namespace["hplusBranchingRatio"]
+    mHps  = sorted(data.keys())
+    tanbs = sorted(data[mHps[0]].keys())
+    mus   = sorted(data[mHps[0]][tanbs[0]].keys())
+    arrays = {}
+    for name in BRTable.quantities:
+        arrays[name] = numpy.zeros((len(mHps), len(tanbs), len(mus)))
+    for i, mHp in enumerate(mHps):
+        for j, tanb in enumerate(tanbs):
+            for k, mu in enumerate(mus):
+                point = data[mHp][tanb][mu]
+                for name in BRTable.quantities:
+                    arrays[name][i, j, k] = getattr(point, name)
+    if npzFileName == None:
+        npzFileName = dataFileName
+    numpy.savez_compressed(npzFileName, mHp=numpy.array(mHps, dtype=float), tanb=numpy.array(tanbs, dtype=float), mu=numpy.array(mus, dtype=float), **arrays)
+
+## Return the sorted tanb values of the grid
+def getTanbValues(mHp):
+    table = getTable()
+    table.getMHpIndex(mHp)
+    return table.tanbList
 
 def getBR_top2bHp(mHp,tanb,mu):
-    return interpolate(mHp,tanb,mu).BRt2bH
+    return interpolateQuantity("BRt2bH",mHp,tanb,mu)
 
 def get_mA(mHp,tanb,mu):
-    return interpolate(mHp,tanb,mu).mA
+    return interpolateQuantity("mA",mHp,tanb,mu)
 
 def getBR_Hp2tau(mHp,tanb,mu):
-    return interpolate(mHp,tanb,mu).BRH2taunu
+    return interpolateQuantity("BRH2taunu",mHp,tanb,mu)
 
 def getDataPoint(mHp,tanb,mu):
-    return hplusBranchingRatio[mHp][tanb][mu]
+    table = getTable()
+    index = (table.getMHpIndex(mHp), table.getTanbIndex(tanb), table.getMuIndex(mu))
+    return BranchingRatio(*[float(table.values[name][index]) for name in BRTable.quantities])
 
 def interpolate(mHp,tanb,mu):
     return linearInterpolation(mHp,tanb,mu)
 
 def lowerTanBPoint(mHp,tanbRef,mu):
-    returnTanb = 0
-    for tanb in hplusBranchingRatio[mHp].keys():
-	if tanb == tanbRef:
-	    return tanb
-        if tanb > tanbRef: 
-	    return returnTanb
-	returnTanb = tanb
-    return 0
+    tanbs = getTanbValues(mHp)
+    i = bisect.bisect_right(tanbs, tanbRef)
+    if i == 0 or (i == len(tanbs) and tanbs[-1] != tanbRef):
+        return 0
+    return tanbs[i-1]
 
 def higherTanBPoint(mHp,tanbRef,mu):
-    if tanbRef < hplusBranchingRatio[mHp].keys()[0]:
-	return 0
-    for tanb in hplusBranchingRatio[mHp].keys():
-        if tanb >= tanbRef:
-            return tanb
-    return 0
+    tanbs = getTanbValues(mHp)
+    i = bisect.bisect_left(tanbs, tanbRef)
+    if i == 0 and tanbRef < tanbs[0] or i == len(tanbs):
+        return 0
+    return tanbs[i]
+
+## Interpolate quantities linearly in tanb for arrays of points
+#
+# \param mHp         mHp grid point(s)
+# \param tanb        tanb value(s)
+# \param mu          mu grid point(s)
+# \param quantities  List of quantities (BRt2bH, BRH2taunu, mA)
+#
+# The arguments are broadcast against each other. The tanb grid
+# interval of each point is found by bisection.
+#
+# \return list of arrays (one per quantity), 0 for tanb outside of the grid
+def interpolateArrays(mHp,tanb,mu,quantities=BRTable.quantities):
+    table = getTable()
+    (mHps, tanbs, mus) = numpy.broadcast_arrays(numpy.asarray(mHp, dtype=float), numpy.asarray(tanb, dtype=float), numpy.asarray(mu, dtype=float))
+    i = table.getAxisIndices(table.mHp, mHps, "mHp")
+    k = table.getAxisIndices(table.mu, mus, "mu")
+    axis = table.tanb
+    j = numpy.clip(numpy.searchsorted(axis, tanbs, side="right")-1, 0, len(axis)-2)
+    fraction = (tanbs - axis[j])/(axis[j+1] - axis[j])
+    outside = (tanbs < axis[0]) | (tanbs > axis[-1])
+    result = []
+    for name in quantities:
+        values = table.values[name]
+        interpolated = values[i, j, k] + (values[i, j+1, k] - values[i, j, k])*fraction
+        result.append(numpy.where(outside, 0.0, interpolated))
+    return result
+
+## Interpolate a quantity linearly in tanb
+#
+# \param name   Quantity (BRt2bH, BRH2taunu, mA)
+# \param mHp    mHp grid point
+# \param tanb   tanb value, or an array of tanb values
+# \param mu     mu grid point
+#
+# \return interpolated value (array for array input), 0 for tanb outside of the grid
+def interpolateQuantity(name,mHp,tanb,mu):
+    values = interpolateArrays(mHp,tanb,mu,[name])[0]
+    if values.ndim == 0:
+        return float(values)
+    return values
 
 def linearInterpolation(mHp,tanb,mu):
-    tanb1 = lowerTanBPoint(mHp,tanb,mu)
-    tanb2 = higherTanBPoint(mHp,tanb,mu)
-
-    if (tanb1 == 0 or tanb2 == 0 or tanb1 > int(tanb) or tanb2 < int(tanb)) :
-	return BranchingRatio(0,0,0)
-
-    fraction = 1
-    if tanb1 < tanb2:
-        fraction = (tanb - tanb1)/(tanb2 - tanb1)
-
-    point1 = hplusBranchingRatio[mHp][tanb1][mu]
-    point2 = hplusBranchingRatio[mHp][tanb2][mu]
-
-    newBRt2bH    = point1.BRt2bH + (point2.BRt2bH - point1.BRt2bH)*fraction
-    newBRH2taunu = point1.BRH2taunu + (point2.BRH2taunu - point1.BRH2taunu)*fraction
-    newmA        = point1.mA + (point2.mA - point1.mA)*fraction
-
-    return BranchingRatio(newBRt2bH,newBRH2taunu,newmA)
-
-def getTanb(mHp,mu,targetBRt2bH):
-    tanb = 20 # initial guess
-    BRt2bH = interpolate(mHp,tanb,mu).BRt2bH
-    while abs(BRt2bH - targetBRt2bH)/targetBRt2bH > 0.00001 and tanb < 219 :
-        tanb = tanb - 0.01*tanb*(BRt2bH - targetBRt2bH)/targetBRt2bH
-	BRt2bH = interpolate(mHp,tanb,mu).BRt2bH
-	#print targetBRt2bH,BRt2bH,tanb
-
-    return tanb
+    values = interpolateArrays(mHp,tanb,mu)
+    if values[0].ndim == 0:
+        values = [float(v) for v in values]
+    return BranchingRatio(*values)
+
+## BRt2bH as a function of tanb for one (mHp, mu), with memoized solutions
+class _TanbCurve:
+    def __init__(self, mHp, mu):
+        table = getTable()
+        self._tanb = table.tanb
+        self._BRt2bH = table.getTanbCurve("BRt2bH", mHp, mu)
+        # Segments between valid (non-negative) grid points
+        self._validSegment = (self._BRt2bH[:-1] >= 0) & (self._BRt2bH[1:] >= 0)
+        self._slope = numpy.sign(self._BRt2bH[1:] - self._BRt2bH[:-1])
+        self._roots = {}
+
+    ## Return list of (tanb, slope sign) where the interpolated BRt2bH crosses target
+    def getRoots(self, target):
+        if target in self._roots:
+            return self._roots[target]
+        d = self._BRt2bH - target
+        segments = numpy.nonzero(self._validSegment & (d[:-1]*d[1:] <= 0) & (d[:-1] != d[1:]))[0]
+        roots = []
+        for j in segments.tolist():
+            tanb = self._tanb[j] + (self._tanb[j+1] - self._tanb[j])*d[j]/(d[j] - d[j+1])
+            if len(roots) > 0 and roots[-1][0] == tanb:
+                continue # crossing exactly at a grid point
+            roots.append((float(tanb), int(self._slope[j])))
+        self._roots[target] = roots
+        return roots
+
+_tanbCurves = {}
+
+def _getTanbCurve(mHp,mu):
+    key = (mHp, mu)
+    curve = _tanbCurves.get(key, None)
+    if curve == None:
+        curve = _TanbCurve(mHp, mu)
+        _tanbCurves[key] = curve
+    return curve
+
+## Solve tanb for which the interpolated BRt2bH equals targetBRt2bH
+#
+# \param mHp           mHp grid point
+# \param mu            mu grid point
+# \param targetBRt2bH  Target value of BR(t->bH+)
+# \param tanbRef       Reference tanb, the solution closest to it is returned
+# \param increasing    True (False) to accept only solutions where BRt2bH
+#                      increases (decreases) with tanb, None for any
+#
+# The crossings are bracketed by the tanb grid intervals and solved
+# exactly on the linearly interpolated curve.
+#
+# \return tanb, or -1 if there is no solution
+def getTanb(mHp,mu,targetBRt2bH,tanbRef=20,increasing=True):
+    best = -1
+    for (tanb, slope) in _getTanbCurve(mHp, mu).getRoots(targetBRt2bH):
+        if increasing != None and (slope > 0) != increasing:
+            continue
+        if best < 0 or abs(tanb - tanbRef) < abs(best - tanbRef):
+            best = tanb
+    return best
 
 def main():
 #    print lowerTanBPoint(100,121.2,1000)
@@ -84,6 +84,12 @@ import tarfile
 
 import subprocess
 
+import threading
+
+import itertools
+
+import multiprocessing.pool
+
 
 
 import HiggsAnalysis.NtupleAnalysis.tools.multicrab as multicrab
@@ -698,6 +704,14 @@ class MultiCrabCombine(commonLimitTools.LimitMultiCrabBase):
 
         would be waste of resources and everybodys time.
 
+
+
+        With opts.workers > 1 the combine scripts of the mass points are
+
+        run concurrently on the local machine. The outputs are collected
+
+        in mass point order, so the results are identical to a serial run.
+
         '''
 
         #if not quietStatus:
@@ -726,39 +740,69 @@ class MultiCrabCombine(commonLimitTools.LimitMultiCrabBase):
 
         self._results = commonLimitTools.ResultContainer(self.opts.unblinded, self.dirname)
 
-        
 
-        # For-loop: All mass points to run combine on
 
-        for counter, mass in enumerate(self.massPoints, 1):
+        # Run the scripts in a thread pool (combine itself runs in subprocesses)
+
+        nWorkers = min(max(getattr(self.opts, "workers", 1), 1), len(self.massPoints))
 
-            msg = "{:<9} {:>3} {:<1} {:<3} {:<50}".format("Mass Point", "%i" % counter, "/", "%i:" % len(self.massPoints), "m = %s GeV" % mass)
+        pool = None
 
-            Print(ShellStyles.HighlightAltStyle() + msg + ShellStyles.NormalStyle(), counter==1)
+        if nWorkers > 1:
 
+            Verbose("Running combine for %d mass points with %d workers" % (len(self.massPoints), nWorkers), True)
 
+            pool = multiprocessing.pool.ThreadPool(nWorkers)
 
-            myResult = self.clsType.runCombine(mass)
+            myOutputs = pool.imap(self.clsType.runCombineScripts, self.massPoints)
 
-            if myResult.failed:
+        else:
 
-                if not quietStatus:
+            myOutputs = itertools.imap(self.clsType.runCombineScripts, self.massPoints)
 
-                    msg = "Fit failed for mass point %s, skipping ..." % mass
 
-                    Print(ShellStyles.WarningLabel()  + msg, True)
 
-            else:
+        try:
+
+            # For-loop: All mass points to run combine on
+
+            for counter, mass in enumerate(self.massPoints, 1):
+
+                msg = "{:<9} {:>3} {:<1} {:<3} {:<50}".format("Mass Point", "%i" % counter, "/", "%i:" % len(self.massPoints), "m = %s GeV" % mass)
+
+                Print(ShellStyles.HighlightAltStyle() + msg + ShellStyles.NormalStyle(), counter==1)
+
+
+
+                myResult = self.clsType.collectCombineResult(mass, myOutputs.next())
+
+                if myResult.failed:
 
-                self._results.append(myResult)
+                    if not quietStatus:
 
-                #msg = "Processed successfully mass point %s, the result is %s" % (mass,self._results.getResultString(mass)) 
+                        msg = "Fit failed for mass point %s, skipping ..." % mass
 
-                msg = "The result is %s" % (self._results.getResultString(mass))
+                        Print(ShellStyles.WarningLabel()  + msg, True)
 
-                if not quietStatus:
+                else:
 
-                    Print(ShellStyles.SuccessStyle() + msg + ShellStyles.NormalStyle(), False)
+                    self._results.append(myResult)
+
+                    #msg = "Processed successfully mass point %s, the result is %s" % (mass,self._results.getResultString(mass)) 
+
+                    msg = "The result is %s" % (self._results.getResultString(mass))
+
+                    if not quietStatus:
+
+                        Print(ShellStyles.SuccessStyle() + msg + ShellStyles.NormalStyle(), False)
+
+        finally:
+
+            if pool != None:
+
+                pool.terminate()
+
+                pool.join()
 
 
 
@@ -972,6 +1016,8 @@ class LHCTypeAsymptotic:
 
         self.signalInjectionScripts = {}
 
+        self._mlfitLock             = threading.Lock()
+
 
 
         self.configuration = {}
@@ -1632,9 +1678,41 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         '''
 
+        return self.collectCombineResult(mass, self.runCombineScripts(mass))
+
+
+
+
+
+    def runCombineScripts(self, mass):
+
+        '''
+
+        Run the combine scripts (limit, ML fit, significance) of a single mass point
+
+
+
+        The scripts of a mass point share the combined datacard and workspace
+
+        files, so they are run one after another. Different mass points can
+
+        be run concurrently from separate threads. Nothing is parsed here
+
+        (see collectCombineResult()).
+
+
+
+        \param mass   String for the mass point
+
+
+
+        \return Dictionary of script outputs (key is the script type)
+
+        '''
+
         Verbose("Running combine ...", False)
 
-        result = commonLimitTools.Result(mass)
+        outputs = {}
 
         if self.opts.limit:
 
@@ -1644,7 +1722,7 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
                 Verbose(msg, True)
 
-                self._runObservedAndExpected(result, mass)
+                outputs["limit"] = self._runObservedAndExpected(mass)
 
             else:
 
@@ -1652,11 +1730,7 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
                 Verbose(msg, True)
 
-                self._runBlinded(result, mass)
-
-        else:
-
-            Print(ShellStyles.WarningLabel() + "Skipping limit for mass point %s" % mass, True)
+                outputs["limit"] = self._runBlinded(mass)
 
 
 
@@ -1668,7 +1742,55 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         # xenios-2: What do we do here?
 
-        self._runSignificance(mass)
+        outputs["significance"] = self._runSignificance(mass)
+
+        return outputs
+
+
+
+
+
+    def collectCombineResult(self, mass, outputs):
+
+        '''
+
+        Collect the results of the combine scripts of a single mass point
+
+        
+
+        \param mass      String for the mass point
+
+
+
+        \param outputs   Dictionary returned by runCombineScripts()
+
+        
+
+        \return Result object containing the limits for the mass point
+
+        '''
+
+        result = commonLimitTools.Result(mass)
+
+        if self.opts.limit:
+
+            if self.opts.unblinded:
+
+                self._parseObservedAndExpected(result, mass)
+
+            else:
+
+                self._parseBlinded(result, mass)
+
+        else:
+
+            Print(ShellStyles.WarningLabel() + "Skipping limit for mass point %s" % mass, True)
+
+
+
+        if "significance" in outputs:
+
+            self._storeSignificance(mass, outputs["significance"])
 
         return result
 
@@ -1680,7 +1802,7 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         '''
 
-        Helper method to run a script
+        Helper method to run a script in the multicrab directory
 
         
 
@@ -1700,21 +1822,13 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         '''
 
-        pwd = os.getcwd()
-
-        os.chdir(self.dirname)
-
-        msg = "Changing directory to \"%s\". Current working directory is:\n\t\"%s\"" % (self.dirname, os.getcwd())
-
-        Verbose(msg, True)
-
-
+        # The working directory is given to the subprocess instead of changing it for the whole process (thread-safe)
 
         cmdList  = ["./" + script]
 
-        outFile  = os.path.join(os.getcwd(), outputFile)   
+        outFile  = os.path.join(self.dirname, outputFile)   
 
-        errFile  = os.path.join(os.getcwd(), errorFile)
+        errFile  = os.path.join(self.dirname, errorFile)
 
         fileMode = "wb"
 
@@ -1726,9 +1840,9 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         with open(outFile, fileMode) as out, open(errFile, fileMode) as err:
 
-            Verbose("Executing command \"%s\"" % (" ".join(cmdList)), True)
+            Verbose("Executing command \"%s\" in directory \"%s\"" % (" ".join(cmdList), self.dirname), True)
 
-            p = subprocess.Popen(cmdList, stdout=out, stderr=err)
+            p = subprocess.Popen(cmdList, stdout=out, stderr=err, cwd=self.dirname)
 
             output = p.communicate()[0]
 
@@ -1744,14 +1858,6 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
 
 
-        os.chdir(pwd)
-
-        msg = "Changed directory to \"%s\". Current working directory is:\n\t\"%s\"" % (pwd, os.getcwd())
-
-        Verbose(msg, True)
-
-
-
         if 0:
 
             f = open(outFile, fileMode)
@@ -1794,7 +1900,7 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
 
 
-    def _runObservedAndExpected(self, result, mass):
+    def _runObservedAndExpected(self, mass):
 
         '''
 
@@ -1802,17 +1908,31 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         
 
-        \param result  Result object to modify
-
         \param mass    String for the mass point
 
         '''
 
-        script = sel.obsAndExpScripts[mass]
+        script = self.obsAndExpScripts[mass]
+
+        return self._run(script, "obsAndExp_m%s_output.txt" % mass, "obsAndExp_m%s_stderr.txt" % mass)
+
+
+
 
-        output = self._run(script, "obsAndExp_m%s_output.txt"%mass)
 
+    def _parseObservedAndExpected(self, result, mass):
 
+        '''
+
+        Parse the observed and expected limits
+
+        
+
+        \param result  Result object to modify
+
+        \param mass    String for the mass point
+
+        '''
 
         n = self._parseResultFromCombineOutput(result, mass)
 
@@ -1836,7 +1956,7 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
     
 
-    def _runBlinded(self, result, mass):
+    def _runBlinded(self, mass):
 
         '''
 
@@ -1844,8 +1964,6 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         
 
-        \param result  Result object to modify
-
         \param mass    String for the mass point
 
         '''
@@ -1878,9 +1996,25 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         # Execute the shell script that runs combine
 
-        output = self._run(script, logFile, errFile)
+        return self._run(script, logFile, errFile)
+
+
+
 
 
+    def _parseBlinded(self, result, mass):
+
+        '''
+
+        Parse the expected limit
+
+        
+
+        \param result  Result object to modify
+
+        \param mass    String for the mass point
+
+        '''
 
         # Get the number of combine output results. Should be 5 or 6. The results are:
 
@@ -1914,7 +2048,11 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
             script = self.mlfitScripts[mass]
 
-            self._run(script, "mlfit_m_%s_output.txt" % mass)
+            # The ML fit scripts of all mass points update the same mlfit.json
+
+            with self._mlfitLock:
+
+                self._run(script, "mlfit_m_%s_output.txt" % mass, "mlfit_m_%s_stderr.txt" % mass)
 
         return
 
@@ -1924,6 +2062,20 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
     def _runSignificance(self, mass):
 
+        if mass in self.significanceScripts:
+
+            script = self.significanceScripts[mass]
+
+            return self._run(script, "signif_m_%s_output.txt" % mass, "signif_m_%s_stderr.txt" % mass)
+
+        return None
+
+
+
+
+
+    def _storeSignificance(self, mass, output):
+
         jsonFile = os.path.join(self.dirname, "significance.json")
 
 
@@ -1948,10 +2100,6 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         if mass in self.significanceScripts:
 
-            script = self.significanceScripts[mass]
-
-            output = self._run(script, "signif_m_%s_output.txt" % mass)
-
             result[mass] = parseSignificanceOutput(mass, outputString=output)
 
 
@@ -1964,6 +2112,8 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
 
 
+
+
     def writeMultiCrabConfig(self, opts, output, mass, inputFiles, njobs):
 
         if self.opts.injectSignal:
@@ -275,6 +275,8 @@ def createOptionParser(lepDefault=None, lhcDefault=None, lhcasyDefault=None, ful
                       help="minimum r parameter for finding limit")
     parser.add_option("--rmax", dest="rmax", action="store", default=None,
                       help="maximum r parameter for finding limit")
+    parser.add_option("--workers", dest="workers", type="int", default=1,
+                      help="Number of mass points to run combine for concurrently on the local machine (default: 1)")
 
     parser.add_option("--injectSignal", dest="injectSignal", action="store_true", default=False,
                       help="Inject signal (implied by --injectSignalBRTop and --injectSignalBRHplus)")
@@ -7,6 +7,8 @@ import os
 import sys
 import cProfile
 import json
+import cPickle
+import multiprocessing
 
 import HiggsAnalysis.NtupleAnalysis.tools.dataset as dataset
 import HiggsAnalysis.NtupleAnalysis.tools.counter as counter
@@ -55,7 +57,9 @@ class DatasetMgrCreatorManager:
             raise Exception(ShellStyles.ErrorLabel() + msg + ShellStyles.NormalStyle())
         self._toleranceForLuminosityDifference = config.ToleranceForLuminosityDifference
         self._optionDebugConfig = opts.debugConfig
+        self._opts = opts
         self._config = config
+        self._selection = None # (era, searchMode, optimizationMode) of the dsetMgrs
         return
 
     def Verbose(self, msg, printHeader=True):
@@ -100,6 +104,7 @@ class DatasetMgrCreatorManager:
         if len(self._dsetMgrs) > 0:
             msg = "The obtainDatasetMgrs() function has already been called before. The dsetMgrs exist!"
             raise Exception(ShellStyles.ErrorLabel() + msg + ShellStyles.NormalStyle())
+        self._selection = (era, searchMode, optimizationMode)
 
         # For-loop: All dset manager creators
         for i in range(0, len(self._dsetMgrCreators)):
@@ -144,6 +149,24 @@ class DatasetMgrCreatorManager:
         return
 
     
+    def createCopy(self):
+        '''
+        Creates a manager with its own dsetMgrs (and ROOT files) for the same era,
+        searchMode, and optimizationMode. Used in the worker processes of the
+        parallel data mining; the main counter tables are shared with this manager.
+        '''
+        if self._selection == None:
+            msg = "The function obtainDatasetMgrs() needs to be called first!"
+            raise Exception(ShellStyles.ErrorStyle() + msg + ShellStyles.NormalStyle())
+
+        for d in self._dsetMgrCreators:
+            if d != None:
+                d.reopenFiles()
+        myCopy = DatasetMgrCreatorManager(self._opts, self._config, *self._dsetMgrCreators, verbose=self._verbose)
+        myCopy.obtainDatasetMgrs(*self._selection)
+        myCopy._mainCounterTables = self._mainCounterTables
+        return myCopy
+
     def _getIntLumi(self, index, myDsetMgr):
         '''
         Determines the integrated luminosity of the datacard
@@ -341,6 +364,30 @@ class DatasetMgrCreatorManager:
                 self.Verbose(ShellStyles.ErrorStyle() + msg + ShellStyles.NormalStyle() )
         return
 
+#================================================================================================
+# Function definition (parallel data mining)
+#================================================================================================
+# Set by DataCardGenerator._doDataMiningParallel() for the (forked) worker processes
+_dataMiningGenerator = None
+_dataMiningTasks = None
+_dataMiningDsetMgrManager = None
+
+def _initDataMiningWorker():
+    '''
+    Creates the dataset managers of a worker process
+    '''
+    global _dataMiningDsetMgrManager
+    _dataMiningDsetMgrManager = _dataMiningGenerator._dsetMgrManager.createCopy()
+    return
+
+def _doDataMiningInWorker(index):
+    '''
+    Does the data mining for one datacard column, returns the pickled results
+    '''
+    (column, dsetMgrIndex) = _dataMiningTasks[index]
+    _dataMiningGenerator._doColumnDataMining(column, dsetMgrIndex, _dataMiningDsetMgrManager)
+    return cPickle.dumps(column.getDataMiningResults(), cPickle.HIGHEST_PROTOCOL)
+
 class DataCardGenerator:
     def __init__(self, opts, config, verbose=True, h2tb=False):
         self.verbose = verbose
@@ -736,33 +783,76 @@ class DataCardGenerator:
     def doDataMining(self):
         '''
         Do data mining and cache the results
+
+        With the option "jobs" > 1 the columns are mined in a pool of worker
+        processes, each with its own dataset managers. The results are
+        collected in the order of the columns, i.e. identical to a serial run.
         '''
         self.Verbose("Starting data mining")
 
+        # Columns to be mined together with the dset manager index
+        myTasks = []
         if self._dsetMgrManager.getDatasetMgr(DatacardDatasetMgrSourceType.SIGNALANALYSIS) != None:
             # Handle observation separately
-            myDsetMgr    = self._dsetMgrManager.getDatasetMgr(DatacardDatasetMgrSourceType.SIGNALANALYSIS)
-            myLuminosity = self._dsetMgrManager.getLuminosity(DatacardDatasetMgrSourceType.SIGNALANALYSIS)
-
-            myMainCounterTable = self._dsetMgrManager.getMainCounterTable(DatacardDatasetMgrSourceType.SIGNALANALYSIS)
-            self._observation.doDataMining(self._config, myDsetMgr, myLuminosity, myMainCounterTable, self._extractors, self._controlPlotExtractors)
+            myTasks.append( (self._observation, DatacardDatasetMgrSourceType.SIGNALANALYSIS) )
 
         # For-loop: All columns
-        for i, c in enumerate(self._columns, 1):
-            self.Verbose("Performing data-mining for column \"%s\"" % (c.getLabel()), i==1)
-
-            # Determine dset manager index for the given column
-            dsetMgrIndex = self._getDsetMgrIndexForColumnType(c)
+        for c in self._columns:
+            # Determine dset manager index for the given column (separately for data-driven bkgs)
+            myTasks.append( (c, self._getDsetMgrIndexForColumnType(c)) )
 
-            # Do mining for datacard columns (separately for data-driven bkgs)
-            myDsetMgr          = self._dsetMgrManager.getDatasetMgr(dsetMgrIndex)
-            myLuminosity       = self._dsetMgrManager.getLuminosity(dsetMgrIndex)
-            myMainCounterTable = self._dsetMgrManager.getMainCounterTable(dsetMgrIndex)
-            c.doDataMining(self._config, myDsetMgr, myLuminosity, myMainCounterTable, self._extractors, self._controlPlotExtractors)
+        myJobs = getattr(self._opts, "jobs", 1)
+        if myJobs != None and myJobs > 1 and len(myTasks) > 1:
+            self._doDataMiningParallel(myTasks, myJobs)
+        else:
+            for i, (c, dsetMgrIndex) in enumerate(myTasks, 1):
+                self.Verbose("Performing data-mining for column \"%s\"" % (c.getLabel()), i==1)
+                self._doColumnDataMining(c, dsetMgrIndex, self._dsetMgrManager)
 
         self.Verbose("Data mining has been finished, results (and histograms) have been ingeniously cached")
         return
 
+    def _doColumnDataMining(self, column, dsetMgrIndex, dsetMgrManager):
+        '''
+        Do data mining for one column with the dset manager of the given index
+        '''
+        myDsetMgr          = dsetMgrManager.getDatasetMgr(dsetMgrIndex)
+        myLuminosity       = dsetMgrManager.getLuminosity(dsetMgrIndex)
+        myMainCounterTable = dsetMgrManager.getMainCounterTable(dsetMgrIndex)
+        column.doDataMining(self._config, myDsetMgr, myLuminosity, myMainCounterTable, self._extractors, self._controlPlotExtractors)
+        return
+
+    def _doDataMiningParallel(self, tasks, jobs):
+        '''
+        Do data mining for the (column, dset manager index) tasks in a pool of worker processes
+        '''
+        global _dataMiningGenerator, _dataMiningTasks
+        myJobs = min(jobs, len(tasks))
+        self.Verbose("Performing data-mining for %d columns with %d processes" % (len(tasks), myJobs), True)
+
+        # The worker processes are forked, they see the columns and extractors through these
+        _dataMiningGenerator = self
+        _dataMiningTasks = tasks
+        pool = multiprocessing.Pool(myJobs, _initDataMiningWorker)
+        try:
+            myResults = pool.map(_doDataMiningInWorker, range(len(tasks)), 1)
+        finally:
+            pool.terminate()
+            pool.join()
+            _dataMiningGenerator = None
+            _dataMiningTasks = None
+
+        # Unpickle without attaching the histograms to the current directory
+        myAddDirectoryStatus = ROOT.TH1.AddDirectoryStatus()
+        ROOT.TH1.AddDirectory(False)
+        try:
+            for i in range(len(tasks)):
+                (c, dsetMgrIndex) = tasks[i]
+                c.setDataMiningResults(cPickle.loads(myResults[i]))
+        finally:
+            ROOT.TH1.AddDirectory(myAddDirectoryStatus)
+        return
+
     def separateMCEWKTausAndFakes(self, targetColumn, targetColumnNewName, addColumnList, subtractColumnList):
         # Obtain column for embedding
         myEmbColumn = None
@@ -26,6 +26,9 @@ from math import sqrt,pow
 from array import array
 
 _fineBinningSuffix = "_fineBinning"
+# Attributes of DatacardColumn set by doDataMining()
+_dataMiningAttributes = ["_rateResult", "_nuisanceResults", "_controlPlots",
+                         "_cachedShapeRootHistogramWithUncertainties", "_purityForFinalShape"]
 
 #================================================================================================
 # Class definition
@@ -1042,6 +1045,27 @@ class DatacardColumn():
             print "  nuisances:", self._nuisanceIds
         print "  shape histogram:", self.getFullShapeHistoName()
 
+    def getDataMiningResults(self):
+        '''
+        Returns the results cached by doDataMining() as a dictionary
+        (attribute name -> value), e.g. for sending them between processes
+        '''
+        myResults = {}
+        for item in _dataMiningAttributes:
+            if item in self.__dict__:
+                myResults[item] = self.__dict__[item]
+        return myResults
+
+    def setDataMiningResults(self, results):
+        '''
+        Sets the results of doDataMining() obtained with getDataMiningResults()
+        '''
+        for item in results.keys():
+            if item not in _dataMiningAttributes:
+                raise Exception("Unknown data mining result '%s' for data group '%s'!" % (item, self._label))
+            setattr(self, item, results[item])
+        return
+
     def doSeparateAdditionalResults(self):
         myNewNuisancesList = []
         myNewNuisanceIdsList = []
@@ -19,6 +19,188 @@ def Clone(obj, *args):
 _fineBinningSuffix = "_fineBinning"
 _originalDatacardDirectory = "originalDatacards"
 
+## Return the contents of a histogram as a tuple (for detecting modifications)
+def _histoFingerprint(h):
+    axis = h.GetXaxis()
+    l = [h.GetName(), h.GetNbinsX(), axis.GetXmin(), axis.GetXmax()]
+    for i in range(0, h.GetNbinsX()+2):
+        l.append(axis.GetBinLowEdge(i))
+        l.append(h.GetBinContent(i))
+        l.append(h.GetBinError(i))
+    return tuple(l)
+
+## Entry of HistogramCache
+class _HistogramCacheEntry:
+    def __init__(self, name, histo=None):
+        self.name = name
+        self.histo = histo # None until read from the file
+        self.fingerprint = None # Contents when read from the file
+
+## Indexed store of the shape histograms of a datacard
+#
+# Behaves like a list of histograms (iteration, len(), [i], del [i],
+# append(), remove()), and keeps in addition a name -> histogram index.
+# Histograms registered with addFromFile() are read from the shape ROOT
+# file only when they are accessed. Histograms in the cache are renamed
+# with rename(); after renaming them directly with SetName(), invalidate()
+# must be called, which makes the next lookup rebuild the name index.
+class HistogramCache:
+    def __init__(self, histograms=[]):
+        self._entries = []
+        self._index = {} # name -> _HistogramCacheEntry, None if it needs to be rebuilt
+        self._file = None
+        self._directory = None
+        self._modified = False
+        for h in histograms:
+            self.append(h)
+
+    ## Set the ROOT file (and directory in it) of the histograms added with addFromFile()
+    def setSourceFile(self, rootFile, directory):
+        self._file = rootFile
+        self._directory = directory
+
+    ## Register a histogram to be read lazily from the source file
+    def addFromFile(self, keyName):
+        entry = _HistogramCacheEntry(keyName)
+        self._entries.append(entry)
+        if self._index != None:
+            self._index[keyName] = entry
+
+    def _load(self, entry):
+        if entry.histo == None:
+            k = self._directory.GetListOfKeys().FindObject(entry.name)
+            if k == None:
+                raise Exception("Error: cannot find histo '%s' in root file '%s'!"%(entry.name, self._file.GetName()))
+            o = k.ReadObj()
+            o.SetName(k.GetName()) # The key has the correct name, but the histogram name might be something else
+            entry.histo = Clone(o)
+            entry.fingerprint = _histoFingerprint(entry.histo)
+        return entry.histo
+
+    ## Read all histograms not yet read from the source file
+    def loadAll(self):
+        for entry in self._entries:
+            self._load(entry)
+
+    ## Close the source file
+    #
+    # \param readHistograms   If True, histograms not yet read are read before closing
+    def closeFile(self, readHistograms=True):
+        if self._file == None:
+            return
+        if readHistograms:
+            self.loadAll()
+        self._file.Close()
+        self._file = None
+        self._directory = None
+
+    ## Mark the name index to be rebuilt (e.g. after renaming histograms with SetName())
+    def invalidate(self):
+        self._index = None
+
+    ## Rename a histogram in the cache
+    def rename(self, h, name):
+        index = self._getIndex()
+        entry = index.get(h.GetName(), None)
+        h.SetName(name)
+        if entry == None or entry.histo is not h:
+            self.invalidate()
+            return
+        del index[entry.name]
+        entry.name = name
+        index[name] = entry
+
+    def _getIndex(self):
+        if self._index == None:
+            self._index = {}
+            for entry in self._entries:
+                if entry.histo != None:
+                    entry.name = entry.histo.GetName()
+                self._index[entry.name] = entry
+        return self._index
+
+    def _findEntry(self, name):
+        return self._getIndex().get(name, None)
+
+    ## Return histogram by name, or None if not found
+    def get(self, name):
+        entry = self._findEntry(name)
+        if entry == None:
+            return None
+        return self._load(entry)
+
+    def has(self, name):
+        return self._findEntry(name) != None
+
+    ## Return the names of the histograms (without reading them)
+    def getNames(self):
+        self._getIndex()
+        return [entry.name for entry in self._entries]
+
+    ## Remove the histograms for which predicate(name) is true
+    #
+    # \return list of the removed histograms which had been read
+    def removeMatching(self, predicate):
+        index = self._getIndex()
+        keep = []
+        removed = []
+        for entry in self._entries:
+            if predicate(entry.name):
+                del index[entry.name]
+                if entry.histo != None:
+                    removed.append(entry.histo)
+                self._modified = True
+            else:
+                keep.append(entry)
+        self._entries = keep
+        return removed
+
+    ## Return True if histograms have been added, removed, renamed or their contents changed
+    def isModified(self):
+        if self._modified:
+            return True
+        for entry in self._entries:
+            if entry.histo != None and entry.fingerprint != _histoFingerprint(entry.histo):
+                return True
+        return False
+
+    def append(self, h):
+        entry = _HistogramCacheEntry(h.GetName(), h)
+        self._entries.append(entry)
+        if self._index != None:
+            self._index[entry.name] = entry
+        self._modified = True
+
+    def remove(self, h):
+        entry = self._findEntry(h.GetName())
+        if entry == None or entry.histo is not h:
+            entry = None
+            for e in self._entries:
+                if e.histo is h:
+                    entry = e
+        if entry == None:
+            raise ValueError("HistogramCache.remove(h): h not in cache")
+        del self[self._entries.index(entry)]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        self.loadAll()
+        return iter([entry.histo for entry in self._entries])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._load(entry) for entry in self._entries[i]]
+        return self._load(self._entries[i])
+
+    def __delitem__(self, i):
+        entry = self._entries[i]
+        del self._entries[i]
+        if self._index != None and self._index.get(entry.name, None) is entry:
+            del self._index[entry.name]
+        self._modified = True
+
 ### Get list of mass points
 #def getMassPoints(directory="."):
     ## Find out the mass points
@@ -114,7 +296,7 @@ class DataCardDirectoryManager:
                 for objectName in myList:
                     o = self._datacards[m].getRootFileObject(objectName)
                     if "_"+item+"Up" in o.GetName() or "_"+item+"Down" in o.GetName():
-                        o.SetName(o.GetName().replace(item, replaceDictionary[item]))
+                        dcard._hCache.rename(o, o.GetName().replace(item, replaceDictionary[item]))
 
     def removeStatUncert(self, signalOnly=False):
         for m in self._datacards.keys():
@@ -162,13 +344,8 @@ class DataCardDirectoryManager:
         for m in self._datacards.keys():
             dcard = self._datacards[m]
             # Remove histograms
-            i = 0
-            while i < len(dcard._hCache):
-                if "_"+name+"Up" in dcard._hCache[i].GetName() or "_"+name+"Down" in dcard._hCache[i].GetName():
-                    dcard._hCache[i].Delete()
-                    dcard._hCache.remove(dcard._hCache[i])
-                else:
-                    i += 1
+            for h in dcard._hCache.removeMatching(lambda hName: "_"+name+"Up" in hName or "_"+name+"Down" in hName):
+                h.Delete()
             # Remove nuisances
             i = 0
             while i < len(dcard._datasetNuisances):
@@ -269,12 +446,9 @@ class DataCardDirectoryManager:
         for m in self._datacards.keys():
             dcard = self._datacards[m]
             # Look for first item
-            targetIndex = None
-            for i in range(0,len(dcard._datasetNuisances)):
-                if dcard._datasetNuisances[i]["name"] == namesList[0]:
-                    if dcard._datasetNuisances[i]["distribution"] != "shape":
-                        raise Exception("Error: mergeShapeNuisances: nuisance '%s' is not a shape nuisance!"%namesList[0])
-                    targetIndex = i
+            targetIndex = dcard.getNuisanceIndex(namesList[0])
+            if targetIndex != None and dcard._datasetNuisances[targetIndex]["distribution"] != "shape":
+                raise Exception("Error: mergeShapeNuisances: nuisance '%s' is not a shape nuisance!"%namesList[0])
             # Do merge
             for item in namesList[1:]:
                 for i in range(0,len(dcard._datasetNuisances)):
@@ -459,7 +633,7 @@ class DataCardReader:
         self._outSuffix = outSuffix
         self._rootFilename = None
         self._datacardFilename = None
-        self._hCache = [] # Cache for persistent histograms
+        self._hCache = HistogramCache() # Cache for persistent histograms
         # DatacardInfo
         self._datacardColumnNames = [] # List of columns in datacard
         self._datacardBinName = None
@@ -468,6 +642,7 @@ class DataCardReader:
         self._observationValue = None
         self._rateValues = {} # Dictionary, where key is dataset name and value is a string of the rate value
         self._datasetNuisances = [] # List of dictionaries, where key is nuisance name
+        self._nuisanceIndex = {} # Nuisance name -> index in self._datasetNuisances
         
         self._silentStatus = silent
 
@@ -505,13 +680,20 @@ class DataCardReader:
             return False
         return True
 
+    ## Return the index of a nuisance in self._datasetNuisances, or None if not found
+    def getNuisanceIndex(self, nuisanceName):
+        i = self._nuisanceIndex.get(nuisanceName, None)
+        if i != None and i < len(self._datasetNuisances) and self._datasetNuisances[i]["name"] == nuisanceName:
+            return i
+        # The list has changed, rebuild the index
+        self._nuisanceIndex = {}
+        for i in range(len(self._datasetNuisances)):
+            self._nuisanceIndex.setdefault(self._datasetNuisances[i]["name"], i)
+        return self._nuisanceIndex.get(nuisanceName, None)
+
     def datasetHasNuisance(self, datasetName, nuisanceName, exceptionOnFail=False):
         self.hasDatasetByName(datasetName)
-        myFoundStatus = False
-        for nuisance in self._datasetNuisances:
-            if nuisanceName == nuisance["name"]:
-                myFoundStatus = True
-        if not myFoundStatus:
+        if self.getNuisanceIndex(nuisanceName) == None:
             if exceptionOnFail:
                 raise Exception("Dataset '%s' does not have nuisance '%s'!"%(datasetName,nuisanceName))
             return False
@@ -522,15 +704,13 @@ class DataCardReader:
         name = self.getHistoNameForColumn(datasetName)
         if fineBinned:
             name += _fineBinningSuffix
-        for item in self._hCache:
-            if item.GetName() == name:
-                return item # no clone should be returned
-        # Not found, strip directory
-        s = name.split("/")
-        shortName = s[len(s)-1]
-        for item in self._hCache:
-            if item.GetName() == shortName:
-                return item # no clone should be returned
+        item = self._hCache.get(name)
+        if item == None:
+            # Not found, strip directory
+            s = name.split("/")
+            item = self._hCache.get(s[len(s)-1])
+        if item != None:
+            return item # no clone should be returned
         if exceptionOnFail:
             raise Exception("Could not find histogram '%s'!"%name)
         return None
@@ -563,23 +743,8 @@ class DataCardReader:
             name = "%s_%s"%(datasetName, name) # bin-by-bin uncert. replicate the dataset name
         if fineBinned:
             name += _fineBinningSuffix
-        up = None
-        down = None
-        for item in self._hCache:
-            if item.GetName() == name+"Up":
-                up = item
-            elif item.GetName() == name+"Down":
-                down = item
-        if up == None and down == None:
-            # Not found, strip directory
-            s = name.split("/")
-            shortName = s[len(s)-1]
-            for item in self._hCache:
-                if item.GetName() == shortName:
-                    if item.GetName() == shortName+"Up":
-                        up = item
-                    elif item.GetName() == shortName+"Down":
-                        down = item    
+        up = self._hCache.get(name+"Up")
+        down = self._hCache.get(name+"Down")
         if up == None:
             if exceptionOnFail:
                 raise Exception("Could not find histogram '%s'!"%name+"Up")
@@ -604,27 +769,15 @@ class DataCardReader:
             myTestName = self.getHistoNameForNuisance(name, self._datasetNuisances[i][name])
             if myTestName != None:
                 # Remove shape histograms for the column
-                j = 0
-                while j < len(self._hCache):
-                    hName = self._hCache[j].GetName()
-                    if hName.startswith(myTestName):
-                        self._hCache[j].Delete()
-                        del self._hCache[j]
-                    else:
-                        j += 1
+                for h in self._hCache.removeMatching(lambda hName: hName.startswith(myTestName)):
+                    h.Delete()
                 if name in self._datasetNuisances[i].keys():
                     del self._datasetNuisances[i][name]
             i += 1
         # Remove rate histogram
         myTestName = self.getHistoNameForColumn(name)
-        j = 0
-        while j < len(self._hCache):
-            hName = self._hCache[j].GetName()
-            if hName.startswith(myTestName):
-                self._hCache[j].Delete()
-                del self._hCache[j]
-            else:
-                j += 1
+        for h in self._hCache.removeMatching(lambda hName: hName.startswith(myTestName)):
+            h.Delete()
         # Remove column from lists
         del self._rateValues[name]
         i = 0
@@ -699,8 +852,8 @@ class DataCardReader:
                 hSourceUp.Add(hTargetRate)
                 hSourceDown.Add(hTargetRate)
                 # Rename histograms
-                hSourceUp.SetName(self.getHistoNameForNuisance(targetName, nuisanceName+"Up"))
-                hSourceDown.SetName(self.getHistoNameForNuisance(targetName, nuisanceName+"Down"))
+                self._hCache.rename(hSourceUp, self.getHistoNameForNuisance(targetName, nuisanceName+"Up"))
+                self._hCache.rename(hSourceDown, self.getHistoNameForNuisance(targetName, nuisanceName+"Down"))
                 # Set active
                 nuisance[targetName] = "1"
                 #print "source shape", hSourceUp.Integral()/(sourceRate+targetRate),hSourceDown.Integral()/(sourceRate+targetRate)
@@ -863,7 +1016,7 @@ class DataCardReader:
                     o = self.getRootFileObject(objectName)
                     if self.getHistoNameForColumn(item) == objectName:
                         # Rate
-                        o.SetName(self.getHistoNameForColumn(replaceDictionary[item]))
+                        self._hCache.rename(o, self.getHistoNameForColumn(replaceDictionary[item]))
                     else:
                         # Shape nuisances (no stat)
                         for i in range(0,len(self._datasetNuisances)):
@@ -878,7 +1031,7 @@ class DataCardReader:
                                 #new2 = objectName.replace(self.getHistoNameForNuisance(item, self._datasetNuisances[i]["name"]),self.getHistoNameForNuisance(replaceDictionary[item], self._datasetNuisances[i]["name"]))
                                 #if item == "ttbb":
                                 #    print "***",objectName, "***", newName, "***", new2
-                                o.SetName(newName)
+                                self._hCache.rename(o, newName)
                         # stat nuisance FIXME: it seems that this does not work in all cases
                         #if "%s_%s"%(item,item) in objectName:
                             #name = objectName.replace(self.getHistoNameForNuisance(item, item),self.getHistoNameForNuisance(replaceDictionary[item], replaceDictionary[item]))
@@ -914,17 +1067,13 @@ class DataCardReader:
             else:
                 i += 1
         # Remove previous histograms from datacard
-        i = 0
-        while i < len(self._hCache):
-            histoName = self._hCache[i].GetName()
+        def isStatHisto(histoName):
             myStatus = True
             if signalOnly:
                 myStatus = self._datacardColumnNames[0] in histoName
-            if myStatus and "stat" in histoName or "Stat" in histoName:
-                self._hCache[i].Delete()
-                self._hCache.remove(self._hCache[i])
-            else:
-                i += 1
+            return myStatus and "stat" in histoName or "Stat" in histoName
+        for h in self._hCache.removeMatching(isStatHisto):
+            h.Delete()
 
     def recreateShapeStatUncert(self, signalOnly=False, threshold=0.001):
         # Remove previous entries from datacard
@@ -1140,26 +1289,22 @@ class DataCardReader:
         #print "***"
         #print myHistoNames
         #print self._rootFileDirectory
+        # The histograms are read from the file when they are first accessed,
+        # the file is kept open until then
+        self._hCache.setSourceFile(f, myDir)
         for name in myHistoNames:
             s = name.split("/")
             realName = s[len(s)-1]
             k = klist.FindObject(realName)
             if k == None:
                 raise Exception("Error: cannot find histo '%s' in root file '%s'!"%(name, self._rootFilename))
-            o = k.ReadObj()
-            o.SetName(k.GetName()) # The key has the correct name, but the histogram name might be something else
-            #print k.GetName()
-            self._hCache.append(Clone(o))
+            self._hCache.addFromFile(k.GetName())
         # Add also histogram for observation
         myDataName = self.getHistoNameForData()
         k = klist.FindObject(myDataName)
         if k == None:
             raise Exception("Error: cannot find histo '%s' in root file '%s'!"%(name, myDataName))
-        o = k.ReadObj()
-        o.SetName(k.GetName()) # The key has the correct name, but the histogram name might be something else
-        #print k.GetName()
-        self._hCache.append(Clone(o))
-        f.Close()
+        self._hCache.addFromFile(k.GetName())
         
         if not self._silentStatus:
             # Print stat.uncert.
@@ -1197,12 +1342,19 @@ class DataCardReader:
     
     def _writeRootFileContents(self):
         if self._readOnly:
+            self._hCache.closeFile()
             return
         myFilename = self._rootFilename
         if self._outSuffix != None:
             myFilename = myFilename.replace(".root","_%s.root"%self._outSuffix)
         if len(self._rootFileDirectory) > 0:
             myFilename = myFilename.replace(".root","_%s.root"%self._rootFileDirectory)
+        if os.path.abspath(myFilename) == os.path.abspath(self._rootFilename) and not self._hCache.isModified():
+            # Nothing to write back
+            self._hCache.closeFile(readHistograms=False)
+            self._hCache = HistogramCache()
+            return
+        self._hCache.closeFile() # reads all histograms, the output file may be the input file
         f = ROOT.TFile.Open(myFilename, "RECREATE")
         if f == None:
             raise Exception("Error opening file '%s'!"%self._rootFilename)
@@ -1211,21 +1363,21 @@ class DataCardReader:
             #print h.GetName()
         f.Write()
         f.Close()
-        self._hCache = []
+        self._hCache = HistogramCache()
 
     def getRootFileObjectsWithPattern(self, pattern):
         myOutList = []
-        for item in self._hCache:
-            if pattern in item.GetName():
-                myOutList.append(item.GetName())
+        for name in self._hCache.getNames():
+            if pattern in name:
+                myOutList.append(name)
         return myOutList
 
     def getRootFileObject(self, objectName):
-        for item in self._hCache:
-            if item.GetName() == objectName:
-                return item
-        for item in self._hCache:
-            print item.GetName()
+        item = self._hCache.get(objectName)
+        if item != None:
+            return item
+        for name in self._hCache.getNames():
+            print name
         print self._datacardColumnNames
         raise Exception("Error: Cannot find root object '%s' in root file '%s'!"%(objectName, self._rootFilename))
 
@@ -1463,7 +1615,7 @@ class DataCardReader:
             h.Delete()
             hlist.append(hnew)
         # Store
-        self._hCache = hlist[:]
+        self._hCache = HistogramCache(hlist)
 
     ## Add signal from another datacard (usecase: combination of inclusive signals for tan beta limits)
     def addSignal(self, reader):
@@ -17,6 +17,8 @@ _minBrTanBeta = 8.0
 _linearSummingForTheoryUncertainties = True # LHCHXSWG recommendation True
 _separateTheoreticalXsectionAndBrUncertainties = False # LHCHXSWG recommendation False (because of correlations)
 _modelPattern = "%s-LHCHXSWG.root"
+_modelTreeName = "FeynHiggs_results"
+_modelKeyPrecision = 4 # number of decimals used for matching mHp and tanb values in the model database
 _resultsPattern = "results-%s.txt"
 _resultKeys = ["observed",  "expected", "expectedPlus1Sigma", "expectedPlus2Sigma", "expectedMinus1Sigma", "expectedMinus2Sigma"]
 
@@ -264,12 +266,95 @@ class TanBetaResultContainer:
             else:
                 limit.doTanBetaPlotGeneric(myName, graphs, 19700, myFinalStateLabel, limit.mHplus(), self._mssmModel, regime="combination")
                                                                            
+## Lookup table for the contents of a MSSM model root file
+#
+# The FeynHiggs_results tree is read once into a dictionary keyed by the
+# rounded (mHp, tanb) values; the rows hold tHp_xsec and all BR_* branches.
+class ModelDatabase:
+    def __init__(self, filename):
+        self._filename = filename
+        self._rows = {} # key is (mHp, tanb) rounded, value is dictionary of branch values
+        self._tanbValues = set()
+        self._branchNames = []
+        self._read()
+
+    def getFilename(self):
+        return self._filename
+
+    def hasBranch(self, name):
+        return name in self._branchNames
+
+    def hasTanBeta(self, tanbeta):
+        return _makeModelKeyValue(tanbeta) in self._tanbValues
+
+    ## Returns dictionary of branch values for the point or None if the point does not exist
+    def getRow(self, mHp, tanbeta):
+        return self._rows.get((_makeModelKeyValue(mHp), _makeModelKeyValue(tanbeta)), None)
+
+    ## Returns list of rows (or None for missing points) for a list of (mHp, tanbeta) points
+    def getRows(self, points):
+        rows = self._rows
+        return [rows.get((_makeModelKeyValue(mHp), _makeModelKeyValue(tanbeta)), None) for (mHp, tanbeta) in points]
+
+    def _read(self):
+        if not os.path.exists(self._filename):
+            raise Exception("Error: The root file '%s' for the MSSM model does not exist in this directory!"%self._filename)
+        # Open root file and obtain tree
+        backup = ROOT.gErrorIgnoreLevel
+        ROOT.gErrorIgnoreLevel = ROOT.kError
+        f = ROOT.TFile.Open(self._filename)
+        ROOT.gErrorIgnoreLevel = backup
+        myTree = f.Get(_modelTreeName)
+        if myTree == None:
+            f.Close()
+            raise Exception("Error: Could not find tree '%s' in root file '%s'!"%(_modelTreeName, self._filename))
+        # Set branch adresses for reading (only double precision branches are stored)
+        myBuffers = {}
+        for branch in myTree.GetListOfBranches():
+            name = branch.GetName()
+            if name not in ["mHp", "tanb", "tHp_xsec"] and not name.startswith("BR_"):
+                continue
+            myLeaf = branch.GetLeaf(name)
+            if myLeaf == None or myLeaf.GetTypeName() != "Double_t":
+                continue
+            myBuffers[name] = array.array('d',[0])
+            myTree.SetBranchAddress(name, myBuffers[name])
+        for name in ["mHp", "tanb"]:
+            if not name in myBuffers.keys():
+                f.Close()
+                raise Exception("Error: Could not find branch by name '%s' in root tree '%s' in root file '%s'!"%(name, _modelTreeName, self._filename))
+        self._branchNames = myBuffers.keys()
+        # Loop over entries
+        myItems = myBuffers.items()
+        for i in xrange(myTree.GetEntries()):
+            myTree.GetEntry(i)
+            key = (_makeModelKeyValue(myBuffers["mHp"][0]), _makeModelKeyValue(myBuffers["tanb"][0]))
+            self._tanbValues.add(key[1])
+            # Keep the first matching entry like a sequential scan would do
+            if not key in self._rows:
+                self._rows[key] = dict([(name, buf[0]) for (name, buf) in myItems])
+        myTree.ResetBranchAddresses()
+        f.Close()
+
+def _makeModelKeyValue(value):
+    return round(float(value), _modelKeyPrecision)
+
+_modelDatabases = {} # key is root file name, value is ModelDatabase
+
+## Returns the lookup table for the given MSSM model (created on first call)
+def getModelDatabase(mssmModel):
+    myRootFilename = _modelPattern%mssmModel
+    if not myRootFilename in _modelDatabases.keys():
+        _modelDatabases[myRootFilename] = ModelDatabase(myRootFilename)
+    return _modelDatabases[myRootFilename]
+
 class BrContainer:
     def __init__(self, decayModeMatrix, mssmModel, massPoints=None):
         self._decayModeMatrix = decayModeMatrix
         self._mssmModel = mssmModel
         self._separateTheoreticalXsectionAndBrUncertainties = _separateTheoreticalXsectionAndBrUncertainties
         self._results = {} # dictionary, where key is tan beta
+        self._theoryRows = {} # lookup table rows read ahead by readFromDatabaseGrid(), key is the result key
         # Make dictionary of key labels
         self._brkeys = {}
         if decayModeMatrix != None:
@@ -297,78 +382,75 @@ class BrContainer:
     def _readFromDatabase(self, mHp, tanbeta):
         #if not os.path.exists(self._datacardPatterns[0]%mHp):
         #    raise Exception("Error: no support for template morphing between mass points; use one of the mass points!")
-        # Open model root file
-        myRootFilename = _modelPattern%self._mssmModel
-        if not os.path.exists(myRootFilename):
-            raise Exception("Error: The root file '%s' for the MSSM model does not exist in this directory!"%myRootFilename)
-        # Open root file and obtain branch
-        backup = ROOT.gErrorIgnoreLevel
-        ROOT.gErrorIgnoreLevel = ROOT.kError
-        f = ROOT.TFile.Open(myRootFilename)
-        ROOT.gErrorIgnoreLevel = backup
-        _treename = "FeynHiggs_results"
-        myTree = f.Get(_treename)
-        if myTree == None:
-            f.Close()
-            raise Exception("Error: Could not find tree '%s' in root file '%s'!"%(_treename, myRootFilename))
-        # Set branch adresses for reading
-        mHpInTree = array.array('d',[0])
-        tanbInTree = array.array('d',[0])
-        sigmaInTree = array.array('d',[0])
-        brTBHInTree = array.array('d',[0])
-        myTree.SetBranchAddress("mHp", mHpInTree)
-        myTree.SetBranchAddress("tanb", tanbInTree)
-        myTree.SetBranchAddress("tHp_xsec", sigmaInTree)
-        myTree.SetBranchAddress("BR_tHpb", brTBHInTree)
-        # Set branch adresses for branching keys
-        for brkey in self._brkeys.keys():
-            myBrLabel = "BR_%s"%brkey
-            if myTree.GetBranch(myBrLabel) == None:
-                raise Exception("Error: Could not find branch by name '%s' in root tree '%s' in root file '%s'!"%(myBrLabel, _treename, myRootFilename))
-            myTree.SetBranchAddress(myBrLabel, self._brkeys[brkey])
-        # Find values from root database
-        myTanBetaValueFoundStatus = False
-        myFoundMassStatus = False
-        i = 0
-        nentries = myTree.GetEntries()
-        while i < nentries and not myFoundMassStatus:
-            myTree.GetEvent(i)
-            if abs(tanbInTree[0] - float(tanbeta)) < 0.0001:
-                myTanBetaValueFoundStatus = True
-                if abs(mHpInTree[0] - float(mHp)) < 0.0001:
-                    myFoundMassStatus = True
-            i += 1
-        f.Close()
-        if not myTanBetaValueFoundStatus:
-            print "Warning: Could not find tan beta value %f in '%s'!"%(tanbeta, myRootFilename)
-        if not myFoundMassStatus:
-            print "Warning: Could not find mass value %s in '%s'!"%(mHp, myRootFilename)
-        # Found branching and sigma, store them
-        tblabel = constructResultKey(mHp, tanbeta)
-        if not tblabel in self._results.keys():
-            self._results[tblabel] = {}
-            self._results[tblabel]["combineResult"] = None
-        if not myTanBetaValueFoundStatus or not myFoundMassStatus:
-            for brkey in self._brkeys.keys():
-                self._results[tblabel]["%sTheory"%brkey] = None
-            self._results[tblabel]["sigmaTheory"] = None
-        else:
-            for brkey in self._brkeys.keys():
-                self._results[tblabel]["%sTheory"%brkey] = self._brkeys[brkey][0]
-            if float(mHp) > 179:
-                self._results[tblabel]
-                self._results[tblabel]["sigmaTheory"] = sigmaInTree[0]*2.0*0.001 # fb->pb; xsec is in database for only H+, factor 2 gives xsec for Hpm
+        self.readFromDatabaseBatch([(mHp, tanbeta)])
+
+    ## Reads the theoretical input for a list of (mHp, tanbeta) points at once
+    #
+    # The rows of all points are taken from the lookup table in one go
+    # (rows read ahead by readFromDatabaseGrid() are reused), and the
+    # results are filled in a single pass over the points.
+    def readFromDatabaseBatch(self, points):
+        myDatabase = self._getModelDatabase()
+        # Find values from lookup table
+        self._fetchRows(myDatabase, points)
+        myRows = [self._theoryRows[constructResultKey(mHp, tanbeta)] for (mHp, tanbeta) in points]
+        myBrItems = [(brkey, "BR_%s"%brkey, "%sTheory"%brkey) for brkey in self._brkeys.keys()]
+        for ((mHp, tanbeta), myRow) in zip(points, myRows):
+            myFoundMassStatus = myRow != None
+            if not myDatabase.hasTanBeta(tanbeta):
+                print "Warning: Could not find tan beta value %f in '%s'!"%(float(tanbeta), myDatabase.getFilename())
+            if not myFoundMassStatus:
+                print "Warning: Could not find mass value %s in '%s'!"%(mHp, myDatabase.getFilename())
+            # Found branching and sigma, store them
+            tblabel = constructResultKey(mHp, tanbeta)
+            if not tblabel in self._results:
+                self._results[tblabel] = {}
+                self._results[tblabel]["combineResult"] = None
+            myResult = self._results[tblabel]
+            s = "  - m=%s, tanbeta=%.1f: "%(mHp, float(tanbeta))
+            if not myFoundMassStatus:
+                for (brkey, branch, label) in myBrItems:
+                    myResult[label] = None
+                myResult["sigmaTheory"] = None
+                s += "Failed to found theor. input!"
             else:
-                self._results[tblabel]["sigmaTheory"] = brTBHInTree[0] # Br(t->bH+) for light H+
-        
-        s = "  - m=%s, tanbeta=%.1f: "%(mHp, float(tanbeta))
-        if not myTanBetaValueFoundStatus or not myFoundMassStatus:
-            s += "Failed to found theor. input!"
-        else:
-            s += "sigma_theor=%f pb"%(self._results[tblabel]["sigmaTheory"])
-            for brkey in self._brkeys.keys():
-                s += ", Br(%s)=%f"%(brkey, self._brkeys[brkey][0])
-        print s
+                for (brkey, branch, label) in myBrItems:
+                    self._brkeys[brkey][0] = myRow[branch]
+                    myResult[label] = myRow[branch]
+                if float(mHp) > 179:
+                    myResult["sigmaTheory"] = myRow["tHp_xsec"]*2.0*0.001 # fb->pb; xsec is in database for only H+, factor 2 gives xsec for Hpm
+                else:
+                    myResult["sigmaTheory"] = myRow["BR_tHpb"] # Br(t->bH+) for light H+
+                s += "sigma_theor=%f pb"%(myResult["sigmaTheory"])
+                for (brkey, branch, label) in myBrItems:
+                    s += ", Br(%s)=%f"%(brkey, myRow[branch])
+            print s
+
+    ## Reads ahead the lookup table rows for the full scan grid of masses x tanbeta values
+    #
+    # Only the rows are cached; the results of a point are filled (and
+    # resultExists() becomes true) when the point itself is read.
+    def readFromDatabaseGrid(self, massPoints, tanbetaValues):
+        self._fetchRows(self._getModelDatabase(), [(m, tb) for m in massPoints for tb in tanbetaValues])
+
+    def _getModelDatabase(self):
+        # Obtain lookup table for the model (the root file is read only once per process)
+        myDatabase = getModelDatabase(self._mssmModel)
+        for brkey in self._brkeys.keys():
+            if not myDatabase.hasBranch("BR_%s"%brkey):
+                raise Exception("Error: Could not find branch by name '%s' in root tree '%s' in root file '%s'!"%("BR_%s"%brkey, _modelTreeName, myDatabase.getFilename()))
+        return myDatabase
+
+    def _fetchRows(self, myDatabase, points):
+        myMissing = []
+        for (mHp, tanbeta) in points:
+            tblabel = constructResultKey(mHp, tanbeta)
+            if not tblabel in self._theoryRows and not (mHp, tanbeta) in myMissing:
+                myMissing.append((mHp, tanbeta))
+        if len(myMissing) == 0:
+            return
+        for ((mHp, tanbeta), myRow) in zip(myMissing, myDatabase.getRows(myMissing)):
+            self._theoryRows[constructResultKey(mHp, tanbeta)] = myRow
 
     def produceScaledCards(self, mHp, tanbeta):
         if self.resultExists(mHp, tanbeta):
@@ -372,6 +372,7 @@ if __name__ == "__main__":
     CTRLPLOTDEBUG = False
     PROFILERDEBUG = False
     VERBOSE       = False
+    JOBS          = 1
 
     # Object for selecting data eras, search modes, and optimization modes
     myModuleSelector = analysisModuleSelector.AnalysisModuleSelector() 
@@ -431,6 +432,9 @@ if __name__ == "__main__":
     parser.add_option("-v", "--verbose", dest="verbose", action="store_true", default=VERBOSE,
                       help="Print more information [default: %s]" % (VERBOSE) )
 
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=JOBS,
+                      help="Number of processes used for the data mining of the datacard columns [default: %s]" % (JOBS) )
+
     #parser.add_option("--QCDfactorised", dest="useQCDfactorised", action="store_true", default=False, 
     #                  help="Use factorised method for QCD measurement")
 
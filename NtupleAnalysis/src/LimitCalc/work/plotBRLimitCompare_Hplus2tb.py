@@ -465,7 +465,7 @@ def SavePlot(plot, saveDir, plotName, saveFormats = [".png", ".pdf"]):
             Verbose(saveNameURL, i==1)
         else:
             Verbose(saveName + ext, i==1)
-        plot.saveAs(saveName, formats=saveFormats)
+    plot.saveAs(saveName, formats=saveFormats)
     return
 
 
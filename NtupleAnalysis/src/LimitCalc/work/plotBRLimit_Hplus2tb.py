@@ -236,7 +236,7 @@ def SavePlot(plot, plotName, saveDir, saveFormats = [".png", ".pdf", ".C"]):
             print "\t", saveNameURL
         else:
             print "\t", saveName + ext
-        plot.saveAs(saveName, formats=saveFormats)
+    plot.saveAs(saveName, formats=saveFormats)
     return
 
 
@@ -180,12 +180,18 @@ def main(opts, brContainer, m, scen, plotContainers):
                     tb += 0.1
                 else:
                     tb += 1
+        # Read ahead the theoretical input of the known points at once
+        myMassPoints = [m]
+        if opts.gridRunAllMassesInOneJob:
+            myMassPoints = opts.masspoints[:]
         if len(myTanBetaValues) > 0:
             print "Considering tan beta values:", myTanBetaValues
+            brContainer.readFromDatabaseGrid(myMassPoints, myTanBetaValues)
             for tb in myTanBetaValues:
                 getCombineResultPassedStatus(opts, brContainer, m, tb, myKey, scen)
         else:
             if float(m) > 179:
+                brContainer.readFromDatabaseGrid(myMassPoints, [1.1, 1.2, 1.3, 1.4])
                 getCombineResultPassedStatus(opts, brContainer, m, 1.1, myKey, scen)
                 getCombineResultPassedStatus(opts, brContainer, m, 1.2, myKey, scen)
                 getCombineResultPassedStatus(opts, brContainer, m, 1.3, myKey, scen)
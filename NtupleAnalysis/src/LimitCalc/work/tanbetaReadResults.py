@@ -73,9 +73,11 @@ def produceOutputFromTaskDirs(massWhiteList, scenario, mAtanbetaStatus):
     brContainer = tbtools.BrContainer(decayModeMatrix=None, mssmModel=scenario)
     brContainer._results = myScenarioData
     # Obtain theoretical xsection values form database
+    myPoints = []
     for myKey in myScenarioData.keys():
         myKeyComponents = tbtools.disentangleResultKey(myKey)
-        brContainer._readFromDatabase(myKeyComponents["m"], myKeyComponents["tb"])
+        myPoints.append((myKeyComponents["m"], myKeyComponents["tb"]))
+    brContainer.readFromDatabaseBatch(myPoints)
     # Analyze and write
     myPlotContainer = tbtools.TanBetaResultContainer(scenario, myMassPoints)
     tbtools.analyzeTanbetaResults(brContainer, myPlotContainer, scenario, myMassPoints, myResultKeys, saveToDisk=True)
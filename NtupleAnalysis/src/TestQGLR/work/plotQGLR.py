@@ -242,7 +242,7 @@ def SavePlot(plot, saveName, saveDir, saveFormats = [".pdf"]):
             Print(saveNameURL, i==0)
         else:
             Print(savePath + ext, i==0)
-        plot.saveAs(savePath, formats=saveFormats)
+    plot.saveAs(savePath, formats=saveFormats)
     return
 
 
@@ -369,7 +369,7 @@ def SavePlot(plot, saveName, saveDir, saveFormats = [".pdf"]):
             Print(saveNameURL, i==0)
         else:
             Print(savePath + ext, i==0)
-        plot.saveAs(savePath, formats=saveFormats)
+    plot.saveAs(savePath, formats=saveFormats)
     return
 
 
@@ -410,7 +410,7 @@ def SavePlot(plot, saveName, saveDir, saveFormats = [".png"]):
             Print(saveNameURL, i==0)
         else:
             Print(savePath + ext, i==0)
-        plot.saveAs(savePath, formats=saveFormats)
+    plot.saveAs(savePath, formats=saveFormats)
     return
 
 
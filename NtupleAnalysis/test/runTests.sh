@@ -29,6 +29,15 @@ for i in $(find $HIGGSANALYSIS_BASE/NtupleAnalysis/src/*/python -name "*.py" | x
         RET=$FOO
     fi
 done
+# Unit tests under NtupleAnalysis/test
+for i in $(ls $HIGGSANALYSIS_BASE/NtupleAnalysis/test/test_*.py); do
+    echo $i
+    python $i
+    FOO=$?
+    if [ $RET = 0 -a $FOO != 0 ]; then
+        RET=$FOO
+    fi
+done
 
 echo
 echo
@@ -366,4 +366,53 @@ TEST_CASE("BTagSFCalculator works", "[EventSelection]") {
     // Check combined SF values
     CHECK( std::abs(p.calculateSF(jets, bjets) - sf) < 0.001 );
   }
+  SECTION("SF input as packed table") {
+    // Pack the btagSF rows into columns like scaleFactors.BtagSFPayloadTable.packRows() does
+    boost::property_tree::ptree table;
+    for (std::string column: {"jetFlavor", "ptMin", "ptMax", "sysType", "formula"}) {
+      boost::property_tree::ptree values;
+      for (auto& row: sfList) {
+        boost::property_tree::ptree value;
+        value.put("", row.second.get<std::string>(column));
+        values.push_back(std::make_pair("", value));
+      }
+      table.add_child(column, values);
+    }
+    boost::property_tree::ptree tableConfig = tmp;
+    tableConfig.erase("btagSF");
+    tableConfig.add_child("btagSFTable", table);
+    mgr.setEntry(0);
+    REQUIRE( coll.size() == 4 );
+    std::vector<Jet> jets = coll.toVector();
+    REQUIRE( jets.size() == 4 );
+    std::vector<Jet> jnull = { };
+    // The scale factors must be the same as with the row-wise input
+    for (std::string direction: {"nominal", "up", "down"}) {
+      tmp.put("btagSFVariationDirection", direction);
+      tmp.put("btagSFVariationInfo", "tag");
+      tableConfig.put("btagSFVariationDirection", direction);
+      tableConfig.put("btagSFVariationInfo", "tag");
+      ParameterSet psetRows(tmp, true, false);
+      ParameterSet psetTable(tableConfig, true, false);
+      BTagSFCalculator pRows(psetRows);
+      BTagSFCalculator pTable(psetTable);
+      pRows.bookHistograms(&dir, histoWrapper);
+      pTable.bookHistograms(&dir, histoWrapper);
+      for (auto flavor: {BTagSFInputStash::kBJet, BTagSFInputStash::kCJet, BTagSFInputStash::kGJet, BTagSFInputStash::kUDSJet}) {
+        CHECK( pTable.sizeOfSFList(flavor, direction) == pRows.sizeOfSFList(flavor, direction) );
+      }
+      for (auto& jet: jets) {
+        std::vector<Jet> j = { jet };
+        CHECK( pTable.calculateSF(j, jnull) == Approx(pRows.calculateSF(j, jnull)) );
+        CHECK( pTable.calculateSF(j, j) == Approx(pRows.calculateSF(j, j)) );
+      }
+      std::vector<Jet> bjets = { jets[0] };
+      CHECK( pTable.calculateSF(jets, bjets) == Approx(pRows.calculateSF(jets, bjets)) );
+    }
+    // All columns must have the same length
+    table.get_child("formula").push_back(std::make_pair("", table.get_child("formula").front().second));
+    tableConfig.put_child("btagSFTable", table);
+    ParameterSet psetBroken(tableConfig, true, false);
+    REQUIRE_THROWS_AS( BTagSFCalculator p(psetBroken), hplus::Exception );
+  }
 }
@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+
+import os
+import unittest
+import numpy
+
+from HiggsAnalysis.LimitCalc.BRdataInterface import lowerTanBPoint, higherTanBPoint, getTanb, getBR_top2bHp
+import HiggsAnalysis.LimitCalc.BRdataInterface as BRdataInterface
+
+from unittestTools import TemporaryDirectoryTestCase
+
+class TestBRdataInterface(TemporaryDirectoryTestCase):
+    def setUp(self):
+        TemporaryDirectoryTestCase.setUp(self)
+        self._backup = (BRdataInterface.dataFileName, BRdataInterface._table, BRdataInterface._tanbCurves)
+        tanbs = [1.0, 2.0, 5.0, 10.0, 20.0]
+        shape = (2, len(tanbs), 2)
+        BRt2bH = numpy.zeros(shape)
+        BRt2bH[:, :, :] = numpy.array([0.1, 0.05, 0.02, 0.04, 0.08]).reshape(1, len(tanbs), 1)
+        BRt2bH[0, 4, 1] = -1 # invalid point
+        BRdataInterface.dataFileName = os.path.join(self.directory, "BRdata.npz")
+        numpy.savez(BRdataInterface.dataFileName, mHp=numpy.array([80.0, 100.0]), tanb=numpy.array(tanbs), mu=numpy.array([-200.0, 200.0]),
+                    BRt2bH=BRt2bH, BRH2taunu=numpy.ones(shape), mA=numpy.zeros(shape))
+        BRdataInterface._table = None
+        BRdataInterface._tanbCurves = {}
+
+    def tearDown(self):
+        (BRdataInterface.dataFileName, BRdataInterface._table, BRdataInterface._tanbCurves) = self._backup
+        TemporaryDirectoryTestCase.tearDown(self)
+
+    def testLowerTanBPoint(self):
+        self.assertEqual(lowerTanBPoint(100, 0.5, 200), 0)
+        self.assertEqual(lowerTanBPoint(100, 1.0, 200), 1.0)
+        self.assertEqual(lowerTanBPoint(100, 3.0, 200), 2.0)
+        self.assertEqual(lowerTanBPoint(100, 5.0, 200), 5.0)
+        self.assertEqual(lowerTanBPoint(100, 20.0, 200), 20.0)
+        self.assertEqual(lowerTanBPoint(100, 25.0, 200), 0)
+
+    def testHigherTanBPoint(self):
+        self.assertEqual(higherTanBPoint(100, 0.5, 200), 0)
+        self.assertEqual(higherTanBPoint(100, 1.0, 200), 1.0)
+        self.assertEqual(higherTanBPoint(100, 3.0, 200), 5.0)
+        self.assertEqual(higherTanBPoint(100, 5.0, 200), 5.0)
+        self.assertEqual(higherTanBPoint(100, 20.0, 200), 20.0)
+        self.assertEqual(higherTanBPoint(100, 25.0, 200), 0)
+
+    def testUnknownMass(self):
+        self.assertRaises(KeyError, lowerTanBPoint, 90, 3.0, 200)
+
+    def testGetTanb(self):
+        self.assertAlmostEqual(getTanb(100, 200, 0.03), 7.5)
+        self.assertAlmostEqual(getTanb(100, 200, 0.03, increasing=False), 4.0)
+        self.assertAlmostEqual(getTanb(100, 200, 0.03, tanbRef=1, increasing=None), 4.0)
+        self.assertAlmostEqual(getTanb(100, 200, 0.03, tanbRef=10, increasing=None), 7.5)
+        self.assertAlmostEqual(getTanb(100, 200, 0.05, increasing=False), 2.0)
+        self.assertEqual(getTanb(100, 200, 0.5), -1)
+
+    def testGetTanbInvalidPoint(self):
+        self.assertAlmostEqual(getTanb(80, 200, 0.03), 7.5)
+        self.assertEqual(getTanb(80, 200, 0.06), -1)
+        self.assertAlmostEqual(getTanb(80, -200, 0.06), 15.0)
+
+    def testGetTanbConsistentWithInterpolation(self):
+        tanb = getTanb(100, 200, 0.03)
+        self.assertAlmostEqual(getBR_top2bHp(100, tanb, 200), 0.03)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+#! /usr/bin/env python
+
+import os
+import unittest
+
+from HiggsAnalysis.NtupleAnalysis.parameters.scaleFactors import BtagSFPayloadTable, loadBtagSFPayload
+import HiggsAnalysis.NtupleAnalysis.parameters.scaleFactors as scaleFactors
+
+from unittestTools import TemporaryDirectoryTestCase
+
+class TestBtagSFPayloadTable(TemporaryDirectoryTestCase):
+    def setUp(self):
+        TemporaryDirectoryTestCase.setUp(self)
+        self.fileName = self.writeFile("payload.csv",
+            "CSVv2,OperatingPoint, measurementType, sysType, jetFlavor, etaMin, etaMax, ptMin, ptMax, discrMin, discrMax, formula \n"
+            "0, comb, central,0,-2.4,2.4,30,670,0,1,0.9 ,\n"
+            "1, comb, central,0,-2.4,2.4,30,670,0,1,0.8 ,\n"
+            "0, comb, up,0,-2.4,2.4,30,670,0,1,1.0 ,\n"
+            "0, incl, central,2,-2.4,2.4,20,1000,0,1,0.7 ,\n"
+            "0, comb, central,1,-2.4,2.4,30,670,0,1,0.95 ,\n")
+
+    def testFromCsv(self):
+        table = BtagSFPayloadTable.fromCsv(self.fileName)
+        self.assertEqual(table.getAlgo(), "CSVv2")
+        rows = table.getFileRows()
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0], ("0", " comb", " central", 0, -2.4, 2.4, 30.0, 670.0, 0.0, 1.0, "0.9 "))
+
+    def testGetRows(self):
+        table = BtagSFPayloadTable.fromCsv(self.fileName)
+        rows = table.getFileRows()
+        self.assertEqual(table.getRows(), rows)
+        self.assertEqual(table.getRows(operatingPoint="0"), [rows[0], rows[2], rows[3], rows[4]])
+        self.assertEqual(table.getRows(operatingPoint="0", measurementType="comb", sysType="central"), [rows[0], rows[4]])
+        self.assertEqual(table.getRows(operatingPoint="0", jetFlavor=2), [rows[3]])
+        self.assertEqual(table.getRows(operatingPoint="2"), [])
+
+    def testPackRows(self):
+        table = BtagSFPayloadTable.fromCsv(self.fileName)
+        packed = table.packRows(table.getRows(operatingPoint="0", sysType="central"))
+        self.assertEqual(sorted(packed.keys()), sorted(BtagSFPayloadTable.packedColumns))
+        self.assertEqual(packed["jetFlavor"], [0, 2, 1])
+        self.assertEqual(packed["ptMin"], [30.0, 20.0, 30.0])
+        self.assertEqual(packed["ptMax"], [670.0, 1000.0, 670.0])
+        self.assertEqual(packed["sysType"], [" central", " central", " central"])
+        self.assertEqual(packed["etaMin"], [-2.4, -2.4, -2.4])
+        self.assertEqual(packed["formula"], ["0.9 ", "0.7 ", "0.95 "])
+        self.assertEqual(table.packRows([]), dict((c, []) for c in BtagSFPayloadTable.packedColumns))
+
+    def testLoadBtagSFPayload(self):
+        table = loadBtagSFPayload(self.fileName)
+        self.assertTrue(loadBtagSFPayload(self.fileName) is table)
+        self.assertTrue(os.path.exists(self.fileName+".cache"))
+        # Read from the binary cache
+        del scaleFactors._btagSFPayloadTables[self.fileName]
+        cached = loadBtagSFPayload(self.fileName)
+        self.assertFalse(cached is table)
+        self.assertEqual(cached.getAlgo(), table.getAlgo())
+        self.assertEqual(cached.getFileRows(), table.getFileRows())
+        del scaleFactors._btagSFPayloadTables[self.fileName]
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+
+import os
+import unittest
+
+from HiggsAnalysis.NtupleAnalysis.tools.plots import PlotManifest, plotManifestFileName, setForceRebuild, UnstableInputException
+import HiggsAnalysis.NtupleAnalysis.tools.plots as plots
+
+from unittestTools import TemporaryDirectoryTestCase
+
+class TestPlotManifest(TemporaryDirectoryTestCase):
+    def tearDown(self):
+        setForceRebuild(False)
+        TemporaryDirectoryTestCase.tearDown(self)
+
+    def testUpToDate(self):
+        manifest = PlotManifest(self.directory)
+        self.assertFalse(manifest.isUpToDate("foo", "abc", [".png"]))
+        self.writeFile("foo.png")
+        manifest.update("foo", "abc", [".png"])
+        self.assertTrue(manifest.isUpToDate("foo", "abc", [".png"]))
+        self.assertFalse(manifest.isUpToDate("foo", "def", [".png"]))
+        self.assertFalse(manifest.isUpToDate("foo", "abc", [".png", ".pdf"]))
+        self.assertFalse(manifest.isUpToDate("bar", "abc", [".png"]))
+
+    def testMissingFile(self):
+        manifest = PlotManifest(self.directory)
+        manifest.update("foo", "abc", [".png"])
+        self.assertFalse(manifest.isUpToDate("foo", "abc", [".png"]))
+
+    def testFormats(self):
+        manifest = PlotManifest(self.directory)
+        self.writeFile("foo.png")
+        self.writeFile("foo.pdf")
+        manifest.update("foo", "abc", [".png"])
+        manifest.update("foo", "abc", [".pdf"])
+        self.assertTrue(manifest.isUpToDate("foo", "abc", [".png", ".pdf"]))
+        # A new fingerprint invalidates the other formats
+        manifest.update("foo", "def", [".pdf"])
+        self.assertTrue(manifest.isUpToDate("foo", "def", [".pdf"]))
+        self.assertFalse(manifest.isUpToDate("foo", "def", [".png"]))
+
+    def testRemove(self):
+        manifest = PlotManifest(self.directory)
+        self.writeFile("foo.png")
+        manifest.update("foo", "abc", [".png"])
+        manifest.remove("foo")
+        self.assertFalse(manifest.isUpToDate("foo", "abc", [".png"]))
+
+    def testForceRebuild(self):
+        manifest = PlotManifest(self.directory)
+        self.writeFile("foo.png")
+        manifest.update("foo", "abc", [".png"])
+        setForceRebuild()
+        self.assertFalse(manifest.isUpToDate("foo", "abc", [".png"]))
+
+    def testSave(self):
+        fileName = os.path.join(self.directory, plotManifestFileName)
+        manifest = PlotManifest(self.directory)
+        manifest.save()
+        self.assertFalse(os.path.exists(fileName))
+        self.writeFile("foo.png")
+        manifest.update("foo", "abc", [".png"])
+        self.assertFalse(os.path.exists(fileName))
+        manifest.save()
+        self.assertTrue(os.path.exists(fileName))
+        self.assertTrue(PlotManifest(self.directory).isUpToDate("foo", "abc", [".png"]))
+        self.assertEqual(os.listdir(self.directory).count(plotManifestFileName), 1)
+        # Not rewritten if nothing has changed
+        os.remove(fileName)
+        manifest.save()
+        self.assertFalse(os.path.exists(fileName))
+
+    def testUnreadable(self):
+        self.writeFile(plotManifestFileName, "{foo")
+        self.writeFile("foo.png")
+        manifest = PlotManifest(self.directory)
+        self.assertFalse(manifest.isUpToDate("foo", "abc", [".png"]))
+        manifest.update("foo", "abc", [".png"])
+        manifest.save()
+        self.assertTrue(PlotManifest(self.directory).isUpToDate("foo", "abc", [".png"]))
+
+class TestCanonicalRepr(unittest.TestCase):
+    def testStable(self):
+        self.assertEqual(plots._canonicalRepr({"b": [1, 2.5], "a": None}), plots._canonicalRepr({"a": None, "b": [1, 2.5]}))
+        self.assertNotEqual(plots._canonicalRepr({"a": 1}), plots._canonicalRepr({"a": 2}))
+
+    def testUnstable(self):
+        class Foo:
+            pass
+        self.assertRaises(UnstableInputException, plots._canonicalRepr, [Foo()])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+## \package unittestTools
+# Helpers shared by the python unit tests in this directory
+#
+# The test modules are run as scripts (see runTests.sh), so this module
+# is imported from the directory of the test module.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+## Test case with a fresh temporary directory for each test
+#
+# The directory is available as self.directory, and is removed with
+# its contents after the test.
+class TemporaryDirectoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    ## Writes a file into the temporary directory
+    #
+    # \param name     Name of the file relative to the temporary directory
+    # \param content  Content of the file
+    #
+    # \return Path of the file
+    def writeFile(self, name, content=""):
+        path = os.path.join(self.directory, name)
+        f = open(path, "w")
+        f.write(content)
+        f.close()
+        return path